@@ -1,42 +1,35 @@
-from flask import Blueprint, request, jsonify
-import requests
+from flask import Blueprint, request, jsonify, stream_with_context
 from datetime import datetime
+from sqlalchemy import bindparam, case, select, update
 from models.book import Book
 from models.user import User
+from models.borrow_event import BORROW, RETURN, BorrowEvent
+from models.borrow_rollup import WINDOWS, advance_windows, top_books
 from models.base_model import db
 from flask import current_app as app
+from api.v1.peer_client import fan_out
+from api.v1.idempotency import idempotent, IDEMPOTENCY_HEADER
+from api.v1.schemas import (BookCreate, AddUserWebhook, UpdateBookWebhook, UpdateBooksWebhook,
+                            OverdueBooksWebhook, validate_payload)
+from config.read_replicas import read_only
+from config.unit_of_work import commit_or_defer, rollback_or_defer, transactional
+from api.v1.backend.exports import EXPORTS, FORMATS, export_columns, iter_export_rows, to_csv, to_ndjson
 
 
 backend_bp = Blueprint("backend_views", __name__, url_prefix="/api/v1/backend/admin")
 
+TOP_BOOKS_DEFAULT_LIMIT = 10
+TOP_BOOKS_MAX_LIMIT = 100
+
 @backend_bp.route('/books/add', methods=['POST'])
-def add_book():
+@validate_payload(BookCreate)
+def add_book(payload):
     '''
     Add a new book to the library and notify the frontend service
     '''
-    # Get data from the request
-    data = request.get_json()
-
-    # Validate the received data
-    if not data:
-        return jsonify({"message": "Invalid data format"}), 400
-
-    # Check if all necessary fields are provided
-    title = data.get('title')
-    publisher = data.get('publisher')
-    category = data.get('category')
-
-    missing_fields = []
-    if not title:
-        missing_fields.append('title')
-    if not publisher:
-        missing_fields.append('publisher')
-    if not category:
-        missing_fields.append('category')
-
-    if missing_fields:
-        return jsonify({"message": f"Missing required fields: {', '.join(missing_fields)}"}), 400
-    
+    # The payload has already been decoded and validated against BookCreate
+    title, publisher, category = payload.title, payload.publisher, payload.category
+
     # Check if the book with the same title already exists
     existing_book = Book.query.filter_by(title=title).first()
     if existing_book:
@@ -50,18 +43,19 @@ def add_book():
         book.save()
 
         # Notify the frontend service using a webhook (localhost)
-        frontend_update_url = 'http://frontend:5001/api/v1/frontend/webhooks/add-book'  # Change to your actual frontend port
-        payload = {'book_id': book.id, 'book_data': book.to_dict()}
+        webhook_path = '/api/v1/frontend/webhooks/add-book'
+        payload = {'book_id': book.id, 'book_data': book.to_payload()}
         
-        # Send book data as payload
-        response = requests.post(frontend_update_url, json=payload)
+        # Send book data as payload to every frontend subscriber, keyed so that a retried delivery is applied once
+        headers = {IDEMPOTENCY_HEADER: f'add-book:{book.id}'}
+        result = fan_out('FRONTEND_SERVICE_URL', webhook_path, payload, headers=headers)
 
-        # Check if the request to the frontend was successful
-        if response.status_code == 200:
+        # Check if every frontend subscriber accepted the update
+        if result.ok:
             return jsonify({"message": "Book added successfully and frontend updated"}), 201
         else:
-            # Handle non-successful responses from the frontend webhook
-            return jsonify({"message": f"Book added but failed to notify frontend: {response.text}"}), 500
+            # Handle the subscribers that failed or rejected the webhook
+            return jsonify({"message": f"Book added but failed to notify frontend: {result.describe_failures()}"}), 500
 
     except Exception as e:
         # Handle connection errors or other request exceptions
@@ -83,21 +77,24 @@ def remove_book(book_id):
         book.delete()
 
         # Notify the frontend service using a webhook
-        frontend_update_url = 'http://frontend:5001/api/v1/frontend/webhooks/remove-book'
+        webhook_path = '/api/v1/frontend/webhooks/remove-book'
         payload = {'book_id': book_id}
+        headers = {IDEMPOTENCY_HEADER: f'remove-book:{book_id}'}
 
-        response = requests.post(frontend_update_url, json=payload)
+        result = fan_out('FRONTEND_SERVICE_URL', webhook_path, payload, headers=headers)
 
-        # Check if the request to the frontend was successful
-        if response.status_code == 200:
+        # Check if every frontend subscriber was notified
+        if result.ok:
             return jsonify({"message": "Book removed successfully and frontend notified"}), 200
         else:
-            return jsonify({"message": f"Book removed but failed to notify frontend: {response.text}"}), 500
+            return jsonify({"message": f"Book removed but failed to notify frontend: "
+                                       f"{result.describe_failures()}"}), 500
 
     except Exception as e:
         return jsonify({"message": f"Error removing book: {str(e)}"}), 500
 
 @backend_bp.route('/users', methods=['GET'])
+@read_only
 def list_users():
     """
     Retrieve and return a list of all users without including details about borrowed books.
@@ -134,6 +131,7 @@ def list_users_with_books():
         return jsonify({"message": f"Error retrieving users with borrowed books: {str(e)}"}), 500
 
 @backend_bp.route('/books/unavailable', methods=['GET'])
+@read_only
 def list_unavailable_books():
     """
     Retrieve and return a list of books that are currently not available for borrowing.
@@ -155,41 +153,49 @@ def list_unavailable_books():
 
 
 
+@backend_bp.route('/export/<string:entity>', methods=['GET'])
+@read_only
+def export_entity(entity):
+    """
+    Stream a full export of users, books or unavailable books (with borrowers) for reporting.
+
+    Query parameter 'format' selects 'csv' (default) or 'ndjson'. Rows are streamed as they
+    are read, and gzip/brotli-compressed on the fly when the client accepts it.
+
+    :param entity: One of 'users', 'books' or 'unavailable-books'.
+    :return: Streamed CSV or NDJSON response.
+    """
+    if entity not in EXPORTS:
+        return jsonify({"message": f"Unknown export entity: {entity}"}), 404
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in FORMATS:
+        return jsonify({"message": f"Unsupported export format: {export_format}"}), 400
+
+    rows = iter_export_rows(entity, app.config['EXPORT_CHUNK_SIZE'], app.config['EXPORT_YIELD_PER'])
+    body = to_csv(rows, export_columns(entity)) if export_format == 'csv' else to_ndjson(rows)
+    response = app.response_class(stream_with_context(body), mimetype=FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename={entity}.{export_format}'
+    return response
+
+
 @backend_bp.route('/webhooks/add-user', methods=['POST'])
-def add_user_webhook():
+@transactional
+@idempotent
+@validate_payload(AddUserWebhook)
+def add_user_webhook(payload):
     """
     Webhook to handle new user enrollment notifications from the frontend service.
 
-    Expects JSON data with 'user_id' and 'user_data'.
-    Updates or creates the user in the backend database based on the received data.
+    Expects JSON data with 'user_id' and 'user_data' (decoded with AddUserWebhook,
+    dates included).
+    Creates the user, or updates it in place if it already exists, with a single upsert.
 
     :return: JSON response indicating success or failure.
     """
-    data = request.get_json()
-    user_data = data.get('user_data')
-    
-    if not user_data:
-        return jsonify({"message": "Missing user data"}), 400
-
-    user_id = user_data.get('id')
-    if not user_id:
-        return jsonify({"message": "Missing user ID"}), 400
-    
-    # Convert date strings to datetime objects
-    for date_field in ['created_at', 'updated_at']:
-        if user_data.get(date_field):
-            user_data[date_field] = datetime.fromisoformat(user_data[date_field])
-
-    # Check if the user already exists
-    user = User.query.get(user_id)
-    if user:
-        return jsonify({"message": "User already exists"}), 400
-    
-    # Create a new user
-    user = User(**user_data)
-    
     try:
-        user.save()
+        # Insert or update the user in one statement so redelivery is harmless
+        User.upsert(payload.user_data.values())
         return jsonify({"message": "User added successfully"}), 200
     except Exception as e:
         return jsonify({"message": f"Error processing user webhook: {str(e)}"}), 500
@@ -197,32 +203,141 @@ def add_user_webhook():
 
 
 @backend_bp.route('/webhooks/update-book', methods=['POST'])
-def update_book_webhook():
+@transactional
+@idempotent
+@validate_payload(UpdateBookWebhook)
+def update_book_webhook(payload):
     """
     Webhook to handle book updates from the frontend service.
 
-    Expects JSON data with 'book_id' and 'is_available'.
-    Updates the book's availability status based on the received data.
+    Expects JSON data with 'book_id', 'is_available' and optionally 'occurred_at'.
+    Updates the book's availability status with a single UPDATE statement, and
+    appends the borrow or return to the borrow event log.
+
+    :return: JSON response indicating success or failure.
+    """
+    book_id, is_available = payload.book_id, payload.is_available
+
+    try:
+        # Update the book's availability status without loading the row first
+        updated = Book.query.filter_by(id=book_id).update(
+            {'is_available': is_available, 'updated_at': datetime.utcnow()}, synchronize_session=False)
+        commit_or_defer()
+    except Exception as e:
+        rollback_or_defer()
+        return jsonify({"message": f"Error processing book update webhook: {str(e)}"}), 500
+
+    if not updated:
+        return jsonify({"message": "Book not found in backend database"}), 404
+
+    try:
+        # Statistics must not fail the status update; a failed record only rolls back its savepoint
+        BorrowEvent.record([book_id], RETURN if is_available else BORROW, payload.occurred_at or None)
+    except Exception as e:
+        app.logger.error('Failed to record borrow event for book %s: %s', book_id, e)
+    return jsonify({"message": "Book status updated successfully"}), 200
+
+
+@backend_bp.route('/webhooks/update-books', methods=['POST'])
+@transactional
+@idempotent
+@validate_payload(UpdateBooksWebhook)
+def update_books_webhook(payload):
+    """
+    Webhook to handle coalesced book updates from the frontend service.
+
+    Expects JSON data with 'updates', a list of objects with 'book_id', the latest
+    'is_available' and the 'borrowed_at'/'returned_at' times merged into it.
+    Applies every book's latest availability with a single UPDATE ... CASE statement,
+    and appends all merged borrows and returns to the borrow event log in one batch.
+    Unknown books are skipped and reported.
+
+    :return: JSON response indicating success or failure.
+    """
+    # The last update of a book wins if the batch holds it twice
+    updates = {book_update.book_id: book_update for book_update in payload.updates}
+    books_table = Book.__table__
+
+    try:
+        found = set(db.session.scalars(select(books_table.c.id).where(books_table.c.id.in_(list(updates)))))
+        if found:
+            db.session.execute(
+                update(books_table)
+                .where(books_table.c.id.in_(list(found)))
+                .values(is_available=case({book_id: updates[book_id].is_available for book_id in found},
+                                          value=books_table.c.id),
+                        updated_at=datetime.utcnow()))
+        commit_or_defer()
+    except Exception as e:
+        rollback_or_defer()
+        return jsonify({"message": f"Error processing book updates webhook: {str(e)}"}), 500
+
+    events = [(book_id, event_type, occurred_at) for book_id in found
+              for event_type, times in ((BORROW, updates[book_id].borrowed_at), (RETURN, updates[book_id].returned_at))
+              for occurred_at in times]
+    try:
+        # Statistics must not fail the status updates; a failed record only rolls back its savepoint
+        BorrowEvent.record_many(events)
+    except Exception as e:
+        app.logger.error('Failed to record %d borrow events: %s', len(events), e)
+    return jsonify({"message": "Book statuses updated successfully", "updated": len(found),
+                    "missing": sorted(set(updates) - found)}), 200
+
+
+@backend_bp.route('/webhooks/overdue-books', methods=['POST'])
+@transactional
+@idempotent
+@validate_payload(OverdueBooksWebhook)
+def overdue_books_webhook(payload):
+    """
+    Webhook to handle overdue loan notifications from the frontend's overdue sweeper.
+
+    Expects JSON data with 'books', a list of objects with 'book_id' and 'return_by'.
+    Marks all listed books as borrowed with their due date in one bulk UPDATE.
 
     :return: JSON response indicating success or failure.
     """
-    data = request.get_json()
-    book_id = data.get('book_id')
-    is_available = data.get('is_available')
-
-    if not book_id or is_available is None:
-        return jsonify({"message": "Missing book ID or availability status"}), 400
-
-    # Check if the book exists in the backend database
-    book = Book.query.get(book_id)
-
-    if book:
-        try:
-            # Update the book's availability status
-            book.is_available = is_available
-            book.save()
-            return jsonify({"message": "Book status updated successfully"}), 200
-        except Exception as e:
-            return jsonify({"message": f"Error processing book update webhook: {str(e)}"}), 500
-    else:
-        return jsonify({"message": "Book not found in backend database"}), 404
\ No newline at end of file
+    books = payload.books
+
+    try:
+        # Bulk UPDATE by primary key, executed as a single executemany; unknown IDs are skipped
+        books_table = Book.__table__
+        stmt = (update(books_table)
+                .where(books_table.c.id == bindparam('book_id'))
+                .values(is_available=False, return_by=bindparam('due'), updated_at=datetime.utcnow()))
+        db.session.execute(stmt, [{'book_id': book.book_id, 'due': book.return_by} for book in books])
+        commit_or_defer()
+        app.logger.info('Received %d overdue loans', len(books))
+        return jsonify({"message": "Overdue books recorded successfully"}), 200
+    except Exception as e:
+        rollback_or_defer()
+        return jsonify({"message": f"Error processing overdue books webhook: {str(e)}"}), 500
+
+
+@backend_bp.route('/stats/top-books', methods=['GET'])
+@transactional
+def top_books_stats():
+    """
+    Return the most borrowed books of a recent window.
+
+    Query parameters: 'window' (one of 1d, 7d, 30d; default 7d) and 'limit'.
+    Served from per-window counts that borrows update incrementally, so the cost
+    does not grow with the event history.
+
+    :return: JSON response with the window and its books, most borrowed first.
+    """
+    window = request.args.get('window', '7d')
+    if window not in WINDOWS:
+        return jsonify({"message": f"window should be one of {', '.join(WINDOWS)}"}), 400
+    limit = request.args.get('limit', TOP_BOOKS_DEFAULT_LIMIT, type=int)
+    if not 1 <= limit <= TOP_BOOKS_MAX_LIMIT:
+        return jsonify({"message": f"limit should be between 1 and {TOP_BOOKS_MAX_LIMIT}"}), 400
+
+    # Drop the days that left the window since the last borrow
+    advance_windows(datetime.utcnow().date())
+    top = top_books(WINDOWS[window], limit)
+    titles = dict(db.session.query(Book.id, Book.title).filter(Book.id.in_([book_id for book_id, _ in top])))
+    return jsonify({
+        "window": window,
+        "books": [{"book_id": book_id, "title": titles.get(book_id), "borrows": borrows} for book_id, borrows in top],
+    }), 200
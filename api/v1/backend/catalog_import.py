@@ -0,0 +1,158 @@
+import csv
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+import click
+from sqlalchemy import insert, select
+from models.book import Book
+from models.base_model import db
+from api.v1.peer_client import fan_out
+from api.v1.idempotency import IDEMPOTENCY_HEADER
+
+REQUIRED_FIELDS = ('title', 'publisher', 'category')
+ADD_BOOKS_WEBHOOK_PATH = '/api/v1/frontend/webhooks/add-books'
+
+
+def read_records(path, file_format):
+    """
+    Stream book records from a CSV or NDJSON file, one dictionary at a time.
+
+    :param path: Path of the file
+    :param file_format: 'csv' or 'ndjson'
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunked(records, size):
+    """Group an iterable into lists of at most `size` items."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_chunk(records):
+    """
+    Insert the new books of one chunk in a single transaction.
+
+    Records missing a required field, titles already in the catalog (one indexed
+    IN query per chunk) and titles repeated within the chunk are skipped.
+
+    :param records: List of record dictionaries
+    :return: Tuple of (inserted rows, number of skipped records)
+    """
+    valid = [record for record in records if all(record.get(field) for field in REQUIRED_FIELDS)]
+    titles = {record['title'] for record in valid}
+    existing = set(db.session.scalars(select(Book.title).where(Book.title.in_(titles))))
+
+    now = datetime.utcnow()
+    rows = []
+    for record in valid:
+        if record['title'] in existing:
+            continue
+        existing.add(record['title'])
+        rows.append({'id': str(uuid.uuid4()), 'title': record['title'], 'publisher': record['publisher'],
+                     'category': record['category'], 'is_available': True, 'created_at': now, 'updated_at': now})
+
+    try:
+        if rows:
+            # Core executemany: no ORM objects, one round trip per chunk
+            db.session.execute(insert(Book.__table__), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return rows, len(records) - len(rows)
+
+
+def publish_books(rows):
+    """
+    Publish a batch of newly imported books to the batch webhook of every frontend subscriber.
+
+    :param rows: Inserted book rows
+    :return: True if every subscriber accepted the batch
+    """
+    books = [{**row, 'created_at': row['created_at'].replace(tzinfo=timezone.utc),
+              'updated_at': row['updated_at'].replace(tzinfo=timezone.utc)} for row in rows]
+    headers = {IDEMPOTENCY_HEADER: f"add-books:{rows[0]['id']}:{rows[-1]['id']}"}
+    return fan_out('FRONTEND_SERVICE_URL', ADD_BOOKS_WEBHOOK_PATH, {'books': books}, headers=headers).ok
+
+
+def publish_with_retry(app, rows, retries, backoff):
+    """
+    Publish a batch of imported books, retrying with exponential backoff.
+
+    Every attempt carries the same Idempotency-Key, so subscribers that already
+    took the batch replay their response instead of applying it again.
+
+    :param app: Flask application instance, for logging
+    :param rows: Inserted book rows
+    :param retries: Attempts after the first one
+    :param backoff: Seconds before the first retry, doubled for each further one
+    :return: True if every subscriber accepted the batch
+    """
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            if publish_books(rows):
+                return True
+            app.logger.warning('Publishing imported books failed (attempt %d of %d)', attempt + 1, retries + 1)
+        except Exception as e:
+            app.logger.warning('Publishing imported books failed (attempt %d of %d): %s', attempt + 1, retries + 1, e)
+    return False
+
+
+def register_import_command(app):
+    """
+    Register `flask import-books` on the app.
+
+    :param app: Flask application instance
+    """
+    @app.cli.command('import-books')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'file_format', type=click.Choice(['csv', 'ndjson']),
+                  help='File format (defaults to the file extension).')
+    @click.option('--chunk-size', default=5000, show_default=True, help='Rows inserted per transaction.')
+    @click.option('--publish/--no-publish', default=True, show_default=True,
+                  help='Publish imported books to the frontend.')
+    @click.option('--publish-retries', default=3, show_default=True, help='Retries of a batch the frontend rejected.')
+    @click.option('--retry-backoff', default=1.0, show_default=True,
+                  help='Seconds before the first retry, doubled for each further one.')
+    def import_books(path, file_format, chunk_size, publish, publish_retries, retry_backoff):
+        """
+        Bulk import books from a CSV or NDJSON file with title, publisher and category.
+
+        Exits non-zero if a batch could still not be published after its retries.
+        """
+        file_format = file_format or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        started = time.perf_counter()
+        imported = skipped = failed_batches = 0
+
+        for records in chunked(read_records(path, file_format), chunk_size):
+            rows, chunk_skipped = import_chunk(records)
+            imported += len(rows)
+            skipped += chunk_skipped
+
+            if publish and rows and not publish_with_retry(app, rows, publish_retries, retry_backoff):
+                failed_batches += 1
+                app.logger.error('Failed to publish %d imported books, from %s to %s', len(rows),
+                                 rows[0]['title'], rows[-1]['title'])
+
+            elapsed = time.perf_counter() - started
+            click.echo(f'{imported} imported, {skipped} skipped, {(imported + skipped) / elapsed:.0f} rows/s')
+
+        click.echo(f'Done: {imported} imported, {skipped} skipped in {time.perf_counter() - started:.1f}s')
+        if failed_batches:
+            raise click.ClickException(f'{failed_batches} batches could not be published to the frontend')
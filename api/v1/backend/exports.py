@@ -0,0 +1,105 @@
+import csv
+import io
+import json
+from datetime import datetime
+from sqlalchemy import select
+from models.book import Book
+from models.user import User
+from models.base_model import db
+
+books_table = Book.__table__
+users_table = User.__table__
+
+# Entity name -> (key column used to page through it, select statement)
+EXPORTS = {
+    'users': (users_table.c.id, select(users_table)),
+    'books': (books_table.c.id, select(books_table)),
+    'unavailable-books': (books_table.c.id, select(
+        books_table,
+        users_table.c.email.label('borrower_email'),
+        users_table.c.firstname.label('borrower_firstname'),
+        users_table.c.lastname.label('borrower_lastname'),
+    ).select_from(books_table.outerjoin(users_table, books_table.c.borrowed_by_id == users_table.c.id))
+     .where(books_table.c.is_available.is_(False))),
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_columns(entity):
+    """Get the column names of an export entity, in export order."""
+    return [column.name for column in EXPORTS[entity][1].selected_columns]
+
+
+def iter_export_rows(entity, chunk_size, yield_per):
+    """
+    Stream the rows of an export entity with constant memory.
+
+    Rows are read in key-ordered chunks, each in its own short read transaction
+    streamed through a server-side cursor, so a long export never pins a
+    transaction (or, on SQLite, a read lock) for its whole duration.
+
+    :param entity: Key of EXPORTS
+    :param chunk_size: Rows read per transaction
+    :param yield_per: Rows fetched per round trip from the server-side cursor
+    :return: Generator of (column names, row mapping) for every row
+    """
+    key, stmt = EXPORTS[entity]
+    columns = export_columns(entity)
+    last_key = None
+    while True:
+        chunk_stmt = stmt.order_by(key).limit(chunk_size)
+        if last_key is not None:
+            chunk_stmt = chunk_stmt.where(key > last_key)
+        count = 0
+        try:
+            result = db.session.execute(chunk_stmt.execution_options(stream_results=True, yield_per=yield_per))
+            for row in result.mappings():
+                count += 1
+                last_key = row[key.name]
+                yield columns, row
+        finally:
+            db.session.rollback()
+        if count < chunk_size:
+            return
+
+
+def _serialise(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def to_csv(rows, columns, batch_size=500):
+    """
+    Encode export rows as CSV, yielding one chunk per batch of rows.
+
+    The header row comes from `columns`, so an export without rows is still a valid CSV file.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for _, row in rows:
+        writer.writerow([_serialise(row[column]) for column in columns])
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def to_ndjson(rows, batch_size=500):
+    """Encode export rows as newline-delimited JSON, yielding one chunk per batch of rows."""
+    lines = []
+    for columns, row in rows:
+        lines.append(json.dumps({column: _serialise(row[column]) for column in columns}))
+        if len(lines) >= batch_size:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
@@ -0,0 +1,378 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select
+from models.book import Book
+from models.base_model import db
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; writers then only serialise within a process
+    fcntl = None
+
+MAGIC = b'CATIDX01'
+# magic, generation, number of books, number of publishers, number of categories,
+# stale flag (set when books were added or removed since the file was built)
+HEADER = struct.Struct('<8sQIIII')
+STRING_REF = struct.Struct('<II')  # offset into the string blob, length
+# id, title offset, title length, publisher code, category code, is_available,
+# borrowed_at and return_by in microseconds since the epoch (NO_TIME for None)
+RECORD = struct.Struct('<36sIIHHB3xqq')
+ID_SIZE = 36
+NO_TIME = -2 ** 63
+EPOCH = datetime(1970, 1, 1)
+
+
+def _to_micros(value):
+    return NO_TIME if value is None else (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(value):
+    return None if value == NO_TIME else EPOCH + timedelta(microseconds=value)
+
+
+class _Snapshot:
+    """Read-only view over one mapped index file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, self.count, n_publishers, n_categories, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a catalog index')
+        codes_offset = HEADER.size
+        self.records_offset = codes_offset + STRING_REF.size * (n_publishers + n_categories)
+        self.blob_offset = self.records_offset + RECORD.size * self.count
+        # Code tables are tiny, decode them once per file
+        strings = [self._string(*STRING_REF.unpack_from(self.map, codes_offset + STRING_REF.size * index))
+                   for index in range(n_publishers + n_categories)]
+        self.publishers, self.categories = strings[:n_publishers], strings[n_publishers:]
+
+    @property
+    def generation(self):
+        return HEADER.unpack_from(self.map, 0)[1]
+
+    @property
+    def stale(self):
+        return bool(HEADER.unpack_from(self.map, 0)[5])
+
+    def _string(self, offset, length):
+        start = self.blob_offset + offset
+        return self.map[start:start + length].decode('utf-8')
+
+    def _id_at(self, index):
+        start = self.records_offset + RECORD.size * index
+        return self.map[start:start + ID_SIZE]
+
+    def find(self, book_id):
+        """Binary search the id-sorted records; return the record index or None."""
+        key = book_id.encode('utf-8').ljust(ID_SIZE, b'\0')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._id_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.count and self._id_at(low) == key else None
+
+    def record(self, index):
+        return RECORD.unpack_from(self.map, self.records_offset + RECORD.size * index)
+
+
+class CatalogIndex:
+    """
+    Compact, read-optimised catalog snapshot in a memory-mapped file shared by all workers.
+
+    Readers map the file read-only, so every worker on the host shares the same
+    page-cache pages, and pick up a replaced file on their next read. Availability
+    changes patch the fixed-size record in place. Structural changes (books added
+    or removed) only flag the file as stale, which sends reads to the database; a
+    rebuild then swaps in a new file with ``os.replace``. With `rebuild_delay` the
+    rebuild runs on a background thread that many changes in a row share, so a
+    bulk import costs one rebuild rather than one per book. Writers are
+    serialised with a lock file.
+    """
+
+    def __init__(self, path, rebuild_delay=0.0):
+        self.path = path
+        self.rebuild_delay = rebuild_delay
+        self._lock_path = f'{path}.lock'
+        self._snapshot = None
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def _current(self):
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.inode != inode:
+            with self._lock:
+                if self._snapshot is None or self._snapshot.inode != inode:
+                    # The previous mapping stays valid for readers still holding it
+                    self._snapshot = _Snapshot(self.path)
+                snapshot = self._snapshot
+        return snapshot
+
+    def exists(self):
+        return self._current() is not None
+
+    def fresh(self):
+        """Whether the index exists and holds every book added or removed so far."""
+        snapshot = self._current()
+        return snapshot is not None and not snapshot.stale
+
+    def generation(self):
+        """
+        Get the generation of the index, bumped on every change.
+
+        :return: Generation number, or None if there is no index yet
+        """
+        snapshot = self._current()
+        return snapshot.generation if snapshot else None
+
+    def get(self, book_id):
+        """
+        Look up a book by ID.
+
+        :param book_id: ID of the book
+        :return: Dictionary shaped like the get_book response, or None if not indexed or stale
+        """
+        snapshot = self._current()
+        if snapshot is None or snapshot.stale or len(book_id.encode('utf-8')) > ID_SIZE:
+            return None
+        index = snapshot.find(book_id)
+        if index is None:
+            return None
+        _, title_offset, title_length, publisher, category, is_available, borrowed_at, return_by = \
+            snapshot.record(index)
+        borrowed_at, return_by = _from_micros(borrowed_at), _from_micros(return_by)
+        data = {
+            'title': snapshot._string(title_offset, title_length),
+            'publisher': snapshot.publishers[publisher],
+            'category': snapshot.categories[category],
+            'is_available': bool(is_available),
+            'borrowed_at': borrowed_at.isoformat() if borrowed_at else None,
+            'return_by': return_by.isoformat() if return_by else None,
+        }
+        if not is_available:
+            data['available_on'] = data['return_by']
+        return data
+
+    def available_books(self):
+        """
+        List the available books.
+
+        :return: List of dictionaries with id and title for each available book
+        """
+        snapshot = self._current()
+        if snapshot is None:
+            return []
+        books = []
+        for book_id, title_offset, title_length, _, _, is_available, _, _ in RECORD.iter_unpack(
+                memoryview(snapshot.map)[snapshot.records_offset:snapshot.blob_offset]):
+            if is_available:
+                books.append({'id': book_id.rstrip(b'\0').decode('utf-8'),
+                              'title': snapshot._string(title_offset, title_length)})
+        return books
+
+    def _locked(self):
+        lock_file = open(self._lock_path, 'a+b')
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        return lock_file
+
+    def rebuild(self):
+        """
+        Rebuild the index from the database and atomically swap it in.
+
+        The file is swapped in flagged as stale if the index changed while the
+        database was read, since the new file may then miss that change.
+        """
+        with self._rebuild_lock:
+            with self._lock, self._locked():
+                snapshot = self._current()
+                started_at = snapshot.generation if snapshot else 0
+
+            rows = Book.scatter(select(Book.id, Book.title, Book.publisher, Book.category, Book.is_available,
+                                       Book.borrowed_at, Book.return_by))
+            db.session.rollback()
+            rows = [row for row in rows if len(row.id.encode('utf-8')) <= ID_SIZE]
+            rows.sort(key=lambda row: row.id.encode('utf-8'))
+
+            blob = bytearray()
+
+            def add_string(value):
+                encoded = value.encode('utf-8')
+                blob.extend(encoded)
+                return len(blob) - len(encoded), len(encoded)
+
+            publishers = {name: code for code, name in enumerate(sorted({row.publisher for row in rows}))}
+            categories = {name: code for code, name in enumerate(sorted({row.category for row in rows}))}
+            codes = [add_string(name) for name in list(publishers) + list(categories)]
+            records = bytearray()
+            for row in rows:
+                title_offset, title_length = add_string(row.title)
+                records.extend(RECORD.pack(row.id.encode('utf-8'), title_offset, title_length,
+                                           publishers[row.publisher], categories[row.category],
+                                           bool(row.is_available), _to_micros(row.borrowed_at),
+                                           _to_micros(row.return_by)))
+
+            with self._lock, self._locked():
+                snapshot = self._current()
+                generation = snapshot.generation if snapshot else 0
+                temp_path = f'{self.path}.{os.getpid()}.tmp'
+                with open(temp_path, 'wb') as f:
+                    f.write(HEADER.pack(MAGIC, generation + 1, len(rows), len(publishers), len(categories),
+                                        generation != started_at))
+                    for code in codes:
+                        f.write(STRING_REF.pack(*code))
+                    f.write(records)
+                    f.write(blob)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+
+    def rebuild_if_stale(self):
+        """
+        Rebuild the index if it is missing or stale.
+
+        :return: True if it was rebuilt
+        """
+        if self.fresh():
+            return False
+        self.rebuild()
+        return True
+
+    def mark_stale(self):
+        """Flag the index as missing added or removed books, so readers use the database until it is rebuilt."""
+        with self._lock, self._locked():
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, 'r+b') as f:
+                writable = mmap.mmap(f.fileno(), 0)
+            try:
+                header = list(HEADER.unpack_from(writable, 0))
+                header[1] += 1
+                header[5] = 1
+                HEADER.pack_into(writable, 0, *header)
+            finally:
+                writable.close()
+
+    def request_rebuild(self, app):
+        """
+        Rebuild a stale index: now without a rebuild delay, else on the background thread after the delay.
+
+        :param app: Flask application the background thread reads the database with
+        """
+        if not self.rebuild_delay:
+            self.rebuild_if_stale()
+            return
+        self._ensure_started(app)
+        self._wake.set()
+
+    def _run(self, app):
+        while True:
+            self._wake.wait()
+            # Let the rest of a burst of changes land, so they share one rebuild
+            time.sleep(self.rebuild_delay)
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    self.rebuild_if_stale()
+                except Exception as e:
+                    app.logger.error('Catalog index rebuild failed: %s', e)
+                finally:
+                    db.session.remove()
+            if not self.fresh():
+                self._wake.set()
+
+    def _ensure_started(self, app):
+        # Once per process, so workers forked from a preloaded app run their own thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(app,), name='catalog-index-rebuild', daemon=True).start()
+
+    def update_availability(self, book_id, is_available, borrowed_at, return_by):
+        """
+        Patch a book's availability in place, visible to every worker immediately.
+
+        :return: True if the book was indexed and patched
+        """
+        with self._lock, self._locked():
+            if not os.path.exists(self.path):
+                return False
+            with open(self.path, 'r+b') as f:
+                writable = mmap.mmap(f.fileno(), 0)
+            try:
+                snapshot = self._current()
+                index = snapshot.find(book_id)
+                if index is None:
+                    return False
+                offset = snapshot.records_offset + RECORD.size * index
+                record = list(RECORD.unpack_from(writable, offset))
+                record[5:8] = [bool(is_available), _to_micros(borrowed_at), _to_micros(return_by)]
+                RECORD.pack_into(writable, offset, *record)
+                header = list(HEADER.unpack_from(writable, 0))
+                header[1] += 1
+                HEADER.pack_into(writable, 0, *header)
+                return True
+            finally:
+                writable.close()
+
+
+def get_catalog_index():
+    """Return the app's catalog index, or None if CATALOG_INDEX_PATH is not configured."""
+    return current_app.extensions.get('catalog_index')
+
+
+def record_catalog_change():
+    """Flag the shared catalog index as stale after books were added or removed, and have it rebuilt."""
+    index = get_catalog_index()
+    if index is None:
+        return
+    try:
+        index.mark_stale()
+        index.request_rebuild(current_app._get_current_object())
+    except Exception as e:
+        current_app.logger.error('Catalog index rebuild failed: %s', e)
+
+
+def record_availability_change(book_id, is_available, borrowed_at=None, return_by=None):
+    """Patch a book's availability in the shared catalog index, if it is enabled."""
+    index = get_catalog_index()
+    if index is None:
+        return
+    try:
+        if not index.update_availability(book_id, is_available, borrowed_at, return_by):
+            index.request_rebuild(current_app._get_current_object())
+    except Exception as e:
+        current_app.logger.error('Catalog index update failed for book %s: %s', book_id, e)
+
+
+def register_catalog_index(app):
+    """
+    Attach the shared catalog index and build it if no worker has yet, or if it was left stale.
+
+    :param app: Flask application instance
+    """
+    if not app.config.get('CATALOG_INDEX_PATH'):
+        return None
+    index = CatalogIndex(app.config['CATALOG_INDEX_PATH'], app.config['CATALOG_INDEX_REBUILD_DELAY'])
+    app.extensions['catalog_index'] = index
+    if not index.fresh():
+        with app.app_context():
+            index.rebuild()
+    return index
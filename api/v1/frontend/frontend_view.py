@@ -1,15 +1,36 @@
-from flask import Blueprint, request, jsonify
-import requests
+import time
+from flask import Blueprint, current_app, request, jsonify
 from models.user import User
 from models.book import Book
 from models.base_model import db
 from datetime import datetime, timedelta
+from sqlalchemy import select
+from api.v1.peer_client import post_to_peer
+from api.v1.idempotency import idempotent, IDEMPOTENCY_HEADER
+from api.v1.schemas import (UserEnroll, BorrowRequest, CheckoutRequest, AddBookWebhook, AddBooksWebhook,
+                            RemoveBookWebhook, validate_payload)
+from config.read_replicas import read_only, reads_from_replica
+from config.compression import CompressedSnapshot
+from config.unit_of_work import after_commit, transactional, unit_of_work
+from api.v1.frontend.catalog_index import get_catalog_index, record_availability_change, record_catalog_change
+from api.v1.frontend.title_index import get_title_index, record_titles_added, record_title_removed, titles_version
+from api.v1.frontend.update_coalescer import notify_availability, notify_availability_many
 
 
 frontend_bp = Blueprint("frontend_views", __name__, url_prefix="/api/v1/frontend")
 
+SUGGEST_DEFAULT_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+# Columns an add-book event may change on a book the frontend already has; the loan state is owned by the frontend
+CATALOG_FIELDS = ['title', 'publisher', 'category']
+
+# Pre-compressed list_books responses, rebuilt when the catalog version changes
+catalog_snapshot = CompressedSnapshot()
+
 @frontend_bp.route('/enroll', methods=['POST'])
-def enroll_user():
+@validate_payload(UserEnroll)
+def enroll_user(payload):
     """
     Enroll a new user and notify the backend service.
 
@@ -18,19 +39,9 @@ def enroll_user():
 
     :return: JSON response indicating success or failure.
     """
-    data = request.get_json()
-    
-    # Validate the received data
-    if not data:
-        return jsonify({"message": "Invalid data format"}), 400
-
-    email = data.get('email')
-    firstname = data.get('firstname')
-    lastname = data.get('lastname')
+    # The payload has already been decoded and validated against UserEnroll
+    email, firstname, lastname = payload.email, payload.firstname, payload.lastname
 
-    if not email or not firstname or not lastname:
-        return jsonify({"message": "Missing required fields: email, firstname, or lastname"}), 400
-    
     # Check if user already exists based on email
     existing_user = User.query.filter_by(email=email).first()
     if existing_user:
@@ -44,11 +55,12 @@ def enroll_user():
         user.save()
         
         # Notify the backend service using a webhook
-        backend_update_url = 'http://backend:5000/api/v1/backend/admin/webhooks/add-user'  # URL of the backend service
-        payload = {'user_id': user.id, 'user_data': user.to_dict()}
+        webhook_path = '/api/v1/backend/admin/webhooks/add-user'
+        payload = {'user_id': user.id, 'user_data': user.to_payload()}
         
-        # Send user data as payload
-        response = requests.post(backend_update_url, json=payload)
+        # Send user data as payload, keyed so that a retried delivery is applied once
+        headers = {IDEMPOTENCY_HEADER: f'add-user:{user.id}'}
+        response = post_to_peer('BACKEND_SERVICE_URL', webhook_path, payload, headers=headers)
 
         # Check if the request to the backend was successful
         if response.status_code == 200:
@@ -61,6 +73,7 @@ def enroll_user():
 
 
 @frontend_bp.route('/books', methods=['GET'])
+@read_only
 def list_books():
     """
     Retrieve and return a list of available books.
@@ -70,20 +83,45 @@ def list_books():
     :return: JSON response with a list of books including their id and title.
     """
     try:
-        # Fetch books that are available
-        books = Book.get_all(filters={"is_available": True})
-        
-        # Create a list of dictionaries with id and title for each book
-        book_list = [{'id': book.id, 'title': book.title} for book in books]
-        
-        return jsonify(book_list), 200
+        index = get_catalog_index()
+        if index is not None and index.fresh():
+            # Serve from the catalog index shared by all workers, without touching the database
+            return catalog_snapshot.response(('index', index.generation()), index.available_books), 200
+
+        # Serve the serialised (and compressed) list cached for the current catalog version
+        return catalog_snapshot.response(catalog_snapshot_version(), build_available_books), 200
 
     except Exception as e:
         # Handle unexpected errors during retrieval
         return jsonify({"message": f"Error retrieving available books: {str(e)}"}), 500
 
 
+def catalog_snapshot_version():
+    """
+    Key the list_books snapshot is cached under.
+
+    The catalog version only counts the writes made on this host, and replicas lag
+    behind it, so the key also separates replica reads and expires every QUERY_CACHE_TTL.
+    """
+    return (Book.catalog_version(), reads_from_replica(),
+            int(time.monotonic() // current_app.config['QUERY_CACHE_TTL']))
+
+
+def build_available_books():
+    """
+    Build the payload of list_books.
+
+    :return: List of dictionaries with id and title for each available book
+    """
+    # Fetch books that are available, in title order (merged from the shards when the catalog is sharded)
+    books = Book.get_all(filters={"is_available": True}, order_by=['title', 'id'])
+
+    # Create a list of dictionaries with id and title for each book
+    return [{'id': book.id, 'title': book.title} for book in books]
+
+
 @frontend_bp.route('/book/<string:book_id>', methods=['GET'])
+@read_only
 def get_book(book_id):
     """
     Retrieve and return details of a specific book by its ID.
@@ -95,8 +133,14 @@ def get_book(book_id):
     """
 
     try:
-        # Fetch the book by ID or return a 404 error if not found
-        book = Book.query.get_or_404(book_id)
+        # Serve from the shared catalog index when the book is indexed
+        index = get_catalog_index()
+        book_data = index.get(book_id) if index is not None else None
+        if book_data is not None:
+            return jsonify(book_data), 200
+
+        # Fetch the book by ID (from its shard) or return a 404 error if not found
+        book = Book.get_or_404(book_id)
 
         # Define the fields to include in the response
         fields = ['title', 'publisher', 'category', 'is_available', 'borrowed_at', 'return_by']
@@ -109,6 +153,7 @@ def get_book(book_id):
         return jsonify({"message": f"Error retrieving book details: {str(e)}"}), 500
 
 @frontend_bp.route('/books/filter', methods=['GET'])
+@read_only
 def filter_books():
     """
     Filter and retrieve books based on publisher and/or category.
@@ -122,15 +167,15 @@ def filter_books():
         publisher = request.args.get('publisher')
         category = request.args.get('category')
         
-        # Build the query with optional filters
-        query = Book.query
+        # Build the optional filters
+        filters = {}
         if publisher:
-            query = query.filter_by(publisher=publisher)
+            filters['publisher'] = publisher
         if category:
-            query = query.filter_by(category=category)
+            filters['category'] = category
 
-        # Execute the query and fetch the results
-        books = query.all()
+        # Fetch the matching books in title order (merged from the shards when the catalog is sharded)
+        books = Book.get_all(filters=filters, order_by=['title', 'id'])
 
         # Return a list of books with the required fields (id, title, publisher, category)
         return jsonify([book.to_dict(fields=['id', 'title', 'publisher', 'category']) for book in books]), 200
@@ -139,43 +184,70 @@ def filter_books():
         # Handle unexpected errors during retrieval
         return jsonify({"message": f"Error filtering books: {str(e)}"}), 500
 
+@frontend_bp.route('/books/suggest', methods=['GET'])
+def suggest_books():
+    """
+    Suggest book titles starting with a prefix, for search-as-you-type.
+
+    Served from the in-memory title index without querying the database.
+    Matching ignores case, accents and repeated whitespace.
+
+    :return: JSON response with up to 'limit' books (id and title) in title order
+    """
+    prefix = request.args.get('prefix', '')
+    limit = request.args.get('limit', SUGGEST_DEFAULT_LIMIT, type=int)
+
+    if not prefix.strip():
+        return jsonify({"message": "Missing prefix"}), 400
+    if not 0 < limit <= SUGGEST_MAX_LIMIT:
+        return jsonify({"message": f"limit should be between 1 and {SUGGEST_MAX_LIMIT}"}), 400
+
+    try:
+        index = get_title_index()
+        index.refresh_if_stale()
+        return jsonify(index.suggest(prefix, limit)), 200
+    except Exception as e:
+        return jsonify({"message": f"Error suggesting books: {str(e)}"}), 500
+
 @frontend_bp.route('/borrow/<string:book_id>', methods=['POST'])
-def borrow_book(book_id):
+@validate_payload(BorrowRequest)
+def borrow_book(book_id, payload):
     """
     Borrow a book, update its availability status, and notify the backend service.
 
+    The availability check and the update happen in one conditional UPDATE, so two
+    concurrent borrowers cannot both claim the same copy.
+
     :param book_id: ID of the book to be borrowed.
     :return: JSON response indicating success or failure.
     """
-    data = request.get_json()
-    book = Book.query.get_or_404(book_id)
-
-    if not book.is_available:
-        return jsonify({"message": "Book already borrowed"}), 400
-    
-    borrow_duration = data.get('days')
-
-    # Validate that 'days' is an integer
-    if not isinstance(borrow_duration, int) or borrow_duration <= 0:
-        return jsonify({"message": "borrow duration (days) should be a positive integer"}), 400
+    # 'days' is validated as a positive integer by BorrowRequest
+    borrow_duration = payload.days
 
-    # Update book availability status
-    book.is_available = False
-    book.borrowed_at = datetime.utcnow()
-    book.return_by = datetime.utcnow() + timedelta(days=borrow_duration)
+    borrowed_at = datetime.utcnow()
+    return_by = borrowed_at + timedelta(days=borrow_duration)
 
     try:
-        # Save the updated book status
-        book.save()
+        # Claim the book only if it is still available
+        claimed = Book.update_where({'is_available': False, 'borrowed_at': borrowed_at, 'return_by': return_by},
+                                    id=book_id, is_available=True)
+    except Exception as e:
+        return jsonify({"message": f"Error borrowing book: {str(e)}"}), 500
 
-        # Notify the backend service using a webhook
-        backend_update_url = 'http://backend:5000/api/v1/backend/admin/webhooks/update-book'
-        payload = {'book_id': book_id, 'is_available': book.is_available}
+    if not claimed:
+        Book.get_or_404(book_id)
+        return jsonify({"message": "Book already borrowed"}), 400
+    record_availability_change(book_id, False, borrowed_at, return_by)
 
-        response = requests.post(backend_update_url, json=payload)
+    try:
+        # Notify the backend service using a webhook, or queue the update for the next coalesced batch
+        response = notify_availability(book_id, False, borrowed_at,
+                                       f'update-book:{book_id}:{borrowed_at.isoformat()}')
 
         # Check if the request to the backend was successful
-        if response.status_code == 200:
+        if response is None:
+            return jsonify({"message": "Book borrowed successfully and backend update queued"}), 200
+        elif response.status_code == 200:
             return jsonify({"message": "Book borrowed successfully and backend updated"}), 200
         else:
             return jsonify({"message": f"Book borrowed but failed to notify backend: {response.text}"}), 500
@@ -184,41 +256,158 @@ def borrow_book(book_id):
         return jsonify({"message": f"Error borrowing book: {str(e)}"}), 500
 
 
+@frontend_bp.route('/borrow', methods=['POST'])
+@validate_payload(CheckoutRequest)
+def checkout_books(payload):
+    """
+    Borrow several books at once, all or none, and notify the backend service in one call.
+
+    Expects JSON data with 'book_ids' and 'days'. Every book is claimed by the same
+    conditional UPDATE ... WHERE id IN (...) AND is_available, in one transaction that
+    is rolled back unless all of them were still available. With a sharded catalog,
+    the shards commit one after the other, so a cart must stay on one shard.
+
+    :return: JSON response indicating success or failure.
+    """
+    # Claiming a book twice in one checkout is claiming it once
+    book_ids = list(dict.fromkeys(payload.book_ids))
+    if Book.shard_count(book_ids) > 1:
+        return jsonify({"message": "Books are stored on different shards and must be borrowed separately",
+                        "book_ids": book_ids}), 400
+    borrowed_at = datetime.utcnow()
+    return_by = borrowed_at + timedelta(days=payload.days)
+
+    try:
+        with unit_of_work() as unit:
+            claimed = Book.update_where({'is_available': False, 'borrowed_at': borrowed_at, 'return_by': return_by},
+                                        id=book_ids, is_available=True)
+            if claimed != len(book_ids):
+                unit.discard()
+    except Exception as e:
+        return jsonify({"message": f"Error borrowing books: {str(e)}"}), 500
+
+    if claimed != len(book_ids):
+        # Nothing was claimed; report what stood in the way
+        available = dict(Book.scatter(select(Book.id, Book.is_available).where(Book.id.in_(book_ids))))
+        missing = [book_id for book_id in book_ids if book_id not in available]
+        if missing:
+            return jsonify({"message": "Books not found", "book_ids": missing}), 404
+        return jsonify({"message": "Books already borrowed",
+                        "book_ids": [book_id for book_id in book_ids if not available[book_id]]}), 400
+
+    for book_id in book_ids:
+        record_availability_change(book_id, False, borrowed_at, return_by)
+
+    try:
+        # Notify the backend service of the whole checkout in one webhook, or queue it for the next coalesced batch
+        response = notify_availability_many(book_ids, False, borrowed_at,
+                                            f'checkout:{book_ids[0]}:{book_ids[-1]}:{borrowed_at.isoformat()}')
+
+        # Check if the request to the backend was successful
+        if response is None:
+            message = "Books borrowed successfully and backend update queued"
+        elif response.status_code == 200:
+            message = "Books borrowed successfully and backend updated"
+        else:
+            return jsonify({"message": f"Books borrowed but failed to notify backend: {response.text}"}), 500
+        return jsonify({"message": message, "book_ids": book_ids, "return_by": return_by.isoformat()}), 200
+
+    except Exception as e:
+        return jsonify({"message": f"Error borrowing books: {str(e)}"}), 500
+
+
+@frontend_bp.route('/return/<string:book_id>', methods=['POST'])
+def return_book(book_id):
+    """
+    Return a borrowed book, make it available again, and notify the backend service.
+
+    Uses the same conditional UPDATE as borrowing, so a book can only be returned once per loan.
+
+    :param book_id: ID of the book to be returned.
+    :return: JSON response indicating success or failure.
+    """
+    returned_at = datetime.utcnow()
+
+    try:
+        # Release the book only if it is currently borrowed
+        released = Book.update_where({'is_available': True, 'borrowed_at': None, 'return_by': None,
+                                      'borrowed_by_id': None},
+                                     id=book_id, is_available=False)
+    except Exception as e:
+        return jsonify({"message": f"Error returning book: {str(e)}"}), 500
+
+    if not released:
+        Book.get_or_404(book_id)
+        return jsonify({"message": "Book is not borrowed"}), 400
+    record_availability_change(book_id, True)
+
+    try:
+        # Notify the backend service using a webhook, or queue the update for the next coalesced batch
+        response = notify_availability(book_id, True, returned_at,
+                                       f'return-book:{book_id}:{returned_at.isoformat()}')
+
+        # Check if the request to the backend was successful
+        if response is None:
+            return jsonify({"message": "Book returned successfully and backend update queued"}), 200
+        elif response.status_code == 200:
+            return jsonify({"message": "Book returned successfully and backend updated"}), 200
+        else:
+            return jsonify({"message": f"Book returned but failed to notify backend: {response.text}"}), 500
+
+    except Exception as e:
+        return jsonify({"message": f"Error returning book: {str(e)}"}), 500
+
+
 @frontend_bp.route('/webhooks/add-book', methods=['POST'])
-def add_book_webhook():
+@transactional
+@idempotent
+@validate_payload(AddBookWebhook)
+def add_book_webhook(payload):
     '''
-    Webhook for receiving new book notifications from backend and adding it to frontend database
+    Webhook for receiving new book notifications from backend and upserting it into the frontend database
     '''
-    data = request.get_json()
-    book_data = data.get('book_data')
-    
-    if not book_data:
-        return jsonify({"message": "Missing book data"}), 400
-    
-    # Convert date strings to datetime objects
-    for date_field in ['created_at', 'updated_at', 'borrowed_at', 'return_by']:
-        if book_data.get(date_field):
-            book_data[date_field] = datetime.fromisoformat(book_data[date_field])
-        elif date_field in book_data and book_data[date_field] is None:
-            book_data[date_field] = None
-
-    # Check if the book already exists
-    book = Book.query.get(book_data['id'])
-    if book:
-        return jsonify({"message": "Book already exists"}), 400
-
-    # Create a new book
-    book = Book(**book_data)
-    
-    # Save the new book to the frontend database
+    # Insert the book, or refresh only its catalog fields, in one statement so a redelivered or stale
+    # event cannot undo a loan; dates arrive already decoded
     try:
-        book.save()
+        book_data = payload.book_data.values()
+        before = titles_version()
+        Book.upsert(book_data, update_fields=CATALOG_FIELDS)
+        after_commit(record_catalog_change)
+        if 'title' in book_data:
+            after_commit(record_titles_added, [(book_data['id'], book_data['title'])], before)
         return jsonify({"message": "Book added successfully to frontend"}), 200
     except Exception as e:
         return jsonify({"message": f"Error processing book webhook: {str(e)}"}), 500
     
+@frontend_bp.route('/webhooks/add-books', methods=['POST'])
+@transactional
+@idempotent
+@validate_payload(AddBooksWebhook)
+def add_books_webhook(payload):
+    """
+    Webhook for receiving batches of new books from the backend (e.g. bulk imports).
+
+    Expects JSON data with 'books', a list of book data objects like add-book's 'book_data'.
+    The whole batch is decoded and validated in one pass, then upserted in one transaction.
+
+    :return: JSON response indicating success or failure.
+    """
+    books = [book_data.values() for book_data in payload.books]
+
+    try:
+        before = titles_version()
+        Book.upsert_many(books, update_fields=CATALOG_FIELDS)
+        after_commit(record_catalog_change)
+        after_commit(record_titles_added, [(book['id'], book['title']) for book in books if 'title' in book], before)
+        return jsonify({"message": f"{len(books)} books added successfully to frontend"}), 200
+    except Exception as e:
+        return jsonify({"message": f"Error processing books webhook: {str(e)}"}), 500
+
 @frontend_bp.route('/webhooks/remove-book', methods=['POST'])
-def remove_book_webhook():
+@transactional
+@idempotent
+@validate_payload(RemoveBookWebhook)
+def remove_book_webhook(payload):
     """
     Webhook to handle book removal notifications from the backend service.
 
@@ -227,19 +416,18 @@ def remove_book_webhook():
 
     :return: JSON response indicating success or failure.
     """
-    data = request.get_json()
-    book_id = data.get('book_id')
-    
-    if not book_id:
-        return jsonify({"message": "Missing book ID"}), 400
+    book_id = payload.book_id
 
     # Check if the book exists in the frontend database
-    book = Book.query.get(book_id)
+    book = Book.get_by_id(book_id)
 
     if book:
         try:
             # Delete the book from the frontend database
+            before = titles_version()
             book.delete()
+            after_commit(record_catalog_change)
+            after_commit(record_title_removed, book_id, before)
             return jsonify({"message": "Book removed successfully"}), 200
         except Exception as e:
             return jsonify({"message": f"Error processing book removal webhook: {str(e)}"}), 500
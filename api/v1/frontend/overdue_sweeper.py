@@ -0,0 +1,119 @@
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import select, tuple_
+from models.book import Book
+from models.base_model import db
+from models.sweep_watermark import SweepWatermark
+from api.v1.peer_client import post_to_peer
+from api.v1.idempotency import IDEMPOTENCY_HEADER
+
+OVERDUE_WEBHOOK_PATH = '/api/v1/backend/admin/webhooks/overdue-books'
+OVERDUE_SWEEP = 'overdue-books'
+
+
+class OverdueSweeper:
+    """
+    Periodically find loans that became overdue and report them to the backend in bulk.
+
+    Each sweep only looks at loans whose ``return_by`` fell due since the previous
+    sweep, walking the ``return_by`` index in keyset-paginated batches. Every batch
+    is a short read-only transaction, so no long locks are held however many loans
+    are active.
+
+    The previous sweep's end is kept in the database, so a restarted worker does not
+    report old loans again, and a sweep runs only while it holds the watermark's
+    lease, so the workers of a deployment take turns instead of sweeping together.
+    """
+
+    def __init__(self, app, interval, batch_size, lease_seconds=300):
+        self.app = app
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def overdue_batches(self, since, until):
+        """
+        Yield batches of ``(id, return_by)`` for loans that fell due in ``(since, until]``.
+
+        :param since: Lower bound (exclusive) of the due date window
+        :param until: Upper bound (inclusive) of the due date window
+        """
+        last = None
+        while True:
+            stmt = (select(Book.id, Book.return_by)
+                    .where(Book.is_available.is_(False), Book.return_by > since, Book.return_by <= until))
+            if last is not None:
+                stmt = stmt.where(tuple_(Book.return_by, Book.id) > last)
+            stmt = stmt.order_by(Book.return_by, Book.id).limit(self.batch_size)
+            # A sharded catalog is walked on every shard at once, merging the shards' batches in due order
+            batch = Book.scatter(stmt, order_by=lambda row: (row.return_by, row.id), limit=self.batch_size)
+            # End the read transaction before doing any network I/O
+            db.session.rollback()
+            if not batch:
+                return
+            yield batch
+            last = (batch[-1].return_by, batch[-1].id)
+
+    def sweep_once(self):
+        """
+        Report every loan that became overdue since the last successful sweep.
+
+        The watermark only advances once all batches were accepted, so a failed
+        delivery is retried on the next sweep (the backend applies them idempotently).
+
+        :return: Number of overdue loans reported (0 if another worker is sweeping)
+        """
+        now = datetime.utcnow()
+        since = SweepWatermark.claim(OVERDUE_SWEEP, now, self.lease_seconds)
+        if since is None:
+            return 0
+        reported = 0
+        try:
+            for batch in self.overdue_batches(since, now):
+                payload = {'books': [{'book_id': book_id, 'return_by': return_by.replace(tzinfo=timezone.utc)}
+                                     for book_id, return_by in batch]}
+                headers = {IDEMPOTENCY_HEADER: f'overdue-books:{batch[0][0]}:{batch[-1][0]}:{now.isoformat()}'}
+                response = post_to_peer('BACKEND_SERVICE_URL', OVERDUE_WEBHOOK_PATH, payload, headers=headers)
+                if response.status_code != 200:
+                    raise Exception(f'Backend rejected overdue batch: {response.text}')
+                reported += len(batch)
+        except Exception:
+            SweepWatermark.release(OVERDUE_SWEEP)
+            raise
+        SweepWatermark.release(OVERDUE_SWEEP, swept_until=now)
+        return reported
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    reported = self.sweep_once()
+                    if reported:
+                        self.app.logger.info('Reported %d overdue loans to backend', reported)
+                except Exception as e:
+                    self.app.logger.error('Overdue sweep failed: %s', e)
+
+    def start(self):
+        """Start sweeping in a daemon thread."""
+        self._thread = threading.Thread(target=self._run, name='overdue-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the sweeping thread."""
+        self._stop.set()
+
+
+def register_overdue_sweeper(app):
+    """
+    Attach an overdue sweeper to the app and start it if OVERDUE_SWEEP_INTERVAL is set.
+
+    :param app: Flask application instance
+    """
+    sweeper = OverdueSweeper(app, app.config['OVERDUE_SWEEP_INTERVAL'], app.config['OVERDUE_SWEEP_BATCH_SIZE'],
+                             app.config['OVERDUE_SWEEP_LEASE'])
+    app.extensions['overdue_sweeper'] = sweeper
+    if sweeper.interval > 0:
+        sweeper.start()
+    return sweeper
@@ -0,0 +1,170 @@
+import bisect
+import threading
+import time
+import unicodedata
+from flask import current_app
+from sqlalchemy import select
+from models.book import Book
+from models.base_model import db
+from config.query_cache import get_table_versions
+
+# Counter in the table version store that only changes with the titles: borrows and returns,
+# which bump the whole `books` counter, must not make every worker rebuild its index
+TITLES_VERSION = 'books:titles'
+
+
+def normalize_title(title):
+    """Fold a title for prefix matching: accents stripped, case folded, whitespace collapsed."""
+    decomposed = unicodedata.normalize('NFKD', title)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+class TitleIndex:
+    """
+    Sorted in-memory index of normalized book titles for prefix suggestions.
+
+    Entries are (normalized title, title, id) tuples kept in sorted order, so a
+    prefix lookup is one binary search followed by a scan of the matches. Each
+    worker holds its own copy: it is updated in place by the webhooks this worker
+    receives, and rebuilt when the titles version shows another worker changed it.
+    """
+
+    def __init__(self, refresh_interval=30.0):
+        self.refresh_interval = refresh_interval
+        self._entries = []
+        self._keys = {}  # book id -> entry, to find the entry again on removal
+        self._version = None
+        self._next_check = 0.0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def rebuild(self):
+        """Rebuild the index from the database."""
+        version = titles_version()
+        rows = Book.scatter(select(Book.id, Book.title))
+        db.session.rollback()
+        entries = sorted((normalize_title(title), title, book_id) for book_id, title in rows)
+        with self._lock:
+            self._entries = entries
+            self._keys = {entry[2]: entry for entry in entries}
+            self._version = version
+            self._next_check = time.monotonic() + self.refresh_interval
+
+    def _remove(self, book_id):
+        entry = self._keys.pop(book_id, None)
+        if entry is not None:
+            position = bisect.bisect_left(self._entries, entry)
+            if position < len(self._entries) and self._entries[position] == entry:
+                del self._entries[position]
+
+    def _advance(self, before):
+        # Only an index that was current when the write began is current after it; if another
+        # worker changed the catalog in between, the old version makes the next check rebuild
+        if before is not None and self._version == before:
+            self._version = titles_version()
+
+    def add(self, books, before=None):
+        """
+        Add or re-title books.
+
+        :param books: Iterable of (id, title) pairs
+        :param before: Titles version read just before the write that added the books
+        """
+        with self._lock:
+            for book_id, title in books:
+                self._remove(book_id)
+                entry = (normalize_title(title), title, book_id)
+                bisect.insort(self._entries, entry)
+                self._keys[book_id] = entry
+            self._advance(before)
+
+    def remove(self, book_id, before=None):
+        """
+        Remove a book from the index.
+
+        :param book_id: ID of the removed book
+        :param before: Titles version read just before the write that removed the book
+        """
+        with self._lock:
+            self._remove(book_id)
+            self._advance(before)
+
+    def refresh_if_stale(self):
+        """Rebuild the index if another worker changed the titles, checking at most once per interval."""
+        if not self.refresh_interval or time.monotonic() < self._next_check:
+            return
+        with self._lock:
+            if time.monotonic() < self._next_check:
+                return
+            self._next_check = time.monotonic() + self.refresh_interval
+            version = titles_version()
+            if version != self._version:
+                self.rebuild()
+
+    def suggest(self, prefix, limit=10):
+        """
+        Find the titles starting with a prefix.
+
+        :param prefix: Prefix typed by the user, normalized like the titles
+        :param limit: Maximum number of suggestions
+        :return: List of dictionaries with id and title, in title order
+        """
+        prefix = normalize_title(prefix)
+        with self._lock:
+            position = bisect.bisect_left(self._entries, (prefix,))
+            matches = []
+            for normalized, title, book_id in self._entries[position:position + limit]:
+                if not normalized.startswith(prefix):
+                    break
+                matches.append({'id': book_id, 'title': title})
+        return matches
+
+
+def titles_version():
+    """Get the version of the book titles, bumped whenever a webhook adds, re-titles or removes books."""
+    return get_table_versions().get(TITLES_VERSION)
+
+
+def get_title_index():
+    """Return the app's title index."""
+    return current_app.extensions.get('title_index')
+
+
+def record_titles_added(books, before=None):
+    """Add books to the title index, given (id, title) pairs and the titles version read before the write."""
+    get_table_versions().bump(TITLES_VERSION)
+    index = get_title_index()
+    if index is None:
+        return
+    try:
+        index.add(books, before)
+    except Exception as e:
+        current_app.logger.error('Title index update failed: %s', e)
+
+
+def record_title_removed(book_id, before=None):
+    """Remove a book from the title index, given the titles version read before the write."""
+    get_table_versions().bump(TITLES_VERSION)
+    index = get_title_index()
+    if index is None:
+        return
+    try:
+        index.remove(book_id, before)
+    except Exception as e:
+        current_app.logger.error('Title index update failed for book %s: %s', book_id, e)
+
+
+def register_title_index(app):
+    """
+    Build the title index at startup and attach it to the app.
+
+    :param app: Flask application instance
+    """
+    index = TitleIndex(app.config['TITLE_INDEX_REFRESH_INTERVAL'])
+    with app.app_context():
+        index.rebuild()
+    app.extensions['title_index'] = index
+    return index
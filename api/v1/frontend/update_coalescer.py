@@ -0,0 +1,283 @@
+import atexit
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+import requests
+from flask import current_app, jsonify
+from api.v1.peer_client import CircuitOpenError, post_to_peer
+from api.v1.idempotency import IDEMPOTENCY_HEADER
+from config.profiling import admin_required
+
+UPDATE_BOOK_WEBHOOK_PATH = '/api/v1/backend/admin/webhooks/update-book'
+UPDATE_BOOKS_WEBHOOK_PATH = '/api/v1/backend/admin/webhooks/update-books'
+DEAD_LETTERS_KEPT = 100
+
+
+class PendingUpdate:
+    """The latest availability of one book, with every borrow and return merged into it."""
+
+    __slots__ = ('is_available', 'borrowed_at', 'returned_at')
+
+    def __init__(self):
+        self.is_available = None
+        self.borrowed_at = []
+        self.returned_at = []
+
+    def add(self, is_available, occurred_at):
+        self.is_available = is_available
+        (self.returned_at if is_available else self.borrowed_at).append(occurred_at)
+
+    def merge_newer(self, newer):
+        """Fold in an update made after this one: its state wins, the event times are kept in order."""
+        self.is_available = newer.is_available
+        self.borrowed_at += newer.borrowed_at
+        self.returned_at += newer.returned_at
+
+    def to_payload(self, book_id):
+        return {'book_id': book_id, 'is_available': self.is_available,
+                'borrowed_at': [at.replace(tzinfo=timezone.utc) for at in self.borrowed_at],
+                'returned_at': [at.replace(tzinfo=timezone.utc) for at in self.returned_at]}
+
+
+class UpdateCoalescer:
+    """
+    Merge availability updates per book and send them to the backend in batches.
+
+    The first update after a flush opens a window of `window` seconds; every update
+    of the same book within it replaces the pending state, so a book borrowed and
+    returned ten times costs one row in one update-books call. A window closes early
+    once `max_batch` books are pending. A batch the backend did not accept is kept
+    as it was sent, Idempotency-Key included, and resent ahead of the updates made
+    since, so a retry of a batch the backend did apply is replayed instead of
+    recording its borrows twice. Only connection errors and 5xx replies are retried;
+    a batch the backend refuses otherwise (4xx) is moved to `dead_letters` and logged,
+    so it does not hold up the updates behind it. At most `max_retrying` batches wait
+    for a retry; beyond that the oldest are dropped and logged. Pending updates are
+    flushed when the process exits.
+    """
+
+    def __init__(self, app, window, max_batch, max_retrying=100):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.max_retrying = max_retrying
+        self.pending = {}  # book_id -> PendingUpdate, in first-update order
+        self.retrying = []  # (idempotency key, payload) of unaccepted batches, oldest first
+        self.dead_letters = deque(maxlen=DEAD_LETTERS_KEPT)  # (idempotency key, payload, reason), latest last
+        self.sent_batches = self.sent_updates = self.merged_updates = self.failed_batches = 0
+        self.rejected_batches = self.dropped_batches = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._full = threading.Event()
+        self._stop = threading.Event()
+        self._pid = None
+
+    def submit(self, book_id, is_available, occurred_at):
+        """
+        Queue the new availability of a book for the next batch.
+
+        :param book_id: ID of the borrowed or returned book
+        :param is_available: New availability of the book
+        :param occurred_at: Time of the borrow or return (naive UTC)
+        """
+        self._ensure_started()
+        with self._lock:
+            update = self.pending.get(book_id)
+            if update is None:
+                update = self.pending[book_id] = PendingUpdate()
+            else:
+                self.merged_updates += 1
+            update.add(is_available, occurred_at)
+            if len(self.pending) >= self.max_batch:
+                self._full.set()
+        self._wake.set()
+
+    def flush(self):
+        """
+        Send the batches waiting for a retry, then every pending update, in batches of at most `max_batch` books.
+
+        :return: Number of books sent
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self.pending = self.pending, {}
+                self._wake.clear()
+                self._full.clear()
+                items = list(pending.items())
+                flushed_at = datetime.utcnow().isoformat()
+                for start in range(0, len(items), self.max_batch):
+                    batch = items[start:start + self.max_batch]
+                    # The key is fixed with the batch, so every retry of it carries the same one
+                    self.retrying.append((f'update-books:{batch[0][0]}:{batch[-1][0]}:{flushed_at}',
+                                          {'updates': [update.to_payload(book_id) for book_id, update in batch]}))
+                self._drop_overflow()
+            sent = 0
+            while self.retrying:
+                key, payload = self.retrying[0]
+                try:
+                    response = post_to_peer('BACKEND_SERVICE_URL', UPDATE_BOOKS_WEBHOOK_PATH, payload,
+                                            headers={IDEMPOTENCY_HEADER: key})
+                except (requests.RequestException, CircuitOpenError):
+                    self._retry_later()
+                    raise
+                except Exception as e:
+                    self._reject(key, payload, str(e) or type(e).__name__)
+                    continue
+                if response.status_code >= 500:
+                    self._retry_later()
+                    raise Exception(f'Backend failed update batch: HTTP {response.status_code}: {response.text}')
+                if response.status_code != 200:
+                    self._reject(key, payload, f'HTTP {response.status_code}: {response.text}')
+                    continue
+                sent += len(payload['updates'])
+                with self._lock:
+                    self.retrying.pop(0)
+                    self.sent_batches += 1
+                    self.sent_updates += len(payload['updates'])
+            return sent
+
+    def _retry_later(self):
+        # The batch stays first in line, with its key, for the next window
+        with self._lock:
+            self.failed_batches += 1
+            self._wake.set()
+
+    def _reject(self, key, payload, reason):
+        # A refused batch would be refused again; set it aside so the batches behind it go through
+        self.app.logger.error('Backend refused coalesced update batch %s (%d books), moved to dead letters: %s',
+                              key, len(payload['updates']), reason)
+        with self._lock:
+            self.retrying.pop(0)
+            self.dead_letters.append((key, payload, reason))
+            self.rejected_batches += 1
+
+    def _drop_overflow(self):
+        # Called with self._lock held
+        while len(self.retrying) > self.max_retrying:
+            key, payload = self.retrying.pop(0)
+            self.dropped_batches += 1
+            self.app.logger.error('Coalesced update batch %s (%d books) dropped: more than %d batches await a retry',
+                                  key, len(payload['updates']), self.max_retrying)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            # Let the churn of the window collect, unless the batch fills up first
+            self._full.wait(self.window)
+            if self._stop.is_set():
+                return
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    self.app.logger.error('Coalesced book update failed, retrying with the next window: %s', e)
+                    self._stop.wait(self.window)
+
+    def _ensure_started(self):
+        # Once per process, so workers forked from a preloaded app run their own thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='update-coalescer', daemon=True).start()
+                atexit.register(self.close)
+
+    def stop(self):
+        """Stop the sending thread."""
+        self._stop.set()
+        self._wake.set()
+        self._full.set()
+
+    def close(self):
+        """
+        Stop the sending thread and flush what is still queued.
+
+        Registered with atexit by the process that queues updates, so a worker that
+        shuts down cleanly does not drop its last window. A killed process still loses
+        it; keep UPDATE_COALESCE_WINDOW short.
+        """
+        self.stop()
+        with self.app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.error('Coalesced book updates lost at shutdown (%d books, %d batches): %s',
+                                      len(self.pending), len(self.retrying), e)
+
+    def to_dict(self):
+        with self._lock:
+            return {'window': self.window, 'pending': len(self.pending), 'retrying': len(self.retrying),
+                    'sent_batches': self.sent_batches, 'sent_updates': self.sent_updates,
+                    'merged_updates': self.merged_updates, 'failed_batches': self.failed_batches,
+                    'rejected_batches': self.rejected_batches, 'dropped_batches': self.dropped_batches}
+
+
+def notify_availability(book_id, is_available, occurred_at, idempotency_key):
+    """
+    Tell the backend about a borrow or return.
+
+    With UPDATE_COALESCE_WINDOW set the update is queued for the next coalesced
+    batch and None is returned; otherwise it is sent right away to the update-book
+    webhook and the backend's response is returned.
+
+    :param book_id: ID of the borrowed or returned book
+    :param is_available: New availability of the book
+    :param occurred_at: Time of the borrow or return (naive UTC)
+    :param idempotency_key: Idempotency key of the single update
+    """
+    coalescer = current_app.extensions.get('update_coalescer')
+    if coalescer is not None:
+        coalescer.submit(book_id, is_available, occurred_at)
+        return None
+    payload = {'book_id': book_id, 'is_available': is_available,
+               'occurred_at': occurred_at.replace(tzinfo=timezone.utc)}
+    return post_to_peer('BACKEND_SERVICE_URL', UPDATE_BOOK_WEBHOOK_PATH, payload,
+                        headers={IDEMPOTENCY_HEADER: idempotency_key})
+
+
+def notify_availability_many(book_ids, is_available, occurred_at, idempotency_key):
+    """
+    Tell the backend about books borrowed or returned together, in one call.
+
+    Like notify_availability(), but without a coalescer the books are sent as one
+    batch to the update-books webhook.
+
+    :param book_ids: IDs of the borrowed or returned books
+    :param is_available: New availability of the books
+    :param occurred_at: Time of the borrow or return (naive UTC)
+    :param idempotency_key: Idempotency key of the batch
+    :return: The backend's response, or None if the updates were queued
+    """
+    coalescer = current_app.extensions.get('update_coalescer')
+    if coalescer is not None:
+        for book_id in book_ids:
+            coalescer.submit(book_id, is_available, occurred_at)
+        return None
+    updates = []
+    for book_id in book_ids:
+        update = PendingUpdate()
+        update.add(is_available, occurred_at)
+        updates.append(update.to_payload(book_id))
+    return post_to_peer('BACKEND_SERVICE_URL', UPDATE_BOOKS_WEBHOOK_PATH, {'updates': updates},
+                        headers={IDEMPOTENCY_HEADER: idempotency_key})
+
+
+def register_update_coalescer(app):
+    """
+    Attach an update coalescer to the app if UPDATE_COALESCE_WINDOW is set, and expose its counters to admins.
+
+    :param app: Flask application instance
+    """
+    if app.config['UPDATE_COALESCE_WINDOW'] > 0:
+        app.extensions['update_coalescer'] = UpdateCoalescer(
+            app, app.config['UPDATE_COALESCE_WINDOW'], app.config['UPDATE_COALESCE_MAX_BATCH'],
+            app.config['UPDATE_COALESCE_MAX_RETRYING'])
+
+    @app.route('/debug/update-coalescer', methods=['GET'])
+    @admin_required(app)
+    def update_coalescer_stats():
+        coalescer = app.extensions.get('update_coalescer')
+        return jsonify(coalescer.to_dict() if coalescer is not None else {'window': 0}), 200
@@ -0,0 +1,40 @@
+from functools import wraps
+from flask import request
+from flask import current_app as app
+from models.idempotency_key import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def idempotent(view):
+    """
+    Make a webhook view safe to retry by honouring the Idempotency-Key header.
+
+    The first request with a given key is processed and its response recorded for
+    IDEMPOTENCY_KEY_TTL seconds; retries with the same key replay the recorded
+    response without touching the handler. Requests without the header are
+    processed as usual.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+
+        scoped_key = f'{request.endpoint}:{key}'
+        record = IdempotencyKey.get_active(scoped_key)
+        if record:
+            response = app.response_class(record.response_body, status=record.status_code,
+                                          mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        response = app.make_response(view(*args, **kwargs))
+
+        # Only remember outcomes that a retry would reproduce anyway
+        if response.status_code < 500:
+            IdempotencyKey.record(scoped_key, response.status_code, response.get_data(as_text=True),
+                                  app.config['IDEMPOTENCY_KEY_TTL'])
+        return response
+
+    return wrapper
@@ -0,0 +1,316 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app as app, jsonify
+from config.profiling import admin_required
+from config.tracing import start_client_span
+from api.v1.schemas import encode_payload
+
+_session = None
+_session_lock = threading.Lock()
+_fan_out_pool = None
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a peer endpoint whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker for one peer endpoint.
+
+    Closed: calls go through and their outcomes are tracked over a sliding window.
+    Open: calls fail immediately with CircuitOpenError for `open_seconds`.
+    Half-open: a single probe call is let through; its outcome closes or re-opens the breaker.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, window, min_calls, failure_rate, open_seconds):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.results = deque(maxlen=window)
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.rejected = 0
+        self.transitions = deque(maxlen=20)
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.transitions.append({'from': self.state, 'to': state, 'at': datetime.utcnow().isoformat()})
+        app.logger.warning('Circuit breaker %s: %s -> %s', self.name, self.state, state)
+        self.state = state
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+        self.results.clear()
+
+    def before_call(self):
+        """Admit a call, or raise CircuitOpenError if the breaker is open."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self._transition(self.HALF_OPEN)
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self.probe_in_flight):
+                self.rejected += 1
+                raise CircuitOpenError(f'Circuit breaker for {self.name} is open')
+            if self.state == self.HALF_OPEN:
+                self.probe_in_flight = True
+
+    def record(self, success):
+        """Record the outcome of an admitted call."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.probe_in_flight = False
+                self._transition(self.CLOSED if success else self.OPEN)
+                return
+            self.results.append(success)
+            failures = self.results.count(False)
+            if len(self.results) >= self.min_calls and failures / len(self.results) >= self.failure_rate:
+                self._transition(self.OPEN)
+
+    def to_dict(self):
+        """
+        Convert the breaker state to a dictionary for monitoring.
+
+        :return: Dictionary representation of the breaker
+        """
+        with self._lock:
+            return {
+                'state': self.state,
+                'window_calls': len(self.results),
+                'window_failures': self.results.count(False),
+                'rejected': self.rejected,
+                'transitions': list(self.transitions),
+            }
+
+
+def get_circuit_breaker(name):
+    """
+    Get the app's circuit breaker for a peer endpoint, creating it on first use.
+
+    :param name: Peer endpoint URL
+    """
+    breakers = app.extensions.setdefault('circuit_breakers', {})
+    breaker = breakers.get(name)
+    if breaker is None:
+        with _session_lock:
+            breaker = breakers.setdefault(name, CircuitBreaker(
+                name, app.config['CIRCUIT_BREAKER_WINDOW'], app.config['CIRCUIT_BREAKER_MIN_CALLS'],
+                app.config['CIRCUIT_BREAKER_FAILURE_RATE'], app.config['CIRCUIT_BREAKER_OPEN_SECONDS']))
+    return breaker
+
+
+def get_peer_session():
+    """
+    Return the process-wide HTTP session used for service-to-service calls.
+
+    Reusing one session keeps connections to the peer alive across requests
+    instead of paying a TCP handshake per webhook.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # One connection pool per peer host, so fan-out to many subscribers does not evict pools
+                hosts = 2 + sum(len(urls) for urls in app.config['WEBHOOK_SUBSCRIBERS'].values())
+                adapter = HTTPAdapter(pool_connections=max(4, hosts), pool_maxsize=app.config['PEER_POOL_SIZE'])
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def post_to_peer(base_url_key, path, payload, headers=None):
+    """
+    POST a payload to the peer service through the endpoint's circuit breaker.
+
+    The payload is sent as JSON, or as MessagePack when PEER_WIRE_FORMAT is
+    'msgpack'; timezone-aware datetimes are sent natively in both. Any exception
+    (connection errors, timeouts, ...) and 5xx responses count as failures. While
+    the breaker is open the call fails immediately with CircuitOpenError. Traced
+    requests pass their trace context on in the traceparent header.
+
+    :param base_url_key: Config key holding the peer's base URL, e.g. 'FRONTEND_SERVICE_URL'
+    :param path: Path of the peer endpoint
+    :param payload: Payload of dictionaries, lists, scalars and datetimes
+    :param headers: Optional extra headers
+    :return: The peer's response
+    """
+    body, content_type = encode_payload(payload, app.config['PEER_WIRE_FORMAT'] == 'msgpack')
+    return _post(app.config[base_url_key], path, body, content_type, headers)
+
+
+def _post(base_url, path, body, content_type, headers):
+    url = f"{base_url}{path}"
+    breaker = get_circuit_breaker(url)
+    breaker.before_call()
+    span = None
+    try:
+        headers = dict(headers or {}, **{'Content-Type': content_type})
+        span = start_client_span(f'POST {path}', headers, {'http.method': 'POST', 'http.url': url})
+        response = get_peer_session().post(url, data=body, headers=headers, timeout=app.config['PEER_TIMEOUT'])
+    except Exception as e:
+        # Any failure after admission must be recorded, or a half-open probe would never finish
+        breaker.record(False)
+        if span is not None:
+            span.end(e)
+        raise
+    breaker.record(response.status_code < 500)
+    if span is not None:
+        span.attributes['http.status_code'] = response.status_code
+        span.end(f'HTTP {response.status_code}' if response.status_code >= 500 else None)
+    return response
+
+
+class SubscriberStats:
+    """Delivery outcomes of one webhook subscriber."""
+
+    def __init__(self):
+        self.delivered = self.failed = 0
+        self.last_status = self.last_error = self.last_delivered_at = self.last_failed_at = None
+        self._lock = threading.Lock()
+
+    def record(self, delivery):
+        with self._lock:
+            now = datetime.utcnow().isoformat()
+            self.last_status = delivery.response.status_code if delivery.response is not None else None
+            if delivery.ok:
+                self.delivered += 1
+                self.last_delivered_at = now
+            else:
+                self.failed += 1
+                self.last_failed_at = now
+                self.last_error = delivery.error
+
+    def to_dict(self):
+        with self._lock:
+            return {'delivered': self.delivered, 'failed': self.failed, 'last_status': self.last_status,
+                    'last_error': self.last_error, 'last_delivered_at': self.last_delivered_at,
+                    'last_failed_at': self.last_failed_at}
+
+
+class Delivery:
+    """Outcome of one webhook call to one subscriber."""
+
+    __slots__ = ('url', 'response', 'error')
+
+    def __init__(self, url, response=None, error=None):
+        self.url = url
+        self.response = response
+        self.error = error if error is not None or response is None or response.status_code == 200 \
+            else f'HTTP {response.status_code}: {response.text}'
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class FanOutResult:
+    """Deliveries of one event to every subscriber."""
+
+    def __init__(self, deliveries):
+        self.deliveries = deliveries
+
+    @property
+    def ok(self):
+        return all(delivery.ok for delivery in self.deliveries)
+
+    @property
+    def failures(self):
+        return [delivery for delivery in self.deliveries if not delivery.ok]
+
+    def describe_failures(self):
+        return '; '.join(f'{delivery.url}: {delivery.error}' for delivery in self.failures)
+
+
+def get_subscribers(base_url_key):
+    """
+    Get the base URLs of the webhook subscribers for a peer service.
+
+    :param base_url_key: Config key of the peer service, e.g. 'FRONTEND_SERVICE_URL'
+    :return: The URLs configured in WEBHOOK_SUBSCRIBERS, or the peer's single base URL
+    """
+    return app.config['WEBHOOK_SUBSCRIBERS'].get(base_url_key) or [app.config[base_url_key]]
+
+
+def get_subscriber_stats(url):
+    """Get the delivery statistics of a subscriber, creating them on first use."""
+    stats = app.extensions.setdefault('subscriber_stats', {})
+    subscriber = stats.get(url)
+    if subscriber is None:
+        with _session_lock:
+            subscriber = stats.setdefault(url, SubscriberStats())
+    return subscriber
+
+
+def _get_fan_out_pool():
+    global _fan_out_pool
+    if _fan_out_pool is None:
+        with _session_lock:
+            if _fan_out_pool is None:
+                _fan_out_pool = ThreadPoolExecutor(max_workers=app.config['WEBHOOK_FANOUT_WORKERS'],
+                                                   thread_name_prefix='webhook-fan-out')
+    return _fan_out_pool
+
+
+def _deliver(base_url, path, body, content_type, headers):
+    try:
+        delivery = Delivery(base_url, response=_post(base_url, path, body, content_type, headers))
+    except Exception as e:
+        delivery = Delivery(base_url, error=str(e) or type(e).__name__)
+    get_subscriber_stats(base_url).record(delivery)
+    return delivery
+
+
+def fan_out(base_url_key, path, payload, headers=None):
+    """
+    POST a payload to every webhook subscriber of a peer service at once.
+
+    The payload is encoded once; the calls run concurrently on a bounded thread pool
+    shared by the process (WEBHOOK_FANOUT_WORKERS), each through its own circuit
+    breaker, so an event costs the latency of the slowest subscriber rather than
+    the sum. Each call runs in a copy of the caller's context, so it sees the app
+    and continues the caller's trace.
+
+    :param base_url_key: Config key of the peer service, e.g. 'FRONTEND_SERVICE_URL'
+    :param path: Path of the webhook endpoint
+    :param payload: Payload of dictionaries, lists, scalars and datetimes
+    :param headers: Optional extra headers
+    :return: FanOutResult with one delivery per subscriber, in subscriber order
+    """
+    subscribers = get_subscribers(base_url_key)
+    body, content_type = encode_payload(payload, app.config['PEER_WIRE_FORMAT'] == 'msgpack')
+    if len(subscribers) == 1:
+        return FanOutResult([_deliver(subscribers[0], path, body, content_type, headers)])
+    pool = _get_fan_out_pool()
+    futures = [pool.submit(contextvars.copy_context().run, _deliver, url, path, body, content_type, headers)
+               for url in subscribers]
+    return FanOutResult([future.result() for future in futures])
+
+
+def register_peer_monitoring(app):
+    """
+    Expose the state and recent transitions of every peer circuit breaker, and the
+    delivery statistics of every webhook subscriber, to admins only.
+
+    :param app: Flask application instance
+    """
+    @app.route('/debug/circuit-breakers', methods=['GET'])
+    @admin_required(app)
+    def list_circuit_breakers():
+        breakers = app.extensions.get('circuit_breakers', {})
+        return jsonify({name: breaker.to_dict() for name, breaker in list(breakers.items())}), 200
+
+    @app.route('/debug/subscribers', methods=['GET'])
+    @admin_required(app)
+    def list_subscribers():
+        stats = app.extensions.get('subscriber_stats', {})
+        return jsonify({url: subscriber.to_dict() for url, subscriber in list(stats.items())}), 200
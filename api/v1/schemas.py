@@ -0,0 +1,294 @@
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Annotated, List, Union, get_args, get_origin
+import msgspec
+from flask import jsonify, request
+
+# Payload fields that must be present and non-empty
+Required = Annotated[str, msgspec.Meta(min_length=1)]
+OptionalDatetime = Union[datetime, None, msgspec.UnsetType]
+MISSING = 'Missing required field'
+
+# Content types of the compact binary encoding for service-to-service calls
+MSGPACK_MIMETYPE = 'application/msgpack'
+MSGPACK_MIMETYPES = {MSGPACK_MIMETYPE, 'application/x-msgpack', 'application/vnd.msgpack'}
+JSON_MIMETYPE = 'application/json'
+
+# (name, is a list) of the datetime and list-of-datetime fields of each payload schema
+_datetime_fields = {}
+
+
+def _schema_datetime_fields(schema):
+    names = _datetime_fields.get(schema)
+    if names is None:
+        names = _datetime_fields[schema] = tuple(
+            (field.name, get_origin(field.type) is list) for field in msgspec.structs.fields(schema)
+            if field.type is datetime or datetime in get_args(field.type))
+    return names
+
+
+def _naive_utc(value):
+    tz = getattr(value, 'tzinfo', None)
+    if tz is None:
+        return value
+    return (value if tz is timezone.utc else value.astimezone(timezone.utc)).replace(tzinfo=None)
+
+
+class Payload(msgspec.Struct):
+    """
+    Base class of request payload schemas.
+
+    Unknown keys are ignored. Optional fields default to UNSET so that values()
+    only returns the keys the client actually sent.
+
+    Datetimes are UTC: naive, or aware (native MessagePack timestamps, JSON strings
+    ending in Z or carrying an offset). Aware values are converted to UTC and made
+    naive, like the DateTime columns they are written to; a driver given an aware
+    value for a naive column may store it in its session time zone instead.
+    """
+
+    def __post_init__(self):
+        for name, is_list in _schema_datetime_fields(type(self)):
+            value = getattr(self, name)
+            if is_list:
+                if any(getattr(item, 'tzinfo', None) is not None for item in value):
+                    setattr(self, name, [_naive_utc(item) for item in value])
+            elif getattr(value, 'tzinfo', None) is not None:
+                setattr(self, name, _naive_utc(value))
+
+    def values(self):
+        """
+        Get the fields that were present in the payload.
+
+        :return: Dictionary of field values, without UNSET fields
+        """
+        data = msgspec.structs.asdict(self)
+        if msgspec.UNSET in data.values():
+            return {field: value for field, value in data.items() if value is not msgspec.UNSET}
+        return data
+
+
+class BookCreate(Payload):
+    title: Required
+    publisher: Required
+    category: Required
+
+
+class UserEnroll(Payload):
+    email: Required
+    firstname: Required
+    lastname: Required
+
+
+class BorrowRequest(Payload):
+    days: Annotated[int, msgspec.Meta(gt=0)]
+
+
+# Books one checkout may claim at once
+CHECKOUT_MAX_BOOKS = 50
+
+
+class CheckoutRequest(Payload):
+    book_ids: Annotated[List[Annotated[str, msgspec.Meta(min_length=1)]],
+                        msgspec.Meta(min_length=1, max_length=CHECKOUT_MAX_BOOKS)]
+    days: Annotated[int, msgspec.Meta(gt=0)]
+
+
+class BookData(Payload):
+    id: Required
+    title: Union[str, msgspec.UnsetType] = msgspec.UNSET
+    publisher: Union[str, msgspec.UnsetType] = msgspec.UNSET
+    category: Union[str, msgspec.UnsetType] = msgspec.UNSET
+    is_available: Union[bool, None, msgspec.UnsetType] = msgspec.UNSET
+    borrowed_at: OptionalDatetime = msgspec.UNSET
+    return_by: OptionalDatetime = msgspec.UNSET
+    borrowed_by_id: Union[int, str, None, msgspec.UnsetType] = msgspec.UNSET
+    created_at: OptionalDatetime = msgspec.UNSET
+    updated_at: OptionalDatetime = msgspec.UNSET
+
+
+class UserData(Payload):
+    id: Required
+    email: Union[str, msgspec.UnsetType] = msgspec.UNSET
+    firstname: Union[str, msgspec.UnsetType] = msgspec.UNSET
+    lastname: Union[str, msgspec.UnsetType] = msgspec.UNSET
+    created_at: OptionalDatetime = msgspec.UNSET
+    updated_at: OptionalDatetime = msgspec.UNSET
+
+
+class AddBookWebhook(Payload):
+    book_data: BookData
+
+
+class AddBooksWebhook(Payload):
+    books: Annotated[List[BookData], msgspec.Meta(min_length=1)]
+
+
+class RemoveBookWebhook(Payload):
+    book_id: Required
+
+
+class AddUserWebhook(Payload):
+    user_data: UserData
+
+
+class UpdateBookWebhook(Payload):
+    book_id: Required
+    is_available: bool
+    occurred_at: OptionalDatetime = msgspec.UNSET  # time of the borrow or return
+
+
+class BookUpdate(Payload):
+    book_id: Required
+    is_available: bool  # latest state, the one to apply
+    borrowed_at: List[datetime] = []  # every borrow merged into this update
+    returned_at: List[datetime] = []  # every return merged into this update
+
+
+class UpdateBooksWebhook(Payload):
+    updates: Annotated[List[BookUpdate], msgspec.Meta(min_length=1)]
+
+
+class OverdueBook(Payload):
+    book_id: Required
+    return_by: datetime
+
+
+class OverdueBooksWebhook(Payload):
+    books: Annotated[List[OverdueBook], msgspec.Meta(min_length=1)]
+
+
+_decoders = {}
+_json_encoder = msgspec.json.Encoder()
+_msgpack_encoder = msgspec.msgpack.Encoder()
+
+
+def is_msgpack(mimetype):
+    """Whether a content type is MessagePack."""
+    return mimetype in MSGPACK_MIMETYPES
+
+
+def get_decoder(schema, msgpack=False):
+    """Return the JSON (or MessagePack) decoder compiled for a schema, compiling it on first use."""
+    decoder = _decoders.get((schema, msgpack))
+    if decoder is None:
+        decoder = msgspec.msgpack.Decoder(schema) if msgpack else msgspec.json.Decoder(schema)
+        _decoders[schema, msgpack] = decoder
+    return decoder
+
+
+def encode_payload(payload, msgpack=False):
+    """
+    Encode an outgoing payload as JSON or MessagePack.
+
+    Timezone-aware datetimes are sent natively: as MessagePack timestamps, or as
+    RFC 3339 strings in JSON.
+
+    :param payload: Payload of dictionaries, lists and scalars
+    :param msgpack: Encode as MessagePack instead of JSON
+    :return: Tuple of (body, content type)
+    """
+    if msgpack:
+        return _msgpack_encoder.encode(payload), MSGPACK_MIMETYPE
+    return _json_encoder.encode(payload), JSON_MIMETYPE
+
+
+def _join(path, name):
+    return f'{path}.{name}' if path else name
+
+
+def _collect_errors(schema, value, path, errors):
+    """
+    Record an error for every invalid field of a decoded JSON value.
+
+    Only used once fast decoding has failed: the decoder stops at the first error,
+    this walks the whole payload so the client gets all of them at once.
+    """
+    try:
+        msgspec.convert(value, schema)
+        return
+    except msgspec.ValidationError as e:
+        message = str(e).split(' - at ')[0]
+
+    found = len(errors)
+    inner = get_args(schema)[0] if get_origin(schema) is Annotated else schema
+    if isinstance(inner, type) and issubclass(inner, msgspec.Struct) and isinstance(value, dict):
+        for field in msgspec.structs.fields(inner):
+            if field.encode_name in value:
+                _collect_errors(field.type, value[field.encode_name], _join(path, field.name), errors)
+            elif field.required:
+                errors[_join(path, field.name)] = MISSING
+    elif get_origin(inner) in (list, List) and isinstance(value, list):
+        item_schema = get_args(inner)[0]
+        for index, item in enumerate(value):
+            _collect_errors(item_schema, item, f'{path}[{index}]', errors)
+    if len(errors) == found:
+        errors[path or '$'] = message
+
+
+def field_errors(schema, body, msgpack=False):
+    """
+    Explain why a request body does not match a schema.
+
+    :param schema: Payload schema
+    :param body: Raw request body
+    :param msgpack: The body is MessagePack instead of JSON
+    :return: Dictionary of field path -> error message
+    """
+    try:
+        value = msgspec.msgpack.decode(body) if msgpack else msgspec.json.decode(body)
+    except msgspec.DecodeError as e:
+        return {'$': str(e)}
+    errors = {}
+    _collect_errors(schema, value, '', errors)
+    return errors
+
+
+def error_response(errors):
+    """Build the 400 response for a list of field errors."""
+    missing = [path for path, message in errors.items() if message == MISSING]
+    invalid = [path for path, message in errors.items() if message != MISSING]
+    summary = []
+    if missing:
+        summary.append(f"Missing required fields: {', '.join(missing)}")
+    if invalid:
+        summary.append(f"Invalid fields: {', '.join(invalid)}")
+    return jsonify({"message": '; '.join(summary), "errors": errors}), 400
+
+
+def decode_payload(schema, body, msgpack=False):
+    """
+    Decode and validate a request body in a single pass.
+
+    :param schema: Payload schema
+    :param body: Raw request body
+    :param msgpack: The body is MessagePack instead of JSON
+    :return: Tuple of (decoded payload, None), or (None, field errors) if the body is invalid
+    """
+    try:
+        return get_decoder(schema, msgpack).decode(body), None
+    except msgspec.DecodeError:
+        return None, field_errors(schema, body, msgpack)
+
+
+def validate_payload(schema):
+    """
+    Decode the body of a view's request with a schema and pass it as `payload`.
+
+    Bodies sent as MessagePack (see MSGPACK_MIMETYPES) are decoded as such, any
+    other body as JSON. Requests whose body does not match the schema are rejected
+    with 400 and the error of every invalid field, before the view runs.
+
+    :param schema: Payload schema
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            payload, errors = decode_payload(schema, request.get_data(), is_msgpack(request.mimetype))
+            if errors:
+                return error_response(errors)
+            return view(*args, payload=payload, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -12,9 +12,23 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from config.base_database import db, init_db
 from config.config import setup_logging, get_config
 from config.error_handlers import register_error_handlers
+from config.compression import register_compression
+from config.rate_limit import register_rate_limiter
+from config.tracing import register_tracing
+from config.profiling import register_profiling
+from config.memory_profiling import register_memory_profiling
+from config.read_replicas import register_read_replicas
+from config.query_cache import register_query_cache
+from api.v1.peer_client import register_peer_monitoring
+from config.readiness import register_readiness
 from api.v1.backend.backend_view import backend_bp
+from api.v1.backend.catalog_import import register_import_command
 
 
+# Hottest read endpoints, requested once by each worker before it reports ready. They list whole
+# tables, so they are only requested when the query cache (QUERY_CACHE_SIZE) keeps the results
+WARMUP_PATHS = ['/api/v1/backend/admin/users', '/api/v1/backend/admin/books/unavailable']
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -36,13 +50,43 @@ def create_app():
     # Register error handlers
     register_error_handlers(app)
 
+    # Trace requests, SQL statements and peer calls (first, so the request span covers every hook)
+    register_tracing(app, 'backend')
+
+    # Admin-only sampling profiler and per-request cProfile
+    register_profiling(app)
+
+    # Per-route allocation peaks, session identity-map sizes and allocation snapshots, if enabled
+    register_memory_profiling(app, db)
+
+    # Shed excess load before any view or DB work starts
+    register_rate_limiter(app)
+
+    # Compress responses (registered first so it runs after the response logger)
+    register_compression(app)
+
     # Initialize SQLAlchemy with the Flask app
     init_db(app)
     Migrate(app, db)
 
+    # Route read-only endpoints to the read replicas, if any are configured
+    register_read_replicas(app, db)
+
+    # Cache get_all/get_first results of opted-in models, if enabled
+    register_query_cache(app)
+
     # Register the Blueprint with the Flask application
     app.register_blueprint(backend_bp)
 
+    # Register the `flask import-books` bulk import command
+    register_import_command(app)
+
+    # Expose peer circuit breaker state for monitoring
+    register_peer_monitoring(app)
+
+    # Liveness and readiness probes; readiness waits for the pool, peer and hot endpoints to be warm
+    register_readiness(app, db, 'FRONTEND_SERVICE_URL', WARMUP_PATHS if app.config['QUERY_CACHE_SIZE'] > 0 else [])
+
     # Log request information before each request
     @app.before_request
     def log_request_info():
@@ -51,7 +95,11 @@ def create_app():
     # Log response information after each request
     @app.after_request
     def log_response_info(response):
-        app.logger.info('Response: %s %s', response.status, response.get_data(as_text=True))
+        # Do not buffer streamed bodies or decode compressed ones
+        if response.is_streamed or response.content_encoding:
+            app.logger.info('Response: %s <%s body>', response.status, response.content_encoding or 'streamed')
+        else:
+            app.logger.info('Response: %s %s', response.status, response.get_data(as_text=True))
         return response
     
     return app
@@ -1,11 +1,31 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
 import pytest
+import tempfile
+import threading
+import time
+import requests
 import uuid
 import requests_mock
+from unittest import mock
 from flask_testing import TestCase
 from app import create_app
+from api.v1.peer_client import CircuitOpenError, get_circuit_breaker, post_to_peer
+from config.asgi import ThreadOffloadASGIApp
+from config.tracing import Tracer
+from config.unit_of_work import after_commit, unit_of_work
 from config.base_database import db, init_db
 from models.book import Book
 from models.user import User
+from models.borrow_event import BorrowEvent
+from models.idempotency_key import IdempotencyKey
+from models.borrow_rollup import RollupWatermark
+from datetime import datetime, timedelta
+from sqlalchemy import event
 
 class TestBackendViews(TestCase):
     def create_app(self):
@@ -77,6 +97,17 @@ class TestBackendViews(TestCase):
         assert len(response.json) == 1
         assert response.json[0]['email'] == 'test_user@example.com'
 
+    def test_list_users_with_borrowed_books(self):
+        user = User(id=str(uuid.uuid4()), email='borrower@example.com', firstname='Test', lastname='User')
+        user.save()
+        Book(title='Borrowed Book', publisher='Test Publisher', category='Test Category',
+             is_available=False, borrowed_by_id=user.id).save()
+
+        response = self.client.get('/api/v1/backend/admin/users/books')
+
+        assert response.status_code == 200
+        assert response.json[0]['is_available'] == [False]
+
     def test_list_unavailable_books(self):
         book = Book(title='Test Book', publisher='Test Publisher', category='Test Category', is_available=False)
         book.save()
@@ -115,5 +146,418 @@ class TestBackendViews(TestCase):
         assert response.status_code == 200
         assert response.json['message'] == 'Book status updated successfully'
 
+    def test_add_user_webhook_redelivery_is_idempotent(self):
+        user_id = str(uuid.uuid4())
+        payload = {'user_data': {'id': user_id, 'firstname': 'New', 'lastname': 'User',
+                                 'email': 'new_user@example.com'}}
+        self.client.post('/api/v1/backend/admin/webhooks/add-user', json=payload)
+
+        payload['user_data']['lastname'] = 'Renamed'
+        response = self.client.post('/api/v1/backend/admin/webhooks/add-user', json=payload)
+
+        assert response.status_code == 200
+        assert User.query.count() == 1
+        assert db.session.get(User, user_id).lastname == 'Renamed'
+
+    def test_webhook_idempotency_key_replays_response(self):
+        headers = {'Idempotency-Key': 'update-book:missing'}
+        payload = {'book_id': 'missing', 'is_available': True}
+
+        first = self.client.post('/api/v1/backend/admin/webhooks/update-book', json=payload, headers=headers)
+        second = self.client.post('/api/v1/backend/admin/webhooks/update-book', json=payload, headers=headers)
+
+        assert first.status_code == 404
+        assert second.status_code == 404
+        assert second.headers['Idempotent-Replayed'] == 'true'
+        assert second.json == first.json
+
+    def test_warmup_skips_full_table_listings_without_query_cache(self):
+        steps = [name for name, _, _ in self.app.extensions['warmup'].steps]
+        assert self.app.config['QUERY_CACHE_SIZE'] == 0
+        assert steps == ['database', 'peer']
+
+    def test_idempotency_key_record_drops_duplicates_and_logs_other_failures(self):
+        IdempotencyKey.record('race', 200, '{}', 60)
+        with self.assertNoLogs(self.app.logger, 'WARNING'):
+            IdempotencyKey.record('race', 200, '{}', 60)  # the concurrent request that lost the race
+        assert IdempotencyKey.query.filter_by(key='race').count() == 1
+
+        with mock.patch.object(db.session, 'add', side_effect=RuntimeError('no such table: idempotency_keys')), \
+                self.assertLogs(self.app.logger, 'WARNING') as logs:
+            IdempotencyKey.record('lost', 200, '{}', 60)
+        assert 'lost' in logs.output[0] and 'no such table' in logs.output[0]
+
+    def test_overdue_books_webhook(self):
+        book = Book(title='Overdue Book', publisher='Test Publisher', category='Test Category')
+        book.save()
+
+        response = self.client.post('/api/v1/backend/admin/webhooks/overdue-books', json={
+            'books': [{'book_id': book.id, 'return_by': '2024-01-08T00:00:00'},
+                      {'book_id': 'removed_book_id', 'return_by': '2024-01-08T00:00:00'}]
+        })
+
+        assert response.status_code == 200
+        db.session.expire_all()
+        assert book.is_available is False
+        assert book.return_by.isoformat() == '2024-01-08T00:00:00'
+
+    def test_asgi_mode_serves_blueprint(self):
+        asgi_app = ThreadOffloadASGIApp(self.app, max_threads=4)
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/v1/backend/admin/users',
+                 'query_string': b'', 'headers': [(b'accept', b'application/json')]}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi_app(scope, receive, send))
+
+        assert messages[0]['status'] == 200
+        assert json.loads(b''.join(message.get('body', b'') for message in messages[1:])) == []
+        assert messages[-1]['more_body'] is False
+
+    def test_asgi_adapter_aborts_response_when_body_fails_after_start(self):
+        def failing_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/csv')])
+            yield b'id,title\n'
+            raise RuntimeError('database went away')
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/export', 'query_string': b'', 'headers': []}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        with pytest.raises(RuntimeError, match='database went away'):
+            asyncio.run(ThreadOffloadASGIApp(failing_app, max_threads=1)(scope, receive, send))
+        assert messages[0]['status'] == 200
+        assert [message.get('more_body') for message in messages[1:]] == [True]
+
+    def test_circuit_breaker_fails_fast_when_frontend_is_down(self):
+        url = 'http://frontend:5001/api/v1/frontend/webhooks/add-book'
+        with requests_mock.Mocker() as m:
+            m.post(url, exc=requests.exceptions.ConnectionError)
+            for index in range(5):
+                self.client.post('/api/v1/backend/admin/books/add', json={
+                    'title': f'Book {index}', 'publisher': 'Test Publisher', 'category': 'Test Category'})
+            assert m.call_count == 5
+
+            response = self.client.post('/api/v1/backend/admin/books/add', json={
+                'title': 'Book 5', 'publisher': 'Test Publisher', 'category': 'Test Category'})
+            assert response.status_code == 500
+            assert 'is open' in response.json['message']
+            assert m.call_count == 5
+
+        assert self.client.get('/debug/circuit-breakers').status_code == 404
+        self.app.config['DEBUG_ADMIN_TOKEN'] = 'secret'
+        try:
+            assert self.client.get('/debug/circuit-breakers').status_code == 403
+            breakers = self.client.get('/debug/circuit-breakers', headers={'X-Admin-Token': 'secret'}).json
+        finally:
+            self.app.config['DEBUG_ADMIN_TOKEN'] = None
+        assert breakers[url]['state'] == 'open'
+        assert breakers[url]['rejected'] == 1
+        assert breakers[url]['transitions'][-1]['to'] == 'open'
+
+    def test_circuit_breaker_half_open_probe_closes_on_success(self):
+        with self.app.test_request_context():
+            breaker = get_circuit_breaker('http://frontend:5001/probe')
+            for _ in range(5):
+                breaker.before_call()
+                breaker.record(False)
+            assert breaker.state == 'open'
+
+            breaker.opened_at -= breaker.open_seconds
+            breaker.before_call()
+            assert breaker.state == 'half_open'
+            with pytest.raises(CircuitOpenError):
+                breaker.before_call()
+            breaker.record(True)
+            assert breaker.state == 'closed'
+
+    def test_circuit_breaker_probe_that_raises_reopens_the_breaker(self):
+        url = 'http://frontend:5001/api/v1/frontend/webhooks/add-book'
+        with self.app.test_request_context():
+            breaker = get_circuit_breaker(url)
+            for _ in range(5):
+                breaker.before_call()
+                breaker.record(False)
+            breaker.opened_at -= breaker.open_seconds
+
+            # Not a requests exception, yet it still ends the probe
+            with requests_mock.Mocker() as m:
+                m.post(url, exc=ValueError('bad header'))
+                with pytest.raises(ValueError):
+                    post_to_peer('FRONTEND_SERVICE_URL', '/api/v1/frontend/webhooks/add-book', {})
+            assert breaker.state == 'open'
+            assert not breaker.probe_in_flight
+
+    def test_export_users_csv_streams_all_chunks(self):
+        empty = self.client.get('/api/v1/backend/admin/export/users?format=csv').get_data(as_text=True)
+        assert empty.splitlines() == [','.join(column.name for column in User.__table__.columns)]
+
+        for index in range(5):
+            User(email=f'user{index}@example.com', firstname='Export', lastname=f'User{index}').save()
+        self.app.config['EXPORT_CHUNK_SIZE'] = 2
+
+        response = self.client.get('/api/v1/backend/admin/export/users?format=csv')
+
+        assert response.status_code == 200
+        assert response.is_streamed
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        assert sorted(row['email'] for row in rows) == [f'user{index}@example.com' for index in range(5)]
+
+    def test_export_unavailable_books_ndjson_gzip(self):
+        Book(title='Borrowed Book', publisher='Test Publisher', category='Test Category', is_available=False).save()
+        Book(title='Shelved Book', publisher='Test Publisher', category='Test Category').save()
+
+        response = self.client.get('/api/v1/backend/admin/export/unavailable-books?format=ndjson',
+                                   headers={'Accept-Encoding': 'gzip'})
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        lines = gzip.decompress(response.data).decode('utf-8').splitlines()
+        assert [json.loads(line)['title'] for line in lines] == ['Borrowed Book']
+        assert 'borrower_email' in json.loads(lines[0])
+
+    def test_export_rejects_unknown_entity_and_format(self):
+        assert self.client.get('/api/v1/backend/admin/export/loans').status_code == 404
+        assert self.client.get('/api/v1/backend/admin/export/users?format=xml').status_code == 400
+
+    def test_import_books_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'books.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['title', 'publisher', 'category'])
+            writer.writerows([['Existing Book', 'P', 'C'], ['Imported 1', 'P', 'C'], ['Imported 1', 'P', 'C'],
+                              ['Imported 2', 'P', 'C'], ['No Publisher', '', 'C']])
+        Book(title='Existing Book', publisher='P', category='C').save()
+
+        with requests_mock.Mocker() as m:
+            m.post('http://frontend:5001/api/v1/frontend/webhooks/add-books', json={}, status_code=200)
+            result = self.app.test_cli_runner().invoke(args=['import-books', path, '--chunk-size', '2'])
+
+            assert result.exit_code == 0, result.output
+            assert 'Done: 2 imported, 3 skipped' in result.output
+            published = [book['title'] for request in m.request_history for book in request.json()['books']]
+            assert published == ['Imported 1', 'Imported 2']
+        assert Book.query.filter_by(title='Imported 1').count() == 1
+
+    def test_import_books_command_retries_and_fails_on_unpublished_batches(self):
+        path = os.path.join(tempfile.mkdtemp(), 'books.csv')
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['title', 'publisher', 'category'])
+            writer.writerows([['Retried 1', 'P', 'C'], ['Retried 2', 'P', 'C']])
+        url = 'http://frontend:5001/api/v1/frontend/webhooks/add-books'
+        runner = self.app.test_cli_runner()
+
+        with requests_mock.Mocker() as m:
+            m.post(url, [{'status_code': 503, 'text': 'restarting'}, {'json': {}, 'status_code': 200}])
+            result = runner.invoke(args=['import-books', path, '--retry-backoff', '0'])
+            assert result.exit_code == 0, result.output
+            keys = {request.headers['Idempotency-Key'] for request in m.request_history}
+            assert m.call_count == 2 and len(keys) == 1
+
+        with open(path, 'a', newline='') as f:
+            csv.writer(f).writerow(['Unpublished', 'P', 'C'])
+        with requests_mock.Mocker() as m:
+            m.post(url, status_code=503, text='down')
+            result = runner.invoke(args=['import-books', path, '--publish-retries', '1', '--retry-backoff', '0'])
+            assert m.call_count == 2
+        assert result.exit_code == 1
+        assert '1 batches could not be published to the frontend' in result.output
+
+    def test_webhook_payload_errors_are_reported_per_field(self):
+        response = self.client.post('/api/v1/backend/admin/webhooks/overdue-books', json={
+            'books': [{'book_id': 'a', 'return_by': 'not a date'}, {'return_by': '2024-01-01T00:00:00'}]
+        })
+
+        assert response.status_code == 400
+        assert response.json['errors'] == {'books[0].return_by': 'Invalid RFC3339 encoded datetime',
+                                           'books[1].book_id': 'Missing required field'}
+
+    def test_webhook_continues_incoming_trace(self):
+        spans = []
+        self.app.extensions['tracer'] = Tracer(0.0, type('Collector', (), {'on_end': staticmethod(spans.append)}))
+        book = Book(title='Traced Book', publisher='Wiley', category='Drama')
+        book.save()
+        try:
+            response = self.client.post('/api/v1/backend/admin/webhooks/update-book',
+                                        json={'book_id': book.id, 'is_available': False},
+                                        headers={'traceparent': f"00-{'a' * 32}-{'b' * 16}-01"})
+        finally:
+            del self.app.extensions['tracer']
+
+        assert response.status_code == 200
+        request_span = next(span for span in spans if span.kind == 2)
+        assert (request_span.trace_id, request_span.parent_id) == ('a' * 32, 'b' * 16)
+        assert any(span.name == 'UPDATE' and span.parent_id == request_span.span_id for span in spans)
+
+    def test_profile_endpoints_require_admin_token(self):
+        assert self.client.get('/debug/profile?seconds=0.05').status_code == 404
+        self.app.config['DEBUG_ADMIN_TOKEN'] = 'secret'
+        try:
+            assert self.client.get('/debug/profile?seconds=0.05').status_code == 403
+
+            worker = threading.Thread(target=time.sleep, args=(0.5,), name='busy-worker')
+            worker.start()
+            response = self.client.get('/debug/profile?seconds=0.1', headers={'X-Admin-Token': 'secret'})
+            svg = self.client.get('/debug/profile?seconds=0.05&format=svg', headers={'X-Admin-Token': 'secret'})
+            worker.join()
+            assert response.status_code == 200
+            assert any(line.startswith('busy-worker;') for line in response.get_data(as_text=True).splitlines())
+            assert svg.mimetype == 'image/svg+xml' and b'busy-worker' in svg.data
+
+            profiled = self.client.get('/api/v1/backend/admin/users/books',
+                                       headers={'X-Admin-Token': 'secret', 'X-Profile': 'cprofile'})
+            assert profiled.headers['X-Profiled-Status'] == '200'
+            assert 'list_users_with_books' in profiled.get_data(as_text=True)
+
+            # cProfile cannot run twice at once: an overlapping request is refused and the lock is released after
+            with self.app.extensions['profile_lock']:
+                busy = self.client.get('/api/v1/backend/admin/users/books',
+                                       headers={'X-Admin-Token': 'secret', 'X-Profile': 'cprofile'})
+            assert busy.status_code == 409
+            assert self.app.extensions['profile_lock'].acquire(blocking=False)
+            self.app.extensions['profile_lock'].release()
+        finally:
+            self.app.config['DEBUG_ADMIN_TOKEN'] = None
+
+    def test_unit_of_work_commits_once_and_rolls_back_savepoints(self):
+        committed = []
+        with unit_of_work(flush_size=2):
+            Book(title='First', publisher='P', category='C').save()
+            Book(title='Second', publisher='P', category='C').save()
+            self.assertFalse(db.session.new)  # the full batch was flushed
+            with pytest.raises(Exception):
+                with unit_of_work():
+                    Book(title='Discarded', publisher='P', category='C').save()
+                    after_commit(committed.append, 'discarded')
+                    raise ValueError('nested failure')
+            Book(title='Third', publisher='P', category='C').save()
+            after_commit(committed.append, 'kept')
+            self.assertEqual(committed, [])
+
+        self.assertEqual(committed, ['kept'])
+        self.assertEqual(sorted(book.title for book in Book.get_all()), ['First', 'Second', 'Third'])
+
+        with pytest.raises(ValueError):
+            with unit_of_work():
+                Book.get_first(title='First').delete()
+                raise ValueError('request failed')
+        self.assertIsNotNone(Book.get_first(title='First'))
+
+    def test_top_books_served_from_incremental_window_counts(self):
+        popular = Book(title='Popular', publisher='P', category='C')
+        niche = Book(title='Niche', publisher='P', category='C')
+        popular.save()
+        niche.save()
+        with requests_mock.Mocker():
+            for book, times in ((popular, 3), (niche, 1)):
+                for _ in range(times):
+                    response = self.client.post('/api/v1/backend/admin/webhooks/update-book',
+                                                json={'book_id': book.id, 'is_available': False})
+                    self.assertEqual(response.status_code, 200)
+            self.client.post('/api/v1/backend/admin/webhooks/update-book',
+                             json={'book_id': niche.id, 'is_available': True})
+
+        self.assertEqual([event.event_type for event in BorrowEvent.get_all({'book_id': niche.id})],
+                         ['borrow', 'return'])
+        response = self.client.get('/api/v1/backend/admin/stats/top-books?window=7d')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['books'], [
+            {'book_id': popular.id, 'title': 'Popular', 'borrows': 3},
+            {'book_id': niche.id, 'title': 'Niche', 'borrows': 1},
+        ])
+        self.assertEqual(self.client.get('/api/v1/backend/admin/stats/top-books?window=2d').status_code, 400)
+
+        # Eight days later the borrows have left the 7-day window but are still in the 30-day one
+        db.session.query(RollupWatermark).update(
+            {'through_day': datetime.utcnow().date() - timedelta(days=8)}, synchronize_session=False)
+        db.session.commit()
+        self.assertEqual(self.client.get('/api/v1/backend/admin/stats/top-books?window=7d').json['books'], [])
+        self.assertEqual(self.client.get('/api/v1/backend/admin/stats/top-books?window=30d&limit=1').json['books'],
+                         [{'book_id': popular.id, 'title': 'Popular', 'borrows': 3}])
+
+    def test_webhooks_fan_out_to_every_subscriber_on_the_pool(self):
+        replicas = ['http://frontend-1:5001', 'http://frontend-2:5001']
+        self.app.config['WEBHOOK_SUBSCRIBERS'] = {'FRONTEND_SERVICE_URL': replicas}
+        threads = []
+
+        def accept(request, context):
+            threads.append(threading.current_thread().name)
+            return {'message': 'ok'}
+
+        def reject(request, context):
+            threads.append(threading.current_thread().name)
+            context.status_code = 503
+            return 'replica draining'
+
+        with requests_mock.Mocker() as m:
+            m.post(f'{replicas[0]}/api/v1/frontend/webhooks/add-book', json=accept)
+            m.post(f'{replicas[1]}/api/v1/frontend/webhooks/add-book', text=reject)
+            response = self.client.post('/api/v1/backend/admin/books/add', json={
+                'title': 'Fan Out', 'publisher': 'Test Publisher', 'category': 'Test Category'})
+            assert m.call_count == 2
+            assert all(name.startswith('webhook-fan-out') for name in threads)
+            assert {request.headers['Idempotency-Key'] for request in m.request_history} == {
+                f"add-book:{Book.query.filter_by(title='Fan Out').one().id}"}
+
+        assert response.status_code == 500
+        assert f'{replicas[1]}: HTTP 503: replica draining' in response.json['message']
+        assert replicas[0] not in response.json['message']
+
+        self.app.config['DEBUG_ADMIN_TOKEN'] = 'secret'
+        try:
+            assert self.client.get('/debug/subscribers').status_code == 403
+            subscribers = self.client.get('/debug/subscribers', headers={'X-Admin-Token': 'secret'}).json
+        finally:
+            self.app.config['DEBUG_ADMIN_TOKEN'] = None
+        assert subscribers[replicas[0]]['delivered'] == 1 and subscribers[replicas[0]]['failed'] == 0
+        assert subscribers[replicas[0]]['last_status'] == 200
+        assert subscribers[replicas[1]]['delivered'] == 0 and subscribers[replicas[1]]['failed'] == 1
+        assert subscribers[replicas[1]]['last_error'] == 'HTTP 503: replica draining'
+
+    def test_update_books_applies_latest_states_in_one_statement(self):
+        churned = Book(title='Churned', publisher='P', category='C', is_available=True)
+        returned = Book(title='Returned', publisher='P', category='C', is_available=False)
+        churned.save()
+        returned.save()
+        now = datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'
+        statements = []
+
+        def count_updates(conn, cursor, statement, *args):
+            if statement.startswith('UPDATE books'):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_updates)
+        try:
+            response = self.client.post('/api/v1/backend/admin/webhooks/update-books', json={'updates': [
+                {'book_id': churned.id, 'is_available': False, 'borrowed_at': [now, now], 'returned_at': [now]},
+                {'book_id': returned.id, 'is_available': True, 'returned_at': [now]},
+                {'book_id': 'unknown', 'is_available': True},
+            ]})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_updates)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['updated'], 2)
+        self.assertEqual(response.json['missing'], ['unknown'])
+        self.assertEqual(len(statements), 1)
+        self.assertIn('CASE', statements[0])
+        db.session.expire_all()
+        self.assertFalse(db.session.get(Book, churned.id).is_available)
+        self.assertTrue(db.session.get(Book, returned.id).is_available)
+        self.assertEqual(sorted(row.event_type for row in BorrowEvent.get_all({'book_id': churned.id})),
+                         ['borrow', 'borrow', 'return'])
+        self.assertEqual(self.client.get('/api/v1/backend/admin/stats/top-books?window=1d').json['books'],
+                         [{'book_id': churned.id, 'title': 'Churned', 'borrows': 2}])
+
 if __name__ == '__main__':
     pytest.main()
\ No newline at end of file
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+"""
+Compare the sync WSGI worker with the ASGI serving mode under high concurrency.
+
+Starts a slow stand-in for the frontend service, then serves the backend app once
+under gunicorn's default sync worker and once under uvicorn (ASGI mode), each as a
+single process, and fires concurrent `books/add` requests, each of which writes to
+the database and calls the peer webhook.
+
+    python benchmarks/asgi_vs_wsgi.py --requests 400 --concurrency 200 --peer-delay 0.2
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_slow_peer(port, delay):
+    """Serve 200 OK to every POST after sleeping for `delay` seconds."""
+    class SlowPeerHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), SlowPeerHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_server(mode, port, env):
+    if mode == 'wsgi':
+        command = ['gunicorn', '--workers', '1', '--timeout', '600', '--backlog', '2048',
+                   '--bind', f'127.0.0.1:{port}', 'backend.app:app']
+    else:
+        command = ['uvicorn', 'backend.asgi:app', '--workers', '1', '--backlog', '2048', '--no-access-log',
+                   '--host', '127.0.0.1', '--port', str(port)]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/api/v1/backend/admin/books/unavailable', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+def run_load(port, total, concurrency):
+    url = f'http://127.0.0.1:{port}/api/v1/backend/admin/books/add'
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def one_request(_):
+        payload = {'title': f'Bench {uuid.uuid4()}', 'publisher': 'Bench', 'category': 'Bench'}
+        started = time.perf_counter()
+        try:
+            ok = session.post(url, json=payload, timeout=600).status_code == 201
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_request, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'throughput': total / elapsed,
+        'p50': statistics.median(latencies),
+        'p99': latencies[int(len(latencies) * 0.99) - 1],
+        'errors': sum(1 for _, ok in results if not ok),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--peer-delay', type=float, default=0.2, help='seconds the peer stand-in waits')
+    args = parser.parse_args()
+
+    peer_port = free_port()
+    peer = start_slow_peer(peer_port, args.peer_delay)
+    print(f'{args.requests} requests, concurrency {args.concurrency}, peer delay {args.peer_delay * 1000:.0f} ms')
+    print(f"{'mode':<6}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+
+    try:
+        for mode in ('wsgi', 'asgi'):
+            with tempfile.TemporaryDirectory() as workdir:
+                env = dict(os.environ, APP_ROLE='backend', FLASK_ENV='production', LOG_LEVEL='WARNING',
+                           BACKEND_DATABASE_URL=f'sqlite:///{os.path.join(workdir, "bench.db")}',
+                           FRONTEND_SERVICE_URL=f'http://127.0.0.1:{peer_port}',
+                           ASGI_MAX_THREADS=str(args.concurrency))
+                port = free_port()
+                process = start_server(mode, port, env)
+                try:
+                    result = run_load(port, args.requests, args.concurrency)
+                finally:
+                    process.terminate()
+                    process.wait()
+            print(f"{mode:<6}{result['throughput']:>10.1f}{result['p50'] * 1000:>10.0f}"
+                  f"{result['p99'] * 1000:>10.0f}{result['errors']:>8}")
+    finally:
+        peer.shutdown()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+"""
+Microbenchmarks for the Python-side cost of the model layer at catalog scale.
+
+Generates a synthetic SQLite catalog (skewed publishers and categories, a share of
+borrowed books spread over users), then measures `get_all`, `to_dict` and `save()`
+at each requested size. Every operation reports its median wall time over the
+repeats and their spread ((slowest - fastest) / median), the peak traced memory and
+the number of allocated blocks still live when it returns (measured in a separate
+tracemalloc pass so tracing does not skew timings).
+
+Results are compared against the stored baselines and the script exits non-zero if
+any operation is slower or uses more memory than the tolerance allows. Timings are
+noisy, so they are compared with care:
+
+- The speed of the machine drifts over minutes (by more than 2x on the shared machine
+  that recorded the baselines). A fixed pure-Python workload is timed before every run,
+  and baseline times are scaled by how much faster or slower it runs now ("vs base" too).
+- The median time of the sub-second operations still moves by up to 50% between runs,
+  so the default time tolerance is 60%. It widens further when the spreads measured for
+  the baseline and for this run add up to more.
+- An operation that looks regressed is measured again (--confirm-runs) and only reported
+  if its fastest measurement is still over the limit. --update-baseline keeps the middle
+  one of as many measurements.
+
+For example:
+
+    python benchmarks/model_bench.py --rows 10000,100000
+    python benchmarks/model_bench.py --rows 1000000 --repeats 1 --skip 'User.to_dict(include_books=True)'
+    python benchmarks/model_bench.py --rows 10000,100000 --update-baseline
+
+Baselines are machine specific; refresh them with --update-baseline on the machine
+that runs the comparison.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import delete, insert
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from config.base_database import db, init_db  # noqa: E402
+from models.base_model import BaseModel  # noqa: E402
+from models.book import Book  # noqa: E402
+from models.user import User  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'model_baselines.json')
+CALIBRATION_ROWS = 50000
+PUBLISHERS = [f'Publisher {index:03d}' for index in range(200)]
+CATEGORIES = ['Fiction', 'Science', 'History', 'Children', 'Biography', 'Technology', 'Travel', 'Poetry',
+              'Art', 'Cooking', 'Health', 'Business', 'Religion', 'Philosophy', 'Law', 'Sports']
+WORDS = ['silent', 'river', 'empire', 'garden', 'shadow', 'winter', 'machine', 'letters', 'island', 'night',
+         'stone', 'atlas', 'promise', 'harvest', 'signal', 'orchard', 'theory', 'voyage', 'mirror', 'storm']
+
+
+def zipf_weights(count, exponent):
+    """Popularity weights where the item of rank r gets 1 / r ** exponent."""
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def generate_catalog(rows, seed=0, borrowed_ratio=0.3, users_per_book=0.02, chunk_size=10000):
+    """
+    Fill the database with `rows` books and a proportional number of users.
+
+    Publishers and categories follow a Zipf-like skew, `borrowed_ratio` of the books
+    are borrowed by randomly chosen users and a tenth of those are overdue.
+
+    :return: Number of users created
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    user_ids = [str(uuid.uuid4()) for _ in range(max(10, int(rows * users_per_book)))]
+    db.session.execute(insert(User.__table__), [
+        {'id': user_id, 'email': f'user{index}@example.com', 'firstname': f'First{index}',
+         'lastname': f'Last{index}', 'created_at': now, 'updated_at': now}
+        for index, user_id in enumerate(user_ids)])
+
+    publisher_weights = zipf_weights(len(PUBLISHERS), 1.1)
+    category_weights = zipf_weights(len(CATEGORIES), 0.8)
+    for start in range(0, rows, chunk_size):
+        count = min(chunk_size, rows - start)
+        publishers = rng.choices(PUBLISHERS, publisher_weights, k=count)
+        categories = rng.choices(CATEGORIES, category_weights, k=count)
+        books = []
+        for offset in range(count):
+            book = {'id': str(uuid.uuid4()), 'title': f'{" ".join(rng.sample(WORDS, 3)).title()} {start + offset}',
+                    'publisher': publishers[offset], 'category': categories[offset], 'is_available': True,
+                    'borrowed_at': None, 'return_by': None, 'borrowed_by_id': None,
+                    'created_at': now, 'updated_at': now}
+            if rng.random() < borrowed_ratio:
+                borrowed_at = now - timedelta(days=rng.randint(0, 30))
+                overdue = rng.random() < 0.1
+                book.update(is_available=False, borrowed_at=borrowed_at, borrowed_by_id=rng.choice(user_ids),
+                            return_by=now - timedelta(days=1) if overdue else borrowed_at + timedelta(days=14))
+            books.append(book)
+        db.session.execute(insert(Book.__table__), books)
+    db.session.commit()
+    return len(user_ids)
+
+
+def load_books():
+    return Book.get_all()
+
+
+def load_users():
+    return User.get_all()
+
+
+def save_books(count):
+    """Create `count` books one save() at a time, as the add-book endpoints do."""
+    ids = []
+    for index in range(count):
+        book = Book(title=f'Saved {index}', publisher=PUBLISHERS[0], category=CATEGORIES[0])
+        book.save()
+        ids.append(book.id)
+    return ids
+
+
+def operations(save_rows):
+    """(name, setup outside the measurement, measured operation, cleanup) for every benchmark."""
+    def drop_saved(ids):
+        db.session.execute(delete(Book.__table__).where(Book.id.in_(ids)))
+        db.session.commit()
+
+    return [
+        ('Book.get_all', None, lambda _: Book.get_all(), None),
+        ('Book.get_all(filters)', None,
+         lambda _: Book.get_all({'publisher': PUBLISHERS[0], 'is_available': True}), None),
+        ('BaseModel.to_dict', load_books, lambda books: [BaseModel.to_dict(book) for book in books], None),
+        ('Book.to_dict', load_books, lambda books: [book.to_dict() for book in books], None),
+        ('User.to_dict(include_books=True)', load_users,
+         lambda users: [user.to_dict(include_books=True) for user in users], None),
+        (f'BaseModel.save x{save_rows}', None, lambda _: save_books(save_rows), drop_saved),
+    ]
+
+
+def measure(setup, operation, cleanup, repeats):
+    """
+    Time an operation, then run it once more under tracemalloc.
+
+    :return: Dictionary with the median time in seconds, the spread of the times, peak traced MiB
+        and live allocated blocks
+    """
+    def run(measured):
+        db.session.remove()
+        state = setup() if setup else None
+        gc.collect()
+        result, stats = measured(lambda: operation(state))
+        if cleanup:
+            cleanup(result)
+        del state, result
+        db.session.remove()
+        return stats
+
+    def timed(call):
+        started = time.perf_counter()
+        result = call()
+        return result, time.perf_counter() - started
+
+    def traced(call):
+        tracemalloc.start()
+        blocks_before = sys.getallocatedblocks()
+        result = call()
+        blocks = sys.getallocatedblocks() - blocks_before
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return result, (peak / 2 ** 20, blocks)
+
+    calibrations, times = [], []
+    for _ in range(repeats):
+        calibrations.append(calibrate())
+        times.append(run(timed))
+    seconds = statistics.median(times)
+    peak_mib, blocks = run(traced)
+    return {'seconds': round(seconds, 4), 'spread': round((max(times) - min(times)) / seconds, 2),
+            'calibration': round(statistics.median(calibrations), 5), 'peak_mib': round(peak_mib, 2),
+            'allocs': blocks}
+
+
+def calibrate():
+    """Time a fixed pure-Python workload (dicts, strings, iteration), to follow the machine's current speed."""
+    started = time.perf_counter()
+    rows = [{'id': index, 'title': f'Title {index}'} for index in range(CALIBRATION_ROWS)]
+    sum(len(row['title']) for row in rows)
+    return time.perf_counter() - started
+
+
+def compare(name, result, baseline, time_tolerance, memory_tolerance):
+    """
+    Compare a result with its baseline.
+
+    :return: List of regression messages, empty if within tolerance
+    """
+    regressions = []
+    # Timings are only as exact as the noise of the two measurements being compared
+    time_tolerance = max(time_tolerance, baseline.get('spread', 0) + result['spread'])
+    # and the machine itself runs faster or slower over time; the baseline time follows its speed
+    speed = result['calibration'] / baseline['calibration'] if baseline.get('calibration') else 1.0
+    limits = (('seconds', time_tolerance), ('peak_mib', memory_tolerance), ('allocs', memory_tolerance))
+    for metric, tolerance in limits:
+        base = baseline.get(metric)
+        if base and metric == 'seconds':
+            base = round(base * speed, 4)
+        if base and result[metric] > base * (1 + tolerance):
+            regressions.append(f'{name}: {metric} {result[metric]} vs baseline {base} '
+                               f'(+{(result[metric] / base - 1) * 100:.0f}%, limit +{tolerance * 100:.0f}%)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='10000,100000',
+                        help='comma-separated catalog sizes, e.g. 10000,100000,1000000')
+    parser.add_argument('--repeats', type=int, default=7, help='timing runs per operation, the median is kept')
+    parser.add_argument('--save-rows', type=int, default=1000, help='books created one save() at a time')
+    parser.add_argument('--skip', default='', help='comma-separated operation names to skip')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the new baselines')
+    parser.add_argument('--time-tolerance', type=float, default=0.6, help='allowed slowdown, 0.6 = +60%%')
+    parser.add_argument('--memory-tolerance', type=float, default=0.1, help='allowed memory growth, 0.1 = +10%%')
+    parser.add_argument('--confirm-runs', type=int, default=2,
+                        help='extra measurements before a regression is reported, and for each baseline')
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    environment = {'python': platform.python_version(), 'machine': platform.machine(), 'system': platform.system()}
+    if baselines and not args.update_baseline and baselines.get('environment') != environment:
+        print(f"warning: baselines were recorded on {baselines.get('environment')}, this is {environment}")
+
+    regressions = []
+    for rows in (int(value) for value in args.rows.split(',')):
+        with tempfile.TemporaryDirectory() as workdir:
+            app = Flask(__name__)
+            app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(workdir, "bench.db")}'
+            init_db(app)
+            with app.app_context():
+                started = time.perf_counter()
+                users = generate_catalog(rows, seed=args.seed)
+                print(f'\n{rows} books, {users} users (generated in {time.perf_counter() - started:.1f}s)')
+                print(f"{'operation':<36}{'seconds':>10}{'spread':>8}{'peak MiB':>11}{'allocs':>12}{'vs base':>9}")
+
+                baseline = baselines.get('results', {}).get(str(rows), {})
+                skipped = {name.strip() for name in args.skip.split(',') if name.strip()}
+                for name, setup, operation, cleanup in operations(args.save_rows):
+                    if name in skipped:
+                        continue
+                    result = measure(setup, operation, cleanup, args.repeats)
+                    if args.update_baseline:
+                        # A baseline is the middle of several measurements, not a lucky or an unlucky one
+                        measurements = [result] + [measure(setup, operation, cleanup, args.repeats)
+                                                   for _ in range(args.confirm_runs)]
+                        result = sorted(measurements, key=lambda measured: measured['seconds'])[len(measurements) // 2]
+                    label = f'{rows} rows {name}'
+                    found = []
+                    if not args.update_baseline and name in baseline:
+                        found = compare(label, result, baseline[name], args.time_tolerance, args.memory_tolerance)
+                        # A burst of load on the machine can slow a whole measurement; a regression has to repeat
+                        for _ in range(args.confirm_runs if found else 0):
+                            retry = measure(setup, operation, cleanup, args.repeats)
+                            if retry['seconds'] < result['seconds']:
+                                result = retry
+                            found = compare(label, result, baseline[name], args.time_tolerance,
+                                            args.memory_tolerance)
+                            if not found:
+                                break
+                    base = baseline.get(name, {})
+                    base_seconds = base.get('seconds')
+                    if base_seconds and base.get('calibration'):
+                        base_seconds *= result['calibration'] / base['calibration']
+                    change = f'{(result["seconds"] / base_seconds - 1) * 100:+.0f}%' if base_seconds else '-'
+                    print(f"{name:<36}{result['seconds']:>10.4f}{result['spread']:>8.2f}{result['peak_mib']:>11.2f}"
+                          f"{result['allocs']:>12}{change:>9}")
+                    if args.update_baseline:
+                        baselines.setdefault('results', {}).setdefault(str(rows), {})[name] = result
+                    regressions += found
+                db.session.remove()
+                db.engine.dispose()
+
+    if args.update_baseline:
+        baselines['environment'] = environment
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'\nBaselines written to {args.baseline}')
+        return 0
+
+    if regressions:
+        print('\nREGRESSIONS:')
+        for message in regressions:
+            print(f'  {message}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+"""
+Payload size and encode/decode throughput of the webhook wire formats.
+
+Compares, for a single add-book payload and for add-books batches:
+
+- json (stdlib): the previous sender, `json.dumps` of `to_dict()` with ISO-8601 strings
+- json (msgspec): encode_payload() with native datetimes, RFC 3339 on the wire
+- msgpack: encode_payload(msgpack=True), datetimes as MessagePack timestamps
+
+Decoding always uses the receiver's path: the schema-compiled decoder of
+api/v1/schemas.py, which parses and validates in one pass.
+
+    python benchmarks/wire_bench.py
+    python benchmarks/wire_bench.py --batch 1,100,5000 --repeats 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+from api.v1.schemas import AddBooksWebhook, AddBookWebhook, encode_payload, get_decoder  # noqa: E402
+
+
+def book_rows(count):
+    """Book rows as the backend holds them: naive UTC datetimes, a third of them borrowed."""
+    now = datetime(2024, 5, 1, 12, 0, 0, 123456)
+    rows = []
+    for index in range(count):
+        borrowed = index % 3 == 0
+        rows.append({
+            'id': str(uuid.uuid4()),
+            'title': f'Book title number {index}',
+            'publisher': f'Publisher {index % 200:03d}',
+            'category': 'Fiction',
+            'is_available': not borrowed,
+            'borrowed_at': now - timedelta(days=3) if borrowed else None,
+            'return_by': now + timedelta(days=11) if borrowed else None,
+            'borrowed_by_id': None,
+            'created_at': now - timedelta(days=index % 365),
+            'updated_at': now,
+        })
+    return rows
+
+
+def as_iso(row):
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+
+
+def as_aware(row):
+    return {key: value.replace(tzinfo=timezone.utc) if isinstance(value, datetime) else value
+            for key, value in row.items()}
+
+
+def payloads(count):
+    """The add-book payload for one book, the add-books payload for more."""
+    rows = book_rows(count)
+    if count == 1:
+        return AddBookWebhook, {'book_data': as_iso(rows[0])}, {'book_data': as_aware(rows[0])}
+    return AddBooksWebhook, {'books': [as_iso(row) for row in rows]}, {'books': [as_aware(row) for row in rows]}
+
+
+def best_time(function, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(count, repeats):
+    schema, iso_payload, native_payload = payloads(count)
+    formats = [
+        ('json (stdlib)', lambda: json.dumps(iso_payload).encode('utf-8'), False),
+        ('json (msgspec)', lambda: encode_payload(native_payload)[0], False),
+        ('msgpack', lambda: encode_payload(native_payload, msgpack=True)[0], True),
+    ]
+    results = []
+    for name, encode, msgpack in formats:
+        body = encode()
+        decoder = get_decoder(schema, msgpack)
+        encode_seconds = best_time(encode, repeats)
+        decode_seconds = best_time(lambda: decoder.decode(body), repeats)
+        results.append((name, len(body), encode_seconds, decode_seconds))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', default='1,100,5000', help='comma-separated numbers of books per payload')
+    parser.add_argument('--repeats', type=int, default=50, help='runs per measurement, the best is reported')
+    args = parser.parse_args()
+
+    print(f"{'books':>6}  {'format':<15} {'bytes':>10} {'bytes/book':>10} {'encode':>10} {'decode':>10} "
+          f"{'books/s enc':>12} {'books/s dec':>12}")
+    for count in (int(value) for value in args.batch.split(',')):
+        for name, size, encode_seconds, decode_seconds in run(count, args.repeats):
+            print(f'{count:>6}  {name:<15} {size:>10} {size / count:>10.0f} {encode_seconds * 1e3:>8.3f}ms '
+                  f'{decode_seconds * 1e3:>8.3f}ms {count / encode_seconds:>12,.0f} {count / decode_seconds:>12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
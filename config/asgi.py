@@ -0,0 +1,161 @@
+# config/asgi.py
+import asyncio
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+_DONE = object()
+logger = logging.getLogger(__name__)
+
+
+class ThreadOffloadASGIApp:
+    """
+    Serve a WSGI (Flask) app from an ASGI event loop.
+
+    Connections, request bodies and response streaming are handled on the event
+    loop, while each request's view code (including its SQLAlchemy work and peer
+    webhook calls) runs start to finish on one thread of a bounded pool. A worker
+    process can therefore hold many more in-flight requests that are waiting on
+    I/O than a sync worker, which serves exactly one at a time.
+    """
+
+    def __init__(self, wsgi_app, max_threads=256, queue_size=16):
+        self.wsgi_app = wsgi_app
+        self.max_threads = max_threads
+        self.queue_size = queue_size
+        self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._handle_http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix='asgi-worker')
+        return self.executor
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._get_executor()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _handle_http(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get('body', b''))
+            if not message.get('more_body', False):
+                break
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        environ = build_environ(scope, bytes(body))
+
+        def put(item):
+            # Blocks the worker thread while the client is slower than the app (backpressure)
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            put(('start', int(status.split(' ', 1)[0]),
+                 [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]))
+            return lambda data: put(('body', data))
+
+        def run_wsgi_app():
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if chunk:
+                            put(('body', chunk))
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+            except Exception as e:
+                put(('error', e))
+            finally:
+                put(_DONE)
+
+        future = loop.run_in_executor(self._get_executor(), run_wsgi_app)
+        started = False
+        failed = None
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    break
+                kind = item[0]
+                if kind == 'start' and not started:
+                    await send({'type': 'http.response.start', 'status': item[1], 'headers': item[2]})
+                    started = True
+                elif kind == 'body':
+                    await send({'type': 'http.response.body', 'body': item[1], 'more_body': True})
+                elif kind == 'error':
+                    logger.error('Error serving %s %s', scope['method'], scope['path'], exc_info=item[1])
+                    if started:
+                        failed = item[1]
+                    else:
+                        await send({'type': 'http.response.start', 'status': 500,
+                                    'headers': [(b'content-type', b'text/plain')]})
+                        started = True
+        except Exception:
+            # Keep draining so the worker thread is not left blocked on a full queue
+            while (await queue.get()) is not _DONE:
+                pass
+            raise
+        await future
+        if failed is not None:
+            # The status is already sent; abort the response rather than end a truncated body as complete
+            raise failed
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+def build_environ(scope, body):
+    """
+    Build a WSGI environ dictionary from an ASGI HTTP scope.
+
+    :param scope: ASGI connection scope
+    :param body: Complete request body
+    :return: WSGI environ
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
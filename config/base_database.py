@@ -1,8 +1,9 @@
 #!/usr/bin/python3
 from flask_sqlalchemy import SQLAlchemy
+from config.read_replicas import RoutingSession
 
-# Initialize SQLAlchemy database object
-db = SQLAlchemy()
+# Initialize SQLAlchemy database object; reads from read-only views may go to replicas
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 def init_db(app):
@@ -0,0 +1,137 @@
+# config/compression.py
+import gzip
+import threading
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+def supported_encodings():
+    """Content encodings this process can produce, in order of preference."""
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+
+def negotiate_encoding():
+    """
+    Pick the best content encoding accepted by the client.
+
+    :return: 'br', 'gzip', or None for an uncompressed response
+    """
+    return request.accept_encodings.best_match(supported_encodings())
+
+
+def compress(data, encoding):
+    """Compress a complete body with the given content encoding."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config['COMPRESS_BR_QUALITY'])
+    return gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL'], mtime=0)
+
+
+def compress_stream(chunks, encoding, level, quality):
+    """Compress an iterable of byte chunks incrementally, yielding compressed chunks."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=quality)
+        compress_chunk, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress_chunk, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress_chunk(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def _is_compressible(response):
+    return (200 <= response.status_code < 300 and response.status_code != 204
+            and not response.direct_passthrough
+            and 'Content-Encoding' not in response.headers
+            and response.mimetype in current_app.config['COMPRESS_MIMETYPES'])
+
+
+def register_compression(app):
+    """
+    Compress eligible responses with the best encoding the client accepts.
+
+    Buffered bodies smaller than COMPRESS_MIN_SIZE are sent as-is; streamed
+    bodies are compressed chunk by chunk without being buffered.
+
+    :param app: Flask application instance
+    """
+    @app.after_request
+    def compress_response(response):
+        if not _is_compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        encoding = negotiate_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.iter_encoded(), encoding,
+                                                app.config['COMPRESS_LEVEL'], app.config['COMPRESS_BR_QUALITY'])
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class CompressedSnapshot:
+    """
+    Serialised and pre-compressed bodies of one hot JSON response, cached per data version.
+
+    Only the latest version is kept. Requests for an unchanged version skip both
+    serialisation and compression.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._bodies = {}
+
+    def _body(self, version, encoding, build_payload):
+        with self._lock:
+            if version != self._version:
+                self._version, self._bodies = version, {}
+            body = self._bodies.get(encoding)
+            raw = self._bodies.get(None)
+        if body is not None:
+            return body
+
+        if raw is None:
+            raw = current_app.json.response(build_payload()).get_data()
+        body = raw if encoding is None else compress(raw, encoding)
+        with self._lock:
+            if version == self._version:
+                self._bodies[None] = raw
+                self._bodies[encoding] = body
+        return body
+
+    def response(self, version, build_payload):
+        """
+        Build the response for the current data version in the client's preferred encoding.
+
+        :param version: Hashable fingerprint of the data the payload is built from
+        :param build_payload: Callable returning the JSON-serialisable payload
+        :return: Flask response
+        """
+        encoding = negotiate_encoding()
+        raw = self._body(version, None, build_payload)
+        if encoding is not None and len(raw) < current_app.config['COMPRESS_MIN_SIZE']:
+            encoding = None
+
+        response = current_app.response_class(self._body(version, encoding, build_payload),
+                                              mimetype='application/json')
+        response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        return response
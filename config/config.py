@@ -4,15 +4,105 @@ import logging
 from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
 from pythonjsonlogger import jsonlogger
 
+
+def url_list(env_var):
+    """Read a comma-separated list of URLs from the environment."""
+    return [url.strip() for url in os.getenv(env_var, '').split(',') if url.strip()]
+
+
+def replica_binds(env_var):
+    """Build SQLALCHEMY_BINDS entries from a comma-separated list of replica URLs."""
+    return {f'replica_{index}': url for index, url in enumerate(url_list(env_var))}
+
+
+def shard_binds(env_var):
+    """Build SQLALCHEMY_BINDS entries from a comma-separated list of shard URLs; their order fixes the sharding."""
+    return {f'shard_{index}': url for index, url in enumerate(url_list(env_var))}
+
+
 class BaseConfig:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG')
+    IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))  # seconds
+    READ_REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv('READ_REPLICA_HEALTH_CHECK_INTERVAL', 5))  # seconds
+    FRONTEND_SERVICE_URL = os.getenv('FRONTEND_SERVICE_URL', 'http://frontend:5001')
+    BACKEND_SERVICE_URL = os.getenv('BACKEND_SERVICE_URL', 'http://backend:5000')
+    PEER_TIMEOUT = float(os.getenv('PEER_TIMEOUT', 10))  # seconds
+    PEER_POOL_SIZE = int(os.getenv('PEER_POOL_SIZE', 100))  # keep-alive connections per peer
+    PEER_WIRE_FORMAT = os.getenv('PEER_WIRE_FORMAT', 'json')  # 'json' or 'msgpack' for webhook payloads
+    # Webhook subscribers of the backend's book events (every frontend replica); unset means the service URL alone
+    WEBHOOK_SUBSCRIBERS = {
+        'FRONTEND_SERVICE_URL': url_list('FRONTEND_SUBSCRIBER_URLS'),
+    }
+    WEBHOOK_FANOUT_WORKERS = int(os.getenv('WEBHOOK_FANOUT_WORKERS', 16))  # concurrent webhook calls per process
+    CIRCUIT_BREAKER_WINDOW = int(os.getenv('CIRCUIT_BREAKER_WINDOW', 20))  # most recent calls considered
+    CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv('CIRCUIT_BREAKER_MIN_CALLS', 5))
+    CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv('CIRCUIT_BREAKER_FAILURE_RATE', 0.5))
+    CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv('CIRCUIT_BREAKER_OPEN_SECONDS', 30))
+    ASGI_MAX_THREADS = int(os.getenv('ASGI_MAX_THREADS', 256))  # concurrent requests per ASGI worker
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 500))  # bytes
+    COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))  # gzip level
+    COMPRESS_BR_QUALITY = int(os.getenv('COMPRESS_BR_QUALITY', 5))  # brotli quality
+    COMPRESS_MIMETYPES = ['application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html']
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'false').lower() == 'true'  # opt-in
+    RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'memory')  # 'memory' (per worker) or 'shared' (per host)
+    RATE_LIMIT_STORE_PATH = os.getenv('RATE_LIMIT_STORE_PATH', '/tmp/rate_limit_buckets.bin')
+    RATE_LIMIT_STORE_SLOTS = int(os.getenv('RATE_LIMIT_STORE_SLOTS', 65536))  # shared slots, or buckets per worker
+    RATE_LIMIT_CLIENT_RATE = float(os.getenv('RATE_LIMIT_CLIENT_RATE', 50))  # requests per second
+    RATE_LIMIT_CLIENT_BURST = float(os.getenv('RATE_LIMIT_CLIENT_BURST', 100))
+    # Endpoint -> (requests per second, burst) shared by all clients
+    RATE_LIMIT_ROUTES = {
+        'frontend_views.filter_books': (20, 40),
+        'backend_views.list_users_with_books': (5, 10),
+    }
+    RATE_LIMIT_EXEMPT = ['/webhooks/', '/healthz', '/readyz']
+    MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', 200))  # per worker, 0 disables
+    EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 10000))  # rows per read transaction
+    EXPORT_YIELD_PER = int(os.getenv('EXPORT_YIELD_PER', 1000))  # rows per server-side cursor fetch
+    UNIT_OF_WORK_FLUSH_SIZE = int(os.getenv('UNIT_OF_WORK_FLUSH_SIZE', 500))  # staged changes per flush, 0 = at commit
+    READ_REPLICA_STICKY_SECONDS = int(os.getenv('READ_REPLICA_STICKY_SECONDS', 5))  # covers replication lag
+    QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', 0))  # cached get_all/get_first results, 0 disables
+    QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', 60))  # seconds, bounds staleness across hosts
+    # 'shared' (per host) or 'memory', which only invalidates entries in a single-worker process
+    QUERY_CACHE_VERSION_STORE = os.getenv('QUERY_CACHE_VERSION_STORE', 'shared')
+    QUERY_CACHE_VERSION_STORE_PATH = os.getenv('QUERY_CACHE_VERSION_STORE_PATH', '/tmp/query_cache_versions.bin')
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))  # share of new traces recorded, 0 disables tracing
+    TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'file')  # 'file' or 'otlp'
+    TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')  # OTLP/JSON lines
+    TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    TRACE_BATCH_SIZE = int(os.getenv('TRACE_BATCH_SIZE', 512))
+    TRACE_EXPORT_INTERVAL = float(os.getenv('TRACE_EXPORT_INTERVAL', 2))  # seconds
+    DEBUG_ADMIN_TOKEN = os.getenv('DEBUG_ADMIN_TOKEN')  # X-Admin-Token for the /debug tools, unset disables them
+    PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 60))
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.01))  # seconds between stack samples
+    PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', 40))  # functions listed in per-request cProfile output
+    MEMORY_PROFILING_ENABLED = os.getenv('MEMORY_PROFILING_ENABLED', 'false').lower() == 'true'  # tracemalloc costs CPU
+    MEMORY_TRACEMALLOC_FRAMES = int(os.getenv('MEMORY_TRACEMALLOC_FRAMES', 1))  # stack depth kept per allocation
+    MEMORY_SNAPSHOT_INTERVAL = float(os.getenv('MEMORY_SNAPSHOT_INTERVAL', 300))  # seconds, 0 disables snapshots
+    MEMORY_SNAPSHOT_TOP_N = int(os.getenv('MEMORY_SNAPSHOT_TOP_N', 20))  # allocation sites kept per snapshot
+    MEMORY_SNAPSHOTS_KEPT = int(os.getenv('MEMORY_SNAPSHOTS_KEPT', 12))
+    WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'  # /readyz is 503 until warmup is done
+    WARMUP_DB_CONNECTIONS = int(os.getenv('WARMUP_DB_CONNECTIONS', 5))  # pooled connections opened per engine
+    WARMUP_RETRY_INTERVAL = float(os.getenv('WARMUP_RETRY_INTERVAL', 2))  # seconds between failed warmup attempts
 
 class FrontendConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = os.getenv('FRONTEND_DATABASE_URL', 'sqlite:///frontend_library.db')
+    SQLALCHEMY_BINDS = {**replica_binds('FRONTEND_REPLICA_URLS'), **shard_binds('FRONTEND_SHARD_URLS')}
+    OVERDUE_SWEEP_INTERVAL = float(os.getenv('OVERDUE_SWEEP_INTERVAL', 0))  # seconds, 0 disables the sweeper
+    OVERDUE_SWEEP_BATCH_SIZE = int(os.getenv('OVERDUE_SWEEP_BATCH_SIZE', 500))
+    OVERDUE_SWEEP_LEASE = float(os.getenv('OVERDUE_SWEEP_LEASE', 300))  # seconds a crashed sweeper blocks the others
+    CATALOG_INDEX_PATH = os.getenv('CATALOG_INDEX_PATH')  # shared mmap catalog index, unset disables it
+    # seconds a burst of added or removed books has to share one index rebuild, 0 rebuilds on every change
+    CATALOG_INDEX_REBUILD_DELAY = float(os.getenv('CATALOG_INDEX_REBUILD_DELAY', 1.0))
+    TITLE_INDEX_REFRESH_INTERVAL = float(os.getenv('TITLE_INDEX_REFRESH_INTERVAL', 30))  # seconds, 0 disables
+    UPDATE_COALESCE_WINDOW = float(os.getenv('UPDATE_COALESCE_WINDOW', 0))  # seconds, 0 sends each update-book
+    UPDATE_COALESCE_MAX_BATCH = int(os.getenv('UPDATE_COALESCE_MAX_BATCH', 500))  # books per update-books call
+    # batches kept for a retry while the backend is unreachable, the oldest are dropped beyond it
+    UPDATE_COALESCE_MAX_RETRYING = int(os.getenv('UPDATE_COALESCE_MAX_RETRYING', 100))
 
 class BackendConfig(BaseConfig):
     SQLALCHEMY_DATABASE_URI = os.getenv('BACKEND_DATABASE_URL', 'sqlite:///backend_library.db')
+    SQLALCHEMY_BINDS = replica_binds('BACKEND_REPLICA_URLS')
 
 class FrontendDevelopmentConfig(FrontendConfig):
     DEBUG = True
@@ -0,0 +1,192 @@
+# config/memory_profiling.py
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from flask import Response, g, jsonify, request
+from config.profiling import admin_required
+
+
+def resident_memory():
+    """Current resident set size of this process in bytes, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class RouteMemoryStats:
+    """Aggregated memory figures of one endpoint."""
+
+    __slots__ = ('requests', 'peak_sum', 'peak_max', 'identity_map_max', 'leaked_requests')
+
+    def __init__(self):
+        self.requests = self.peak_sum = self.peak_max = self.identity_map_max = self.leaked_requests = 0
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'peak_bytes_avg': self.peak_sum // self.requests if self.requests else 0,
+            'peak_bytes_max': self.peak_max,
+            'identity_map_max': self.identity_map_max,
+            'leaked_requests': self.leaked_requests,
+        }
+
+
+class MemoryMonitor:
+    """
+    Per-route allocation peaks, session identity-map sizes and periodic allocation snapshots.
+
+    Peaks come from tracemalloc's process-wide peak, reset when a request starts, so
+    they are exact when a worker serves one request at a time and an upper bound
+    when requests overlap.
+    """
+
+    def __init__(self, top_n=20, snapshots_kept=10, frames=1):
+        self.top_n = top_n
+        self.routes = {}
+        self.snapshots = deque(maxlen=snapshots_kept)
+        self._previous = None
+        self._lock = threading.Lock()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def request_started(self, identity_map_size):
+        """Reset the allocation peak; objects already in the session identity map leaked from an earlier request."""
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0], identity_map_size
+
+    def request_finished(self, endpoint, started, identity_map_size):
+        """Record a finished request against its endpoint."""
+        baseline, leaked = started
+        peak = max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+        with self._lock:
+            stats = self.routes.setdefault(endpoint, RouteMemoryStats())
+            stats.requests += 1
+            stats.peak_sum += peak
+            stats.peak_max = max(stats.peak_max, peak)
+            stats.identity_map_max = max(stats.identity_map_max, identity_map_size)
+            if leaked:
+                stats.leaked_requests += 1
+
+    def take_snapshot(self):
+        """
+        Record the top allocation sites, and their growth since the previous snapshot.
+
+        :return: The recorded snapshot summary
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        statistics = (snapshot.compare_to(self._previous, 'lineno') if self._previous
+                      else snapshot.statistics('lineno'))
+        self._previous = snapshot
+        summary = {
+            'taken_at': time.time(),
+            'traced_bytes': tracemalloc.get_traced_memory()[0],
+            'rss_bytes': resident_memory(),
+            'top': [{
+                'site': str(stat.traceback[0]),
+                'size_bytes': stat.size,
+                'size_diff_bytes': getattr(stat, 'size_diff', None),
+                'blocks': stat.count,
+            } for stat in sorted(statistics, key=lambda stat: stat.size, reverse=True)[:self.top_n]],
+        }
+        self.snapshots.append(summary)
+        return summary
+
+    def to_dict(self):
+        with self._lock:
+            routes = {endpoint: stats.to_dict() for endpoint, stats in self.routes.items()}
+        current, peak = tracemalloc.get_traced_memory()
+        return {'rss_bytes': resident_memory(), 'traced_bytes': current, 'traced_peak_bytes': peak,
+                'routes': routes, 'snapshots': list(self.snapshots)}
+
+    def to_prometheus(self):
+        """Render the figures in the Prometheus text exposition format."""
+        data = self.to_dict()
+        lines = [
+            '# TYPE process_resident_memory_bytes gauge',
+            f"process_resident_memory_bytes {data['rss_bytes'] or 0}",
+            '# TYPE tracemalloc_traced_bytes gauge',
+            f"tracemalloc_traced_bytes {data['traced_bytes']}",
+        ]
+        metrics = (
+            ('http_requests_memory_tracked_total', 'counter', 'requests'),
+            ('http_request_memory_peak_bytes_avg', 'gauge', 'peak_bytes_avg'),
+            ('http_request_memory_peak_bytes_max', 'gauge', 'peak_bytes_max'),
+            ('session_identity_map_objects_max', 'gauge', 'identity_map_max'),
+            ('session_leaked_requests_total', 'counter', 'leaked_requests'),
+        )
+        for name, kind, field in metrics:
+            lines.append(f'# TYPE {name} {kind}')
+            for endpoint, stats in sorted(data['routes'].items()):
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {stats[field]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _identity_map_size(db):
+    # Do not create a session just to measure it
+    return len(db.session.identity_map) if db.session.registry.has() else 0
+
+
+def register_memory_profiling(app, db):
+    """
+    Track memory per route when MEMORY_PROFILING_ENABLED is set, and expose it to admins.
+
+    GET /debug/memory returns per-route peaks, identity-map sizes and the recent
+    allocation snapshots (add ?snapshot=1 to take one now); GET /debug/memory/metrics
+    returns the same figures for Prometheus.
+
+    :param app: Flask application instance
+    :param db: SQLAlchemy instance whose sessions are tracked
+    """
+    if app.config['MEMORY_PROFILING_ENABLED']:
+        monitor = MemoryMonitor(app.config['MEMORY_SNAPSHOT_TOP_N'], app.config['MEMORY_SNAPSHOTS_KEPT'],
+                                app.config['MEMORY_TRACEMALLOC_FRAMES'])
+        app.extensions['memory_monitor'] = monitor
+        interval = app.config['MEMORY_SNAPSHOT_INTERVAL']
+        if interval > 0:
+            def take_snapshots():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        monitor.take_snapshot()
+                    except Exception as e:
+                        app.logger.error('Memory snapshot failed: %s', e)
+
+            threading.Thread(target=take_snapshots, name='memory-snapshots', daemon=True).start()
+
+    @app.before_request
+    def start_memory_tracking():
+        monitor = app.extensions.get('memory_monitor')
+        if monitor is not None:
+            g.memory_tracking = monitor.request_started(_identity_map_size(db))
+
+    @app.teardown_request
+    def finish_memory_tracking(exc):
+        started = g.pop('memory_tracking', None)
+        monitor = app.extensions.get('memory_monitor')
+        if started is not None and monitor is not None:
+            monitor.request_finished(request.endpoint or request.path, started, _identity_map_size(db))
+
+    @app.route('/debug/memory', methods=['GET'])
+    @admin_required(app)
+    def memory_report():
+        monitor = app.extensions.get('memory_monitor')
+        if monitor is None:
+            return jsonify({"message": "Memory profiling is disabled"}), 404
+        if request.args.get('snapshot'):
+            monitor.take_snapshot()
+        return jsonify(monitor.to_dict()), 200
+
+    @app.route('/debug/memory/metrics', methods=['GET'])
+    @admin_required(app)
+    def memory_metrics():
+        monitor = app.extensions.get('memory_monitor')
+        if monitor is None:
+            return jsonify({"message": "Memory profiling is disabled"}), 404
+        return Response(monitor.to_prometheus(), mimetype='text/plain; version=0.0.4')
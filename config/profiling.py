@@ -0,0 +1,202 @@
+# config/profiling.py
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from functools import wraps
+from html import escape
+from flask import Response, abort, g, jsonify, request
+
+PROFILE_HEADER = 'X-Profile'
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+
+def is_admin_request(app):
+    """
+    Whether the request carries the configured DEBUG_ADMIN_TOKEN; always False if none is configured.
+
+    The token is read from X-Admin-Token, or from an `Authorization: Bearer` header
+    as sent by metrics scrapers.
+    """
+    token = app.config.get('DEBUG_ADMIN_TOKEN')
+    supplied = request.headers.get(ADMIN_TOKEN_HEADER, '')
+    if not supplied and request.authorization and request.authorization.type == 'bearer':
+        supplied = request.authorization.token or ''
+    return bool(token) and hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8'))
+
+
+def admin_required(app):
+    """Guard a debug view with the admin token. Without a configured token the view does not exist (404)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not app.config.get('DEBUG_ADMIN_TOKEN'):
+                abort(404)
+            if not is_admin_request(app):
+                return jsonify({"message": "Admin token required"}), 403
+            return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _frame_label(code):
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval):
+    """
+    Sample the stacks of every other thread of this process.
+
+    Sampling only reads frames between sleeps, so the profiled threads run at full
+    speed; the cost is one pass over the stacks every `interval` seconds.
+
+    :param seconds: How long to sample for
+    :param interval: Seconds between samples
+    :return: Counter of collapsed stacks ("thread;outermost;...;innermost") -> samples
+    """
+    names = {}
+    stacks = Counter()
+    own_ident = threading.get_ident()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if ident not in names:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames.append(names.get(ident, f'thread-{ident}'))
+            stacks[';'.join(reversed(frames))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapsed(stacks):
+    """Format sampled stacks in the collapsed format read by flamegraph.pl and speedscope."""
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+def flamegraph_svg(stacks, width=1200, frame_height=16, title='Flame graph'):
+    """
+    Render sampled stacks as a self-contained flame graph SVG.
+
+    Each frame is drawn as wide as its share of the samples, callers below callees;
+    hovering a frame shows its name and sample count.
+    """
+    root = {'children': {}, 'count': 0}
+    for stack, count in stacks.items():
+        node = root
+        node['count'] += count
+        for frame in stack.split(';'):
+            node = node['children'].setdefault(frame, {'children': {}, 'count': 0})
+            node['count'] += count
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node['children'].values()), default=0)
+
+    total = root['count'] or 1
+    levels = depth(root)
+    height = (levels + 1) * frame_height
+    rects = []
+
+    def draw(name, node, x, level):
+        node_width = node['count'] / total * width
+        if node_width < 0.5:
+            return
+        y = height - (level + 1) * frame_height
+        hue = 30 + zlib.crc32(name.encode('utf-8')) % 30
+        label = escape(name) if node_width > 40 else ''
+        rects.append(
+            f'<g><title>{escape(name)} ({node["count"]} samples, {node["count"] / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{node_width:.1f}" height="{frame_height - 1}" '
+            f'fill="hsl({hue},90%,60%)"/>'
+            f'<text x="{x + 3:.1f}" y="{y + frame_height - 4}" font-size="11" font-family="monospace" '
+            f'textLength="{max(node_width - 6, 0):.0f}" lengthAdjust="spacingAndGlyphs">{label}</text></g>')
+        for child_name, child in sorted(node['children'].items()):
+            draw(child_name, child, x, level + 1)
+            x += child['count'] / total * width
+
+    draw(f'all ({total} samples)', root, 0.0, 0)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height + frame_height}" '
+            f'viewBox="0 0 {width} {height + frame_height}">'
+            f'<text x="{width / 2}" y="{frame_height - 3}" text-anchor="middle" font-size="13">{escape(title)}</text>'
+            f'{"".join(rects)}</svg>')
+
+
+def register_profiling(app):
+    """
+    Add the admin-only profiling tools to an app.
+
+    GET /debug/profile?seconds=N&format=collapsed|svg samples every thread of this
+    worker for N seconds. A request with the admin token and `X-Profile: cprofile`
+    runs under cProfile and returns the profile instead of its response. One
+    profile runs at a time per worker (cProfile cannot be enabled twice); others get 409.
+
+    :param app: Flask application instance
+    """
+    profile_lock = app.extensions['profile_lock'] = threading.Lock()
+
+    @app.route('/debug/profile', methods=['GET'])
+    @admin_required(app)
+    def sample_profile():
+        seconds = request.args.get('seconds', 10, type=float)
+        output = request.args.get('format', 'collapsed')
+        if not 0 < seconds <= app.config['PROFILE_MAX_SECONDS']:
+            return jsonify({"message": f"seconds should be between 0 and {app.config['PROFILE_MAX_SECONDS']}"}), 400
+        if output not in ('collapsed', 'svg'):
+            return jsonify({"message": "format should be collapsed or svg"}), 400
+        if not profile_lock.acquire(blocking=False):
+            return jsonify({"message": "A profile is already running in this worker"}), 409
+        try:
+            stacks = sample_stacks(seconds, app.config['PROFILE_SAMPLE_INTERVAL'])
+        finally:
+            profile_lock.release()
+
+        if output == 'svg':
+            title = f'{app.name} pid {os.getpid()}, {seconds:g}s'
+            return Response(flamegraph_svg(stacks, title=title), mimetype='image/svg+xml')
+        return Response(collapsed(stacks), mimetype='text/plain')
+
+    @app.before_request
+    def start_request_profile():
+        if request.headers.get(PROFILE_HEADER) == 'cprofile' and is_admin_request(app):
+            if not profile_lock.acquire(blocking=False):
+                return jsonify({"message": "A profile is already running in this worker"}), 409
+            g.request_profiler = cProfile.Profile()
+            g.request_profiler.enable()
+        return None
+
+    def stop_request_profile():
+        profiler = g.pop('request_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            profile_lock.release()
+        return profiler
+
+    @app.after_request
+    def return_request_profile(response):
+        profiler = stop_request_profile()
+        if profiler is None:
+            return response
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats('cumulative').print_stats(app.config['PROFILE_TOP_N'])
+        profiled = Response(report.getvalue(), mimetype='text/plain')
+        profiled.headers['X-Profiled-Status'] = str(response.status_code)
+        return profiled
+
+    @app.teardown_request
+    def release_request_profile(exc):
+        # after_request is skipped if the request failed outside the view's error handling
+        stop_request_profile()
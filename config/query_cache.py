@@ -0,0 +1,199 @@
+# config/query_cache.py
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper, object_session
+from config.read_replicas import RoutingSession
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the shared store then only locks within a process
+    fcntl = None
+
+WRITTEN_TABLES = 'query_cache_written_tables'
+
+
+class MemoryTableVersions:
+    """Per-table version counters held in this worker's memory."""
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, table):
+        return self._versions.get(table, 0)
+
+    def bump(self, table):
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+
+
+class SharedTableVersions:
+    """
+    Per-table version counters in a memory-mapped file shared by every worker on the host.
+
+    Table names are hashed onto a fixed number of slots; tables that collide share
+    a counter, which only costs extra invalidations.
+    """
+
+    SLOT = struct.Struct('<Q')
+
+    def __init__(self, path, slots=1024):
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * self.SLOT.size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def _offset(self, table):
+        return (zlib.crc32(table.encode('utf-8')) % self.slots) * self.SLOT.size
+
+    def get(self, table):
+        return self.SLOT.unpack_from(self._map, self._offset(table))[0]
+
+    def bump(self, table):
+        offset = self._offset(table)
+        with self._lock:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self.SLOT.pack_into(self._map, offset, self.SLOT.unpack_from(self._map, offset)[0] + 1)
+            finally:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class QueryCache:
+    """
+    LRU cache of model query results, invalidated by per-table version counters.
+
+    An entry stores the column values of the rows a query returned, together with
+    the version of the queried table at the time. It is served only while that
+    version is unchanged and the entry is younger than `ttl` seconds.
+    """
+
+    def __init__(self, versions, max_entries, ttl):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, table):
+        """
+        Look up an entry.
+
+        :return: The cached rows, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                version, expires_at, rows = entry
+                if version == self.versions.get(table) and time.monotonic() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return rows
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, rows):
+        """
+        Store the rows of a query that ran while the table was at `version`.
+
+        Rows read while the table changed carry an old version and are never served.
+        """
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Get the hit, miss and eviction counters.
+
+        :return: Dictionary of counters
+        """
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+def get_query_cache():
+    """Return the app's query cache, or None if caching is disabled or there is no app context."""
+    return current_app.extensions.get('query_cache') if has_app_context() else None
+
+
+def get_table_versions():
+    """Return the app's table version counters, or None if there is no app context."""
+    return current_app.extensions.get('table_versions') if has_app_context() else None
+
+
+def _record_write(session, table):
+    """Bump a table's version now and remember to bump it again when the transaction commits."""
+    if session is not None:
+        session.info.setdefault(WRITTEN_TABLES, set()).add(table)
+    versions = get_table_versions()
+    if versions is not None:
+        versions.bump(table)
+
+
+@event.listens_for(Mapper, 'after_insert')
+@event.listens_for(Mapper, 'after_update')
+@event.listens_for(Mapper, 'after_delete')
+def _invalidate_flushed_table(mapper, connection, target):
+    _record_write(object_session(target), mapper.persist_selectable.name)
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _invalidate_executed_table(orm_execute_state):
+    # Bulk query.update()/delete(), Core inserts and upserts run through session.execute()
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None and getattr(table, 'name', None):
+            _record_write(orm_execute_state.session, table.name)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _invalidate_committed_tables(session):
+    # Results cached by other sessions between our flush and commit hold the old rows
+    versions = get_table_versions()
+    for table in session.info.pop(WRITTEN_TABLES, ()):
+        if versions is not None:
+            versions.bump(table)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_rolled_back_tables(session):
+    session.info.pop(WRITTEN_TABLES, None)
+
+
+def register_query_cache(app):
+    """
+    Attach the per-table version counters, and enable the result cache of BaseModel.get_all/get_first
+    if QUERY_CACHE_SIZE is set.
+
+    The counters are kept even without the cache: they also version the catalog (Book.catalog_version()).
+
+    :param app: Flask application instance
+    """
+    if app.config['QUERY_CACHE_VERSION_STORE'] == 'shared':
+        versions = SharedTableVersions(app.config['QUERY_CACHE_VERSION_STORE_PATH'])
+    else:
+        versions = MemoryTableVersions()
+    app.extensions['table_versions'] = versions
+    if app.config['QUERY_CACHE_SIZE'] <= 0:
+        return None
+    cache = QueryCache(versions, app.config['QUERY_CACHE_SIZE'], app.config['QUERY_CACHE_TTL'])
+    app.extensions['query_cache'] = cache
+    return cache
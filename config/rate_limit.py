@@ -0,0 +1,166 @@
+# config/rate_limit.py
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from flask import g, jsonify, request
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the shared store then only locks within a process
+    fcntl = None
+
+
+def take_token(tokens, last, now, rate, burst):
+    """
+    Refill a token bucket up to `now` and try to take one token from it.
+
+    :return: Tuple of (tokens left, seconds until a token is available or 0 if one was taken)
+    """
+    tokens = burst if last == 0 else min(burst, tokens + (now - last) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBucketStore:
+    """
+    Token buckets held in this worker's memory.
+
+    A bucket that has refilled is the same as no bucket, so buckets are dropped once
+    full again; at most `max_buckets` are kept, the least recently used going first.
+    """
+
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # key -> (tokens, last take, time the bucket is full again), by last take
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, rate, burst):
+        now = time.time()
+        with self._lock:
+            tokens, last, _ = self._buckets.pop(key, (0.0, 0.0, 0.0))
+            tokens, retry_after = take_token(tokens, last, now, rate, burst)
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            # The least recently used buckets come first; drop those that are full again
+            while self._buckets:
+                oldest = next(iter(self._buckets.values()))
+                if oldest[2] > now and len(self._buckets) <= self.max_buckets:
+                    break
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class SharedBucketStore:
+    """
+    Token buckets in a memory-mapped file shared by every worker on the host.
+
+    Keys are hashed onto a fixed number of slots, so memory is bounded; keys that
+    collide share a bucket. Updates are serialised with an exclusive file lock.
+    """
+
+    SLOT = struct.Struct('<dd')
+
+    def __init__(self, path, slots):
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * self.SLOT.size
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+
+    def take(self, key, rate, burst):
+        offset = (zlib.crc32(key.encode('utf-8')) % self.slots) * self.SLOT.size
+        with self._lock:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                tokens, last = self.SLOT.unpack_from(self._map, offset)
+                tokens, retry_after = take_token(tokens, last, now, rate, burst)
+                self.SLOT.pack_into(self._map, offset, tokens, now)
+            finally:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return retry_after
+
+
+class AdmissionController:
+    """Per-client and per-route token buckets plus a cap on concurrent requests."""
+
+    def __init__(self, store, max_concurrent):
+        self.store = store
+        self.max_concurrent = max_concurrent
+        self.concurrency = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+
+    def check_rate(self, config, client, endpoint):
+        """
+        Take a token from the client's bucket and from the route's bucket.
+
+        :return: Seconds to wait before retrying, or 0 if the request is admitted
+        """
+        retry_after = self.store.take(f'client:{client}', config['RATE_LIMIT_CLIENT_RATE'],
+                                      config['RATE_LIMIT_CLIENT_BURST'])
+        if retry_after:
+            return retry_after
+        route_limit = config['RATE_LIMIT_ROUTES'].get(endpoint)
+        if route_limit:
+            return self.store.take(f'route:{endpoint}', *route_limit)
+        return 0.0
+
+
+def _too_busy(message, status_code, retry_after):
+    response = jsonify({"message": message})
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def register_rate_limiter(app):
+    """
+    Reject excess requests with 429/503 and Retry-After before any view or DB work runs.
+
+    Rate limits (429) apply only with RATE_LIMIT_ENABLED; the concurrency cap (503) whenever
+    MAX_CONCURRENT_REQUESTS is set. Paths containing one of RATE_LIMIT_EXEMPT (service-to-service
+    webhooks by default) are not limited.
+
+    :param app: Flask application instance
+    """
+    if app.config['RATE_LIMIT_STORE'] == 'shared':
+        store = SharedBucketStore(app.config['RATE_LIMIT_STORE_PATH'], app.config['RATE_LIMIT_STORE_SLOTS'])
+    else:
+        store = MemoryBucketStore(app.config['RATE_LIMIT_STORE_SLOTS'])
+    controller = AdmissionController(store, app.config['MAX_CONCURRENT_REQUESTS'])
+    app.extensions['admission_controller'] = controller
+
+    @app.before_request
+    def admit_request():
+        if any(path in request.path for path in app.config['RATE_LIMIT_EXEMPT']):
+            return None
+
+        retry_after = app.config['RATE_LIMIT_ENABLED'] and controller.check_rate(app.config, request.remote_addr,
+                                                                                 request.endpoint)
+        if retry_after:
+            app.logger.warning('Rate limited %s on %s', request.remote_addr, request.endpoint)
+            return _too_busy("Too many requests", 429, retry_after)
+
+        if controller.concurrency is not None:
+            if not controller.concurrency.acquire(blocking=False):
+                app.logger.warning('Shedding %s: %d requests in flight', request.path, controller.max_concurrent)
+                return _too_busy("Service overloaded, retry later", 503, 1)
+            g.admission_slot = controller.concurrency
+        return None
+
+    @app.teardown_request
+    def release_admission_slot(exc):
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            slot.release()
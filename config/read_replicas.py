@@ -0,0 +1,163 @@
+# config/read_replicas.py
+import itertools
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from config.sharding import get_shard_router
+
+REPLICA_BIND_PREFIX = 'replica_'
+PRIMARY_PIN_COOKIE = 'db_primary_pin'
+
+
+class ReplicaPool:
+    """Round-robin pool of read-replica engines with lazy health checks."""
+
+    def __init__(self, engines, check_interval=5.0, logger=None):
+        self.engines = list(engines)
+        self.check_interval = check_interval
+        self.logger = logger
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._healthy = {engine: True for engine in self.engines}
+        self._next_check = {engine: 0.0 for engine in self.engines}
+
+    def choose(self):
+        """
+        Pick the next healthy replica in round-robin order.
+
+        :return: A replica engine, or None if every replica is unhealthy
+        """
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._counter) % len(self.engines)]
+            if self.is_healthy(engine):
+                return engine
+        return None
+
+    def is_healthy(self, engine):
+        """
+        Return the cached health of a replica, re-checking it once per check interval.
+
+        :param engine: Replica engine
+        :return: True if the last health check succeeded
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_check[engine]:
+                return self._healthy[engine]
+            self._next_check[engine] = now + self.check_interval
+
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            healthy = True
+        except Exception as e:
+            healthy = False
+            if self.logger:
+                self.logger.warning('Read replica %s failed health check: %s', engine.url, e)
+
+        self._healthy[engine] = healthy
+        return healthy
+
+    def mark_unhealthy(self, engine):
+        """Take a replica out of rotation until its next health check."""
+        with self._lock:
+            self._healthy[engine] = False
+            self._next_check[engine] = time.monotonic() + self.check_interval
+
+
+def reads_from_replica():
+    """Whether the current statement may be served by a replica."""
+    if not has_request_context() or not g.get('db_read_only') or g.get('db_wrote'):
+        return False
+    # Read-your-writes: clients that wrote recently stay on the primary
+    return PRIMARY_PIN_COOKIE not in request.cookies
+
+
+def _mark_write():
+    if has_request_context():
+        g.db_wrote = True
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads from read-only endpoints to a replica pool, and flushes sharded rows to their shard.
+
+    A read that fails on a replica with an OperationalError (connection lost, server down, ...)
+    takes the replica out of rotation until its next health check and is retried on the primary.
+    """
+
+    _replica = None  # replica engine chosen for the statement being executed
+    _primary_only = False
+
+    @property
+    def connection_callable(self):
+        router = get_shard_router()
+        return router.connection_callable(self) if router is not None else None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if clause is not None and getattr(clause, 'is_dml', False):
+            _mark_write()
+        elif bind is None and not self._flushing and not self._primary_only and reads_from_replica():
+            pool = current_app.extensions.get('read_replicas')
+            engine = pool.choose() if pool else None
+            if engine is not None:
+                self._replica = engine
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def execute(self, statement, *args, **kwargs):
+        self._replica = None
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except OperationalError as e:
+            replica, self._replica = self._replica, None
+            if replica is None:
+                raise
+            current_app.extensions['read_replicas'].mark_unhealthy(replica)
+            current_app.logger.warning('Read replica %s failed, retrying the read on the primary: %s', replica.url, e)
+            self._primary_only = True
+            try:
+                return super().execute(statement, *args, **kwargs)
+            finally:
+                self._primary_only = False
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush_as_write(session, flush_context):
+    _mark_write()
+
+
+def read_only(view):
+    """Mark a view as read-only so its queries may be routed to a read replica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def register_read_replicas(app, db):
+    """
+    Build the replica pool from the 'replica_*' binds and pin writers to the primary.
+
+    :param app: Flask application instance
+    :param db: SQLAlchemy database object
+    """
+    with app.app_context():
+        engines = [engine for key, engine in sorted(db.engines.items(), key=lambda item: str(item[0]))
+                   if key and key.startswith(REPLICA_BIND_PREFIX)]
+    if engines:
+        app.extensions['read_replicas'] = ReplicaPool(
+            engines, check_interval=app.config['READ_REPLICA_HEALTH_CHECK_INTERVAL'], logger=app.logger)
+
+    @app.after_request
+    def pin_writer_to_primary(response):
+        if g.get('db_wrote'):
+            response.set_cookie(PRIMARY_PIN_COOKIE, '1', max_age=app.config['READ_REPLICA_STICKY_SECONDS'],
+                                httponly=True)
+        return response
@@ -0,0 +1,142 @@
+# config/readiness.py
+import os
+import threading
+import time
+from flask import jsonify
+from sqlalchemy import text
+from api.v1.peer_client import get_peer_session
+
+PENDING, WARMING, READY = 'pending', 'warming_up', 'ready'
+
+
+class Warmup:
+    """
+    Warmup phase of one worker process; readiness flips once every required step succeeded.
+
+    Steps run in order in a background thread. Failed required steps are retried every
+    `retry_interval` seconds (e.g. while the database is still starting); optional
+    steps are attempted once and only reported.
+    """
+
+    def __init__(self, app, steps, retry_interval=2.0):
+        self.app = app
+        self.steps = steps  # list of (name, function, required)
+        self.retry_interval = retry_interval
+        self.state = PENDING
+        self.results = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def ensure_started(self):
+        """Start the warmup thread once per process (a worker forked from a preloaded app starts its own)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.state = WARMING
+            threading.Thread(target=self.run, name='warmup', daemon=True).start()
+
+    def _run_step(self, name, function):
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                function()
+            self.results[name] = {'ok': True, 'seconds': round(time.perf_counter() - started, 3)}
+        except Exception as e:
+            self.results[name] = {'ok': False, 'seconds': round(time.perf_counter() - started, 3), 'error': str(e)}
+            self.app.logger.warning('Warmup step %s failed: %s', name, e)
+        return self.results[name]['ok']
+
+    def run(self):
+        """Run the warmup steps, retrying the required ones until they all succeed."""
+        self.state = WARMING
+        remaining = list(self.steps)
+        while True:
+            remaining = [(name, function, required) for name, function, required in remaining
+                         if not self._run_step(name, function) and required]
+            if not remaining:
+                break
+            time.sleep(self.retry_interval)
+        self.state = READY
+        self.app.logger.info('Warmup finished: %s', self.results)
+
+    def to_dict(self):
+        return {'status': self.state, 'steps': dict(self.results)}
+
+
+def warm_database_pool(db, connections):
+    """Open up to `connections` connections of every engine (primary and replicas) so they wait in the pool."""
+    for engine in db.engines.values():
+        pool_size = getattr(engine.pool, 'size', lambda: connections)()
+        opened = []
+        try:
+            for _ in range(min(connections, pool_size)):
+                connection = engine.connect()
+                opened.append(connection)
+                connection.execute(text('SELECT 1'))
+        finally:
+            for connection in opened:
+                connection.close()
+
+
+def warm_peer_connection(app, base_url_key):
+    """Open a keep-alive connection to the peer service by calling its liveness endpoint."""
+    get_peer_session().get(f"{app.config[base_url_key]}/healthz", timeout=app.config['PEER_TIMEOUT'])
+
+
+def warm_endpoint(app, path):
+    """Serve one GET request to `path` in-process, priming imports, caches and snapshots it uses."""
+    def step():
+        response = app.test_client().get(path)
+        if response.status_code >= 500:
+            raise RuntimeError(f'GET {path} returned {response.status_code}')
+    return step
+
+
+def register_readiness(app, db, peer_url_key, warmup_paths):
+    """
+    Add /healthz (liveness) and /readyz (readiness, flipped after warmup) to an app.
+
+    Warmup starts with the first request a worker process receives, normally the
+    first readiness poll. It opens the database pool, opens a connection to the peer
+    service and requests the hottest read endpoints once. Both endpoints only read
+    in-memory state, so they can be polled every second.
+
+    :param app: Flask application instance
+    :param db: SQLAlchemy database object
+    :param peer_url_key: Config key holding the peer's base URL
+    :param warmup_paths: GET paths requested during warmup, hottest first
+    """
+    steps = [('database', lambda: warm_database_pool(db, app.config['WARMUP_DB_CONNECTIONS']), True),
+             ('peer', lambda: warm_peer_connection(app, peer_url_key), False)]
+    steps += [(f'GET {path}', warm_endpoint(app, path), True) for path in warmup_paths]
+    warmup = Warmup(app, steps, app.config['WARMUP_RETRY_INTERVAL'])
+    app.extensions['warmup'] = warmup
+
+    @app.before_request
+    def start_warmup():
+        # Tests drive the warmup themselves
+        if app.config['WARMUP_ENABLED'] and not app.testing:
+            warmup.ensure_started()
+
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        return jsonify({'status': 'ok'}), 200
+
+    @app.route('/readyz', methods=['GET'])
+    def readyz():
+        if not app.config['WARMUP_ENABLED']:
+            return jsonify({'status': READY, 'steps': {}}), 200
+        response = jsonify(warmup.to_dict())
+        if not warmup.ready:
+            response.status_code = 503
+            response.headers['Retry-After'] = '1'
+        return response
+
+    return warmup
@@ -0,0 +1,147 @@
+# config/sharding.py
+import hashlib
+import heapq
+import uuid
+from itertools import islice
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+SHARD_BIND_PREFIX = 'shard_'
+
+
+def shard_index(key, shards):
+    """
+    Map a shard key to one of `shards` shards.
+
+    Uses a stable hash (not Python's salted hash()), so every worker and every
+    service routes the same key to the same shard.
+    """
+    digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+
+class ShardRouter:
+    """Routes the rows of sharded models to one of N shard engines by a hash of their id."""
+
+    def __init__(self, engines):
+        self.engines = list(engines)
+
+    def engine_for(self, key):
+        """
+        Get the engine of the shard holding a row.
+
+        :param key: The row's id
+        """
+        return self.engines[shard_index(key, len(self.engines))]
+
+    def bind_arguments(self, key=None):
+        """
+        Get the session bind arguments that send a statement to the shards holding `key`.
+
+        :param key: A row id, or None for every shard
+        :return: List of bind_arguments dictionaries, one per shard to run on
+        """
+        if key is not None:
+            return [{'bind': self.engine_for(key)}]
+        return [{'bind': engine} for engine in self.engines]
+
+    def connection_callable(self, session):
+        """Per-instance connection chooser for the session's flush: sharded rows go to their shard."""
+        def connection_for(mapper, instance):
+            if getattr(mapper.class_, 'sharded', False):
+                return session.connection(bind_arguments={'bind': self.engine_for(instance.id)})
+            return session.connection(bind_arguments={'mapper': mapper})
+
+        return connection_for
+
+
+def get_shard_router():
+    """Return the app's shard router, or None if sharding is not configured."""
+    return current_app.extensions.get('shards') if has_app_context() else None
+
+
+def scatter_gather(session, stmt, bind_arguments, key=None, limit=None):
+    """
+    Run a SELECT on every shard and gather the rows.
+
+    With `key`, the statement must be ordered by the same key on every shard, and
+    the sorted per-shard results are merged into one ordered list (a k-way merge,
+    no re-sort). With `limit`, every shard returns at most `limit` rows and the
+    merged result is cut to `limit`, which is exact because the first `limit` rows
+    overall are among the first `limit` rows of their shards.
+
+    The shards are queried one after another on the caller's session (a session
+    cannot be shared across threads, and its ORM rows must come back into it), so a
+    scatter costs the sum of the shards' query times, not the slowest one. Queries
+    that name a row id go to its shard only and pay for one.
+
+    :param session: Session to run the statement on
+    :param stmt: SELECT statement
+    :param bind_arguments: Bind arguments of each shard to query
+    :param key: Optional sort key of a row, matching the statement's ORDER BY
+    :param limit: Optional maximum number of rows
+    :return: List of rows
+    """
+    results = [session.execute(stmt, bind_arguments=arguments).all() for arguments in bind_arguments]
+    if len(results) == 1:
+        return results[0]
+    rows = heapq.merge(*results, key=key) if key is not None else (row for result in results for row in result)
+    return list(islice(rows, limit)) if limit is not None else list(rows)
+
+
+def create_shard_tables(engines, models):
+    """
+    Create the tables of sharded models on every shard, if they do not exist.
+
+    Foreign keys are left out, since the tables they point to live in the primary database.
+
+    :param engines: Shard engines
+    :param models: Sharded models
+    """
+    for engine in engines:
+        existing = set(inspect(engine).get_table_names())
+        with engine.begin() as connection:
+            for model in models:
+                table = model.__table__
+                if table.name in existing:
+                    continue
+                connection.execute(CreateTable(table, include_foreign_key_constraints=[]))
+                for index in table.indexes:
+                    connection.execute(CreateIndex(index))
+
+
+def register_sharding(app, db, models):
+    """
+    Hash-shard the rows of the given models across the 'shard_*' binds, if any are configured.
+
+    The models must set `sharded = True`. Their tables are created on every shard;
+    BaseModel then routes reads and writes by id, and scatters the other queries.
+
+    :param app: Flask application instance
+    :param db: SQLAlchemy database object
+    :param models: Sharded models
+    """
+    with app.app_context():
+        # Ordered by shard number: the position of an engine decides which ids it holds
+        shards = {int(key[len(SHARD_BIND_PREFIX):]): engine for key, engine in db.engines.items()
+                  if key and key.startswith(SHARD_BIND_PREFIX)}
+        engines = [shards[number] for number in sorted(shards)]
+        if not engines:
+            return None
+        create_shard_tables(engines, models)
+    router = ShardRouter(engines)
+    app.extensions['shards'] = router
+    app.logger.info('Sharding %s across %d databases', ', '.join(model.__name__ for model in models), len(engines))
+    return router
+
+
+def _assign_shard_key(target, args, kwargs):
+    # The shard is chosen by id when the row is flushed, so sharded rows get their id up front
+    if getattr(target, 'sharded', False) and kwargs.get('id') is None:
+        kwargs['id'] = str(uuid.uuid4())
+
+
+def listen_for_new_instances(base_model):
+    """Give new instances of sharded models their id on construction."""
+    event.listen(base_model, 'init', _assign_shard_key, propagate=True)
@@ -0,0 +1,310 @@
+# config/tracing.py
+import contextvars
+import json
+import queue
+import random
+import re
+import threading
+import time
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import requests
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+# OTLP span kinds
+KIND_SERVER, KIND_CLIENT = 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+MAX_STATEMENT_LENGTH = 1000
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed operation of a trace."""
+
+    __slots__ = ('name', 'kind', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'status',
+                 'tracer', '_token')
+
+    def __init__(self, tracer, name, kind, trace_id, parent_id, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_OK
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._token = None
+
+    @property
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def activate(self):
+        """Make this span the parent of spans started in the current context."""
+        self._token = _current_span.set(self)
+        return self
+
+    def end(self, error=None):
+        """Finish the span, restore the previous current span and hand the span to the exporter."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.attributes['error.message'] = str(error)
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        self.tracer.processor.on_end(self)
+
+    def __enter__(self):
+        return self.activate()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+        return False
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class FileSink:
+    """Append each batch as one line of OTLP/JSON, the format of the OpenTelemetry collector's file exporter."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, payload):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(payload, separators=(',', ':')) + '\n')
+
+
+class OTLPHttpSink:
+    """POST each batch as OTLP/JSON to an OTLP/HTTP endpoint, e.g. http://collector:4318/v1/traces."""
+
+    def __init__(self, endpoint, timeout=5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def write(self, payload):
+        self.session.post(self.endpoint, json=payload, timeout=self.timeout).raise_for_status()
+
+
+class BatchSpanProcessor:
+    """
+    Queue finished spans and export them in batches from a background thread.
+
+    Request threads never wait on the sink; when the queue is full, spans are
+    dropped and counted rather than blocking the request.
+    """
+
+    def __init__(self, sink, service_name, max_queue=10000, batch_size=512, interval=2.0, logger=None):
+        self.sink = sink
+        self.resource = {'attributes': [_otlp_attribute('service.name', service_name)]}
+        self.batch_size = batch_size
+        self.interval = interval
+        self.logger = logger
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+        self._thread.start()
+
+    def on_end(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self.export(batch)
+
+    def export(self, spans):
+        payload = {'resourceSpans': [{
+            'resource': self.resource,
+            'scopeSpans': [{'scope': {'name': 'library.tracing'}, 'spans': [span.to_otlp() for span in spans]}],
+        }]}
+        try:
+            self.sink.write(payload)
+        except Exception as e:
+            if self.logger:
+                self.logger.warning('Failed to export %d spans: %s', len(spans), e)
+
+
+class Tracer:
+    """Starts spans, samples new traces and continues traces propagated by the peer service."""
+
+    def __init__(self, sample_rate, processor):
+        self.sample_rate = sample_rate
+        self.processor = processor
+
+    def start_span(self, name, kind=KIND_SERVER, attributes=None, traceparent=None):
+        """
+        Start a span as a child of the current span, of an incoming traceparent, or as a new trace.
+
+        Sampling is decided once per trace: children follow their parent, new traces
+        are sampled with probability `sample_rate`.
+
+        :return: The started (not yet activated) span, or None if the trace is not sampled
+        """
+        parent = _current_span.get()
+        if parent is not None:
+            return Span(self, name, kind, parent.trace_id, parent.span_id, attributes)
+
+        match = TRACEPARENT_RE.match(traceparent or '')
+        if match:
+            trace_id, parent_id, flags = match.groups()
+            if not int(flags, 16) & 1:
+                return None
+            return Span(self, name, kind, trace_id, parent_id, attributes)
+
+        if random.random() >= self.sample_rate:
+            return None
+        return Span(self, name, kind, f'{random.getrandbits(128):032x}', None, attributes)
+
+
+def get_tracer():
+    """Return the app's tracer, or None if tracing is disabled."""
+    return current_app.extensions.get('tracer') if has_app_context() else None
+
+
+def current_span():
+    """Return the span of the current context, or None."""
+    return _current_span.get()
+
+
+def start_client_span(name, headers, attributes=None):
+    """
+    Start a span for an outbound call and add its traceparent to the request headers.
+
+    :param name: Span name
+    :param headers: Outgoing headers dictionary, updated in place
+    :return: The activated span, or None if the current request is not traced
+    """
+    tracer = get_tracer()
+    if tracer is None or _current_span.get() is None:
+        return None
+    span = tracer.start_span(name, KIND_CLIENT, attributes).activate()
+    headers[TRACEPARENT_HEADER] = span.traceparent
+    return span
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_sql_span(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    if parent is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'SQL'
+    span = parent.tracer.start_span(operation, KIND_CLIENT, {
+        'db.system': conn.engine.dialect.name,
+        'db.statement': statement[:MAX_STATEMENT_LENGTH],
+        'db.executemany': executemany,
+    })
+    conn.info.setdefault('trace_spans', []).append(span)
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_sql_span(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get('trace_spans')
+    if spans:
+        span = spans.pop()
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            span.attributes['db.rowcount'] = cursor.rowcount
+        span.end()
+
+
+@event.listens_for(Engine, 'handle_error')
+def _fail_sql_span(exception_context):
+    connection = exception_context.connection
+    spans = connection.info.get('trace_spans') if connection is not None else None
+    if spans:
+        spans.pop().end(exception_context.original_exception)
+
+
+def register_tracing(app, service_name):
+    """
+    Trace requests, SQL statements and peer calls when TRACE_SAMPLE_RATE is set.
+
+    Incoming requests continue the trace of a W3C traceparent header (as sent by
+    the peer service's webhook calls) or start a new sampled trace.
+
+    :param app: Flask application instance
+    :param service_name: Name of this service in exported spans
+    """
+    tracer = None
+    if app.config['TRACE_SAMPLE_RATE'] > 0:
+        if app.config['TRACE_EXPORTER'] == 'otlp':
+            sink = OTLPHttpSink(app.config['TRACE_OTLP_ENDPOINT'])
+        else:
+            sink = FileSink(app.config['TRACE_FILE'])
+        processor = BatchSpanProcessor(sink, service_name, batch_size=app.config['TRACE_BATCH_SIZE'],
+                                       interval=app.config['TRACE_EXPORT_INTERVAL'], logger=app.logger)
+        tracer = Tracer(app.config['TRACE_SAMPLE_RATE'], processor)
+        app.extensions['tracer'] = tracer
+
+    @app.before_request
+    def start_request_span():
+        tracer = app.extensions.get('tracer')
+        if tracer is None:
+            return
+        span = tracer.start_span(f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+                                 KIND_SERVER, {'http.method': request.method, 'http.target': request.full_path},
+                                 traceparent=request.headers.get(TRACEPARENT_HEADER))
+        if span is not None:
+            g.trace_span = span.activate()
+
+    @app.after_request
+    def record_response_status(response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.attributes['http.status_code'] = response.status_code
+            if response.status_code >= 500:
+                span.status = STATUS_ERROR
+        return response
+
+    @app.teardown_request
+    def end_request_span(exc):
+        span = g.pop('trace_span', None)
+        if span is not None:
+            span.end(exc)
+
+    return tracer
@@ -0,0 +1,129 @@
+# config/unit_of_work.py
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, has_app_context
+from config.base_database import db
+
+UNIT_OF_WORK = 'unit_of_work'
+
+
+class UnitOfWork:
+    """
+    State of the unit of work open on a session.
+
+    Changes staged through BaseModel.save()/delete() are flushed every `flush_size`
+    operations, so the ORM sends them as batched statements, and committed once
+    when the outermost unit ends. Side effects that must only happen once the
+    changes are durable are queued with after_commit().
+    """
+
+    def __init__(self, flush_size):
+        self.flush_size = flush_size
+        self.staged = 0
+        self.rollback_only = False
+        self.callbacks = []
+
+    def staged_change(self, session):
+        """Count a staged change and flush the batch once it is full."""
+        self.staged += 1
+        if self.flush_size and self.staged >= self.flush_size:
+            session.flush()
+            self.staged = 0
+
+    def discard(self):
+        """Roll the unit back instead of committing it when it ends."""
+        self.rollback_only = True
+
+
+def current_unit_of_work(session=None):
+    """Return the unit of work open on the session, or None."""
+    session = session if session is not None else db.session()
+    return session.info.get(UNIT_OF_WORK)
+
+
+@contextmanager
+def unit_of_work(flush_size=None):
+    """
+    Group the writes made inside the block into one transaction.
+
+    The outermost unit commits when the block ends (or rolls back if it raised or
+    was discarded). A unit opened inside another one is a savepoint: if its block
+    raises, only its own changes are rolled back and the exception propagates.
+
+    :param flush_size: Staged changes per flush, defaults to UNIT_OF_WORK_FLUSH_SIZE
+    """
+    session = db.session()
+    unit = session.info.get(UNIT_OF_WORK)
+    if unit is not None:
+        savepoint = session.begin_nested()
+        queued = len(unit.callbacks)
+        try:
+            yield unit
+            savepoint.commit()
+        except Exception:
+            savepoint.rollback()
+            del unit.callbacks[queued:]
+            raise
+        return
+
+    if flush_size is None:
+        flush_size = current_app.config['UNIT_OF_WORK_FLUSH_SIZE'] if has_app_context() else 0
+    unit = session.info[UNIT_OF_WORK] = UnitOfWork(flush_size)
+    try:
+        yield unit
+        if unit.rollback_only:
+            session.rollback()
+        else:
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.info.pop(UNIT_OF_WORK, None)
+
+    if not unit.rollback_only:
+        for callback, args in unit.callbacks:
+            callback(*args)
+
+
+def after_commit(callback, *args):
+    """Call `callback(*args)` once the open unit of work has committed, or right away if none is open."""
+    unit = current_unit_of_work()
+    if unit is None:
+        callback(*args)
+    else:
+        unit.callbacks.append((callback, args))
+
+
+def commit_or_defer(session=None):
+    """Commit the session, unless a unit of work is open on it and will commit at its end."""
+    session = session if session is not None else db.session()
+    unit = session.info.get(UNIT_OF_WORK)
+    if unit is None:
+        session.commit()
+
+
+def rollback_or_defer(session=None):
+    """Roll the session back after a failed write, unless an open unit of work will roll it back."""
+    session = session if session is not None else db.session()
+    if UNIT_OF_WORK not in session.info:
+        session.rollback()
+
+
+def transactional(view):
+    """
+    Run a view as one unit of work, committed once after the view returns.
+
+    Responses with a 5xx status roll the unit back, like an exception does, so a
+    failed request leaves nothing half-written. A failing commit surfaces as an
+    error response instead of a success the database never recorded.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with unit_of_work() as unit:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code >= 500:
+                unit.discard()
+        return response
+
+    return wrapper
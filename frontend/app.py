@@ -12,9 +12,27 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from config.base_database import db, init_db
 from config.config import setup_logging, get_config
 from config.error_handlers import register_error_handlers
+from config.compression import register_compression
+from config.rate_limit import register_rate_limiter
+from config.tracing import register_tracing
+from config.profiling import register_profiling
+from config.memory_profiling import register_memory_profiling
+from config.read_replicas import register_read_replicas
+from config.sharding import register_sharding
+from config.query_cache import register_query_cache
+from api.v1.peer_client import register_peer_monitoring
+from config.readiness import register_readiness
 from api.v1.frontend.frontend_view import frontend_bp
+from models.book import Book
+from api.v1.frontend.overdue_sweeper import register_overdue_sweeper
+from api.v1.frontend.update_coalescer import register_update_coalescer
+from api.v1.frontend.catalog_index import register_catalog_index
+from api.v1.frontend.title_index import register_title_index
 
 
+# Hottest read endpoints, requested once by each worker before it reports ready
+WARMUP_PATHS = ['/api/v1/frontend/books', '/api/v1/frontend/books/suggest?prefix=a']
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -36,13 +54,55 @@ def create_app():
     # Register error handlers
     register_error_handlers(app)
 
+    # Trace requests, SQL statements and peer calls (first, so the request span covers every hook)
+    register_tracing(app, 'frontend')
+
+    # Admin-only sampling profiler and per-request cProfile
+    register_profiling(app)
+
+    # Per-route allocation peaks, session identity-map sizes and allocation snapshots, if enabled
+    register_memory_profiling(app, db)
+
+    # Shed excess load before any view or DB work starts
+    register_rate_limiter(app)
+
+    # Compress responses (registered first so it runs after the response logger)
+    register_compression(app)
+
     # Initialize SQLAlchemy with the Flask app
     init_db(app)
     Migrate(app, db)
 
+    # Route read-only endpoints to the read replicas, if any are configured
+    register_read_replicas(app, db)
+
+    # Spread the catalog across the shard databases by book id, if any are configured
+    register_sharding(app, db, [Book])
+
+    # Cache get_all/get_first results of opted-in models, if enabled
+    register_query_cache(app)
+
     # Register the Blueprint with the Flask application
     app.register_blueprint(frontend_bp)
 
+    # Expose peer circuit breaker state for monitoring
+    register_peer_monitoring(app)
+
+    # Liveness and readiness probes; readiness waits for the pool, peer and hot endpoints to be warm
+    register_readiness(app, db, 'BACKEND_SERVICE_URL', WARMUP_PATHS)
+
+    # Serve catalog reads from the index shared by all workers, if configured
+    register_catalog_index(app)
+
+    # Build the in-memory title index behind /books/suggest
+    register_title_index(app)
+
+    # Report overdue loans to the backend in the background
+    register_overdue_sweeper(app)
+
+    # Merge availability updates per book into batched backend calls, if enabled
+    register_update_coalescer(app)
+
     # Log request information before each request
     @app.before_request
     def log_request_info():
@@ -51,7 +111,11 @@ def create_app():
     # Log response information after each request
     @app.after_request
     def log_response_info(response):
-        app.logger.info('Response: %s %s', response.status, response.get_data(as_text=True))
+        # Do not buffer streamed bodies or decode compressed ones
+        if response.is_streamed or response.content_encoding:
+            app.logger.info('Response: %s <%s body>', response.status, response.content_encoding or 'streamed')
+        else:
+            app.logger.info('Response: %s %s', response.status, response.get_data(as_text=True))
         return response
     
     return app
@@ -0,0 +1,17 @@
+#!/usr/bin/python3
+"""
+ASGI entry point for the frontend service.
+
+    uvicorn frontend.asgi:app --host 0.0.0.0 --port 5001
+    gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:5001 frontend.asgi:app
+"""
+import os
+import sys
+
+# Add the project root directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.asgi import ThreadOffloadASGIApp
+from frontend.app import app as flask_app
+
+app = ThreadOffloadASGIApp(flask_app, max_threads=flask_app.config['ASGI_MAX_THREADS'])
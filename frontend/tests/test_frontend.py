@@ -1,12 +1,34 @@
+import json
+import os
 import pytest
+import tempfile
+import threading
+import tracemalloc
 import uuid
 import requests_mock
+from unittest import mock
 from flask_testing import TestCase
 from app import create_app
 from config.base_database import db, init_db
 from models.book import Book
 from models.user import User
-from sqlalchemy import text
+import gzip
+import msgspec
+from flask import g
+from sqlalchemy import create_engine, event, text
+from config.read_replicas import ReplicaPool
+from config.sharding import ShardRouter, create_shard_tables, shard_index
+from config.rate_limit import MemoryBucketStore, SharedBucketStore
+from config.query_cache import QueryCache
+from config.tracing import Tracer
+from api.v1.schemas import BookUpdate, encode_payload
+from config.memory_profiling import MemoryMonitor
+from api.v1.frontend.catalog_index import CatalogIndex
+from api.v1.frontend.update_coalescer import UpdateCoalescer
+from api.v1.frontend.title_index import TITLES_VERSION, titles_version
+from api.v1.frontend.overdue_sweeper import OverdueSweeper
+from models.sweep_watermark import SweepWatermark
+from datetime import datetime, timedelta, timezone
 
 
 class TestBackendViews(TestCase):
@@ -103,5 +125,662 @@ class TestBackendViews(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'Book removed successfully', response.data)
 
+    def test_add_book_webhook_redelivery_is_idempotent(self):
+        payload = {'book_data': {'id': 'redelivered_book_id', 'title': 'New Book',
+                                 'publisher': 'New Publisher', 'category': 'New Category', 'is_available': True}}
+        self.client.post('/api/v1/frontend/webhooks/add-book', json=payload)
+        with requests_mock.Mocker() as m:
+            m.post('http://backend:5000/api/v1/backend/admin/webhooks/update-book', json={})
+            self.client.post('/api/v1/frontend/borrow/redelivered_book_id', json={'days': 7})
+
+        # A stale redelivery refreshes the catalog fields but leaves the loan alone
+        payload['book_data']['title'] = 'Renamed Book'
+        response = self.client.post('/api/v1/frontend/webhooks/add-book', json=payload)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Book.query.count(), 1)
+        db.session.expire_all()
+        book = db.session.get(Book, 'redelivered_book_id')
+        self.assertEqual(book.title, 'Renamed Book')
+        self.assertFalse(book.is_available)
+        self.assertIsNotNone(book.return_by)
+
+    def test_read_only_endpoints_use_replica_until_client_writes(self):
+        Book(title='Primary Book', publisher='Macmillan', category='Horror').save()
+        # Flask-Testing shares one request context (and g) with the test client
+        g.pop('db_wrote', None)
+        replica = create_engine('sqlite://')
+        db.metadata.drop_all(replica)
+        db.metadata.create_all(replica)
+        with replica.begin() as connection:
+            connection.execute(Book.__table__.insert().values(id='replica_book_id', title='Replica Book',
+                                                              publisher='Macmillan', category='Horror'))
+        self.app.extensions['read_replicas'] = ReplicaPool([replica])
+        try:
+            response = self.client.get('/api/v1/frontend/books')
+            self.assertIn(b'Replica Book', response.data)
+
+            self.client.set_cookie('db_primary_pin', '1')
+            response = self.client.get('/api/v1/frontend/books')
+            self.assertIn(b'Primary Book', response.data)
+        finally:
+            del self.app.extensions['read_replicas']
+            g.pop('db_read_only', None)
+            db.metadata.drop_all(replica)
+
+    def test_failing_replica_is_taken_out_of_rotation_and_read_retried_on_primary(self):
+        Book(title='Primary Book', publisher='Macmillan', category='Horror').save()
+        g.pop('db_wrote', None)
+        broken = create_engine('sqlite://')  # answers the health check, but has no tables
+        pool = self.app.extensions['read_replicas'] = ReplicaPool([broken], check_interval=60)
+        try:
+            response = self.client.get('/api/v1/frontend/books')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'Primary Book', response.data)
+            self.assertIsNone(pool.choose())
+        finally:
+            del self.app.extensions['read_replicas']
+            g.pop('db_read_only', None)
+
+    def test_borrow_book_already_borrowed(self):
+        book = Book(title='Borrowed Book', publisher='Wiley', category='Drama', is_available=False)
+        book.save()
+        response = self.client.post(f'/api/v1/frontend/borrow/{book.id}', json={'days': 7})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'Book already borrowed', response.data)
+
+    def test_return_book(self):
+        with requests_mock.Mocker() as m:
+            m.post('http://backend:5000/api/v1/backend/admin/webhooks/update-book', json={}, status_code=200)
+
+            book = Book(title='Returnable Book', publisher='Wiley', category='Drama', is_available=False,
+                        borrowed_at=datetime.utcnow(), return_by=datetime.utcnow() + timedelta(days=7))
+            book.save()
+            response = self.client.post(f'/api/v1/frontend/return/{book.id}')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'Book returned successfully and backend updated', response.data)
+            sent = m.last_request.json()
+            self.assertEqual(sent, {'book_id': book.id, 'is_available': True, 'occurred_at': sent['occurred_at']})
+            self.assertTrue(sent['occurred_at'].endswith('Z'))  # sent as UTC
+
+            response = self.client.post(f'/api/v1/frontend/return/{book.id}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(b'Book is not borrowed', response.data)
+
+    def test_overdue_sweeper_reports_each_loan_once(self):
+        now = datetime.utcnow()
+        for days in range(1, 4):
+            Book(title=f'Overdue {days}', publisher='Wiley', category='Drama', is_available=False,
+                 return_by=now - timedelta(days=days)).save()
+        Book(title='On Loan', publisher='Wiley', category='Drama', is_available=False,
+             return_by=now + timedelta(days=1)).save()
+
+        sweeper = self.app.extensions['overdue_sweeper']
+        sweeper.batch_size = 2
+        with requests_mock.Mocker() as m:
+            m.post('http://backend:5000/api/v1/backend/admin/webhooks/overdue-books', json={}, status_code=200)
+
+            self.assertEqual(sweeper.sweep_once(), 3)
+            self.assertEqual([len(request.json()['books']) for request in m.request_history], [2, 1])
+            self.assertEqual(sweeper.sweep_once(), 0)
+
+            # A restarted worker resumes from the stored watermark instead of reporting every loan again
+            restarted = OverdueSweeper(self.app, 0, 2)
+            self.assertEqual(restarted.sweep_once(), 0)
+            self.assertEqual(m.call_count, 2)
+
+            # While one worker holds the lease, the others skip the sweep
+            Book(title='Overdue now', publisher='Wiley', category='Drama', is_available=False,
+                 return_by=datetime.utcnow()).save()
+            self.assertIsNotNone(SweepWatermark.claim('overdue-books', datetime.utcnow(), 60))
+            self.assertEqual(restarted.sweep_once(), 0)
+            SweepWatermark.release('overdue-books')
+            self.assertEqual(restarted.sweep_once(), 1)
+
+    def test_list_books_serves_compressed_snapshot_per_catalog_version(self):
+        for index in range(30):
+            Book(title=f'Snapshot Book {index}', publisher='Macmillan', category='Horror').save()
+        headers = {'Accept-Encoding': 'gzip'}
+
+        response = self.client.get('/api/v1/frontend/books', headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.data))), 30)
+
+        Book(title='Snapshot Book 30', publisher='Macmillan', category='Horror').save()
+        response = self.client.get('/api/v1/frontend/books', headers=headers)
+        self.assertEqual(len(json.loads(gzip.decompress(response.data))), 31)
+
+        response = self.client.get('/api/v1/frontend/books')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(len(response.json), 31)
+
+        # Removing a book and adding one with an older updated_at still changes the version
+        version = Book.catalog_version()
+        Book.get_first(title='Snapshot Book 0').delete()
+        self.client.post('/api/v1/frontend/webhooks/add-books', json={'books': [
+            {'id': 'older_book_id', 'title': 'Older Book', 'publisher': 'Macmillan', 'category': 'Horror',
+             'is_available': True, 'created_at': '2024-01-01T00:00:00', 'updated_at': '2024-01-01T00:00:00'}]})
+        self.assertNotEqual(Book.catalog_version(), version)
+        titles = [book['title'] for book in self.client.get('/api/v1/frontend/books').json]
+        self.assertEqual(len(titles), 31)
+        self.assertIn('Older Book', titles)
+        self.assertNotIn('Snapshot Book 0', titles)
+
+    def test_filter_books_compressed_above_min_size(self):
+        Book(title='Small Book', publisher='Tiny', category='Short').save()
+        response = self.client.get('/api/v1/frontend/books/filter?publisher=Tiny', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+        for index in range(30):
+            Book(title=f'Large Book {index}', publisher='Wiley', category='Drama').save()
+        response = self.client.get('/api/v1/frontend/books/filter?publisher=Wiley', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(response.data))), 30)
+
+    def test_rate_limited_route_returns_429_with_retry_after(self):
+        self.app.config['RATE_LIMIT_ROUTES'] = {'frontend_views.filter_books': (0.5, 2)}
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/v1/frontend/books/filter').status_code, 200)
+
+        self.app.config['RATE_LIMIT_ENABLED'] = True
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/v1/frontend/books/filter').status_code, 200)
+
+        response = self.client.get('/api/v1/frontend/books/filter')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '2')
+        self.assertEqual(self.client.get('/api/v1/frontend/books').status_code, 200)
+
+    def test_memory_bucket_store_drops_refilled_and_least_recent_buckets(self):
+        store = MemoryBucketStore(max_buckets=2)
+        with mock.patch('config.rate_limit.time.time', return_value=1000.0):
+            store.take('client:a', 1, 2)
+            store.take('client:b', 10, 2)
+            self.assertGreater(store.take('client:a', 1, 2) + store.take('client:a', 1, 2), 0)
+        # b refilled after 0.1s and is dropped; a, still short of tokens, is kept
+        with mock.patch('config.rate_limit.time.time', return_value=1000.5):
+            store.take('client:c', 1, 2)
+            self.assertEqual(len(store), 2)
+            self.assertGreater(store.take('client:a', 1, 2), 0)
+            # Over the cap, the least recently used bucket goes first
+            store.take('client:d', 1, 2)
+            self.assertEqual(list(store._buckets), ['client:a', 'client:d'])
+            self.assertGreater(store.take('client:a', 1, 2), 0)
+
+    def test_concurrency_cap_sheds_load_with_503(self):
+        controller = self.app.extensions['admission_controller']
+        controller.concurrency = threading.BoundedSemaphore(1)
+        controller.concurrency.acquire()
+        try:
+            response = self.client.get('/api/v1/frontend/books')
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+        finally:
+            controller.concurrency.release()
+        self.assertEqual(self.client.get('/api/v1/frontend/books').status_code, 200)
+
+    def test_shared_bucket_store_is_shared_across_instances(self):
+        path = os.path.join(tempfile.mkdtemp(), 'buckets.bin')
+        first, second = SharedBucketStore(path, 64), SharedBucketStore(path, 64)
+        self.assertEqual(first.take('client:a', 1, 2), 0)
+        self.assertEqual(second.take('client:a', 1, 2), 0)
+        self.assertGreater(first.take('client:a', 1, 2), 0)
+
+    def test_catalog_index_serves_reads_and_tracks_changes(self):
+        book = Book(title='Indexed Book', publisher='Macmillan', category='Horror')
+        book.save()
+        index = CatalogIndex(os.path.join(tempfile.mkdtemp(), 'catalog.idx'))
+        index.rebuild()
+        self.app.extensions['catalog_index'] = index
+        try:
+            fields = ['title', 'publisher', 'category', 'is_available', 'borrowed_at', 'return_by']
+            self.assertEqual(index.get(book.id), book.to_dict(fields=fields))
+            self.assertEqual(self.client.get('/api/v1/frontend/books').json, [{'id': book.id, 'title': 'Indexed Book'}])
+
+            with requests_mock.Mocker() as m:
+                m.post('http://backend:5000/api/v1/backend/admin/webhooks/update-book', json={}, status_code=200)
+                self.client.post(f'/api/v1/frontend/borrow/{book.id}', json={'days': 7})
+            response = self.client.get(f'/api/v1/frontend/book/{book.id}')
+            self.assertFalse(response.json['is_available'])
+            self.assertEqual(response.json['available_on'], response.json['return_by'])
+            self.assertEqual(self.client.get('/api/v1/frontend/books').json, [])
+            # The index and the database answer get_book alike
+            db.session.expire_all()
+            self.assertEqual(response.json, Book.get_by_id(book.id).to_dict(fields=fields))
+
+            self.client.post('/api/v1/frontend/webhooks/add-book', json={'book_data': {
+                'id': 'indexed_book_id', 'title': 'Second Book', 'publisher': 'Wiley', 'category': 'Drama'}})
+            self.assertEqual(CatalogIndex(index.path).get('indexed_book_id')['publisher'], 'Wiley')
+        finally:
+            del self.app.extensions['catalog_index']
+
+    def test_catalog_index_defers_rebuilds_of_a_burst_of_changes(self):
+        index = CatalogIndex(os.path.join(tempfile.mkdtemp(), 'catalog.idx'), rebuild_delay=3600)
+        index.rebuild()
+        self.app.extensions['catalog_index'] = index
+        try:
+            generation = index.generation()
+            for number in range(3):
+                self.client.post('/api/v1/frontend/webhooks/add-book', json={'book_data': {
+                    'id': f'burst_{number}', 'title': f'Burst {number}', 'publisher': 'Wiley', 'category': 'Drama'}})
+            # Each change only flags the file; reads go to the database until the rebuild
+            self.assertFalse(index.fresh())
+            self.assertEqual(index.generation(), generation + 3)
+            self.assertIsNone(index.get('burst_0'))
+            self.assertEqual(self.client.get('/api/v1/frontend/book/burst_0').json['title'], 'Burst 0')
+            self.assertEqual([book['id'] for book in self.client.get('/api/v1/frontend/books').json],
+                             ['burst_0', 'burst_1', 'burst_2'])
+
+            self.assertTrue(index.rebuild_if_stale())
+            self.assertTrue(index.fresh())
+            self.assertFalse(index.rebuild_if_stale())
+            self.assertEqual(index.get('burst_2')['title'], 'Burst 2')
+        finally:
+            del self.app.extensions['catalog_index']
+
+    def test_add_books_webhook_upserts_batch(self):
+        response = self.client.post('/api/v1/frontend/webhooks/add-books', json={'books': [
+            {'id': f'batch_book_{index}', 'title': f'Batch Book {index}', 'publisher': 'Bulk', 'category': 'Import',
+             'is_available': True, 'created_at': '2024-01-01T00:00:00', 'updated_at': '2024-01-01T00:00:00'}
+            for index in range(3)
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Book.query.filter_by(publisher='Bulk').count(), 3)
+
+    def test_borrow_book_rejects_non_integer_days(self):
+        response = self.client.post('/api/v1/frontend/borrow/any-id', json={'days': '7'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['errors'], {'days': 'Expected `int`, got `str`'})
+
+    def test_suggest_books_by_prefix(self):
+        for book_id, title in [('s1', 'Émile and the Detectives'), ('s2', 'Emma'), ('s3', 'Dune')]:
+            self.client.post('/api/v1/frontend/webhooks/add-book', json={
+                'book_data': {'id': book_id, 'title': title, 'publisher': 'P', 'category': 'C'}})
+        self.client.post('/api/v1/frontend/webhooks/remove-book', json={'book_id': 's2'})
+
+        response = self.client.get('/api/v1/frontend/books/suggest?prefix=EMI')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, [{'id': 's1', 'title': 'Émile and the Detectives'}])
+        self.assertEqual(self.client.get('/api/v1/frontend/books/suggest?prefix=em').json,
+                         [{'id': 's1', 'title': 'Émile and the Detectives'}])
+        self.assertEqual(self.client.get('/api/v1/frontend/books/suggest').status_code, 400)
+
+        # Another worker adds a book this worker's index never sees; the next webhook
+        # must not mark the index current, so the next check rebuilds it
+        index = self.app.extensions['title_index']
+        self.assertEqual(index._version, titles_version())
+        Book(id='s4', title='Emerald', publisher='P', category='C').save()
+        self.app.extensions['table_versions'].bump(TITLES_VERSION)
+        self.client.post('/api/v1/frontend/webhooks/add-book', json={
+            'book_data': {'id': 's5', 'title': 'Emblem', 'publisher': 'P', 'category': 'C'}})
+        self.assertNotEqual(index._version, titles_version())
+        index._next_check = 0
+        self.assertEqual([book['title'] for book in self.client.get('/api/v1/frontend/books/suggest?prefix=em').json],
+                         ['Emblem', 'Emerald', 'Émile and the Detectives'])
+        self.assertEqual(index._version, titles_version())
+
+        # Availability changes leave the titles alone, so they never cost a rebuild
+        with requests_mock.Mocker() as m:
+            m.post('http://backend:5000/api/v1/backend/admin/webhooks/update-book', json={})
+            self.client.post('/api/v1/frontend/borrow/s1', json={'days': 7})
+        index._next_check = 0
+        with mock.patch.object(index, 'rebuild') as rebuild:
+            index.refresh_if_stale()
+        rebuild.assert_not_called()
+
+    def test_query_cache_is_invalidated_by_writes(self):
+        cache = QueryCache(self.app.extensions['table_versions'], max_entries=10, ttl=60)
+        self.app.extensions['query_cache'] = cache
+        try:
+            Book(id='cached', title='Cached', publisher='P', category='C').save()
+            db.session.remove()
+
+            self.assertEqual([book.id for book in Book.get_all({'is_available': True})], ['cached'])
+            self.assertEqual(Book.get_first(id='cached').title, 'Cached')
+            db.session.remove()
+            cached = Book.get_all({'is_available': True})[0]
+            self.assertEqual(cached.title, 'Cached')
+            self.assertEqual(cache.stats()['hits'], 1)
+            # A cached row comes back as a clean persistent instance that can be written
+            self.assertIs(Book.get_by_id('cached'), cached)
+            self.assertFalse(db.session.dirty)
+            cached.title = 'Renamed'
+            cached.save()
+            db.session.remove()
+            self.assertEqual(Book.get_first(id='cached').title, 'Renamed')
+
+            Book.update_where({'is_available': False}, id='cached')
+            db.session.remove()
+            self.assertEqual(Book.get_all({'is_available': True}), [])
+        finally:
+            del self.app.extensions['query_cache']
+
+    def test_borrow_book_trace_propagates_to_backend_webhook(self):
+        spans = []
+        self.app.extensions['tracer'] = Tracer(1.0, type('Collector', (), {'on_end': staticmethod(spans.append)}))
+        try:
+            book = Book(title='Traced Book', publisher='Wiley', category='Drama')
+            book.save()
+            with requests_mock.Mocker() as m:
+                m.post('http://backend:5000/api/v1/backend/admin/webhooks/update-book', json={}, status_code=200)
+                response = self.client.post(f'/api/v1/frontend/borrow/{book.id}', json={'days': 7})
+                traceparent = m.last_request.headers['traceparent']
+        finally:
+            del self.app.extensions['tracer']
+
+        self.assertEqual(response.status_code, 200)
+        request_span = next(span for span in spans if span.name == 'POST /api/v1/frontend/borrow/<string:book_id>')
+        peer_span = next(span for span in spans if span.name.startswith('POST /api/v1/backend'))
+        sql_spans = [span for span in spans if span.attributes.get('db.statement')]
+        self.assertEqual(traceparent, f'00-{request_span.trace_id}-{peer_span.span_id}-01')
+        self.assertEqual(peer_span.parent_id, request_span.span_id)
+        self.assertTrue(sql_spans and all(span.parent_id == request_span.span_id for span in sql_spans))
+
+    def test_memory_report_tracks_routes_and_session_leaks(self):
+        self.app.extensions['memory_monitor'] = MemoryMonitor(top_n=5)
+        self.app.config['DEBUG_ADMIN_TOKEN'] = 'secret'
+        try:
+            self.client.get('/api/v1/frontend/books')
+            # The test shares one app context, so this book is still in the session of the next request
+            book = Book(title='Kept Book', publisher='Wiley', category='Drama')
+            book.save()
+            self.client.get('/api/v1/frontend/books')
+
+            self.assertEqual(self.client.get('/debug/memory').status_code, 403)
+            report = self.client.get('/debug/memory?snapshot=1', headers={'X-Admin-Token': 'secret'}).json
+            stats = report['routes']['frontend_views.list_books']
+            self.assertEqual(stats['requests'], 2)
+            self.assertEqual(stats['leaked_requests'], 1)
+            self.assertGreaterEqual(stats['identity_map_max'], 1)
+            self.assertGreater(stats['peak_bytes_max'], 0)
+            self.assertEqual(len(report['snapshots'][0]['top']), 5)
+
+            metrics = self.client.get('/debug/memory/metrics', headers={'Authorization': 'Bearer secret'})
+            self.assertIn('session_leaked_requests_total{endpoint="frontend_views.list_books"} 1',
+                          metrics.get_data(as_text=True))
+        finally:
+            del self.app.extensions['memory_monitor']
+            self.app.config['DEBUG_ADMIN_TOKEN'] = None
+            tracemalloc.stop()
+
+    def test_readiness_flips_after_warmup(self):
+        warmup = self.app.extensions['warmup']
+        self.assertEqual(self.client.get('/healthz').json, {'status': 'ok'})
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        try:
+            Book(title='Warm Book', publisher='Wiley', category='Drama').save()
+            with requests_mock.Mocker() as m:
+                m.get('http://backend:5000/healthz', json={'status': 'ok'})
+                warmup.run()
+            response = self.client.get('/readyz')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['status'], 'ready')
+            self.assertTrue(all(step['ok'] for step in response.json['steps'].values()))
+            self.assertIn('GET /api/v1/frontend/books', response.json['steps'])
+        finally:
+            warmup.state, warmup.results = 'pending', {}
+
+    def test_add_books_webhook_accepts_msgpack_with_native_timestamps(self):
+        created = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+        body, content_type = encode_payload({'books': [
+            {'id': 'mp1', 'title': 'Packed', 'publisher': 'P', 'category': 'C', 'created_at': created},
+        ]}, msgpack=True)
+        self.assertEqual(msgspec.msgpack.decode(body)['books'][0]['created_at'], created)  # timestamp extension
+        response = self.client.post('/api/v1/frontend/webhooks/add-books', data=body, content_type=content_type)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Book.get_first(id='mp1').created_at, datetime(2024, 5, 1, 12, 30))
+
+        # Aware times are stored as naive UTC, whatever their offset, single or in lists
+        response = self.client.post('/api/v1/frontend/webhooks/add-book', json={'book_data': {
+            'id': 'mp2', 'title': 'Offset', 'publisher': 'P', 'category': 'C',
+            'created_at': '2024-05-01T14:30:00+02:00'}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Book.get_first(id='mp2').created_at, datetime(2024, 5, 1, 12, 30))
+        update = msgspec.json.decode(b'{"book_id": "mp2", "is_available": false, '
+                                     b'"borrowed_at": ["2024-05-01T12:30:00Z", "2024-05-01T14:30:00+02:00"]}',
+                                     type=BookUpdate)
+        self.assertEqual(update.borrowed_at, [datetime(2024, 5, 1, 12, 30)] * 2)
+
+        body, content_type = encode_payload({'books': [{'title': 'No id', 'created_at': 'yesterday'}]}, msgpack=True)
+        response = self.client.post('/api/v1/frontend/webhooks/add-books', data=body, content_type=content_type)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json['errors']), {'books[0].id', 'books[0].created_at'})
+
+        self.app.config['PEER_WIRE_FORMAT'] = 'msgpack'
+        try:
+            book = Book(title='Packed Loan', publisher='Wiley', category='Drama')
+            book.save()
+            with requests_mock.Mocker() as m:
+                m.post('http://backend:5000/api/v1/backend/admin/webhooks/update-book', json={}, status_code=200)
+                self.client.post(f'/api/v1/frontend/borrow/{book.id}', json={'days': 7})
+                sent = m.last_request
+        finally:
+            self.app.config['PEER_WIRE_FORMAT'] = 'json'
+        self.assertEqual(sent.headers['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgspec.msgpack.decode(sent.body)['occurred_at'].tzinfo, timezone.utc)
+
+    def test_update_coalescer_merges_churn_per_book(self):
+        coalescer = UpdateCoalescer(self.app, window=60, max_batch=500)
+        self.app.extensions['update_coalescer'] = coalescer
+        popular = Book(title='Popular', publisher='Wiley', category='Drama', is_available=True)
+        quiet = Book(title='Quiet', publisher='Wiley', category='Drama', is_available=True)
+        popular.save()
+        quiet.save()
+        try:
+            for path in ('borrow', 'return', 'borrow'):
+                response = self.client.post(f'/api/v1/frontend/{path}/{popular.id}', json={'days': 7})
+                self.assertIn(b'backend update queued', response.data)
+            self.client.post(f'/api/v1/frontend/borrow/{quiet.id}', json={'days': 7})
+
+            url = 'http://backend:5000/api/v1/backend/admin/webhooks/update-books'
+            with requests_mock.Mocker() as m:
+                m.post(url, status_code=503, text='backend restarting')
+                with pytest.raises(Exception, match='backend restarting'):
+                    coalescer.flush()
+                # Updates made while the batch failed go in a batch of their own, after it
+                self.client.post(f'/api/v1/frontend/return/{quiet.id}')
+
+                m.post(url, json={'updated': 2, 'missing': []})
+                self.assertEqual(coalescer.flush(), 3)
+
+            self.assertEqual(m.call_count, 3)
+            failed, retried, newer = m.request_history
+            # The retry is the same batch under the same key, so the backend can replay it
+            self.assertEqual(retried.headers['Idempotency-Key'], failed.headers['Idempotency-Key'])
+            self.assertEqual(retried.json(), failed.json())
+            self.assertNotEqual(newer.headers['Idempotency-Key'], failed.headers['Idempotency-Key'])
+            updates = {update['book_id']: update for update in retried.json()['updates']}
+            self.assertFalse(updates[popular.id]['is_available'])
+            self.assertEqual((len(updates[popular.id]['borrowed_at']), len(updates[popular.id]['returned_at'])), (2, 1))
+            self.assertFalse(updates[quiet.id]['is_available'])
+            self.assertEqual([update['book_id'] for update in newer.json()['updates']], [quiet.id])
+            self.assertTrue(newer.json()['updates'][0]['is_available'])
+            self.assertTrue(newer.json()['updates'][0]['returned_at'][0].endswith('Z'))
+            self.app.config['DEBUG_ADMIN_TOKEN'] = 'secret'
+            self.assertEqual(self.client.get('/debug/update-coalescer').status_code, 403)
+            self.assertEqual(self.client.get('/debug/update-coalescer', headers={'X-Admin-Token': 'secret'}).json, {
+                'window': 60, 'pending': 0, 'retrying': 0, 'sent_batches': 2, 'sent_updates': 3,
+                'merged_updates': 2, 'failed_batches': 1, 'rejected_batches': 0, 'dropped_batches': 0})
+
+            # What is still queued when the process exits is flushed, not dropped
+            self.client.post(f'/api/v1/frontend/borrow/{quiet.id}', json={'days': 7})
+            with requests_mock.Mocker() as m:
+                m.post(url, json={'updated': 1, 'missing': []})
+                coalescer.close()
+            self.assertEqual([update['book_id'] for update in m.last_request.json()['updates']], [quiet.id])
+        finally:
+            self.app.config['DEBUG_ADMIN_TOKEN'] = None
+            coalescer.stop()
+
+    def test_update_coalescer_sets_refused_batches_aside_and_caps_retries(self):
+        coalescer = UpdateCoalescer(self.app, window=60, max_batch=1, max_retrying=2)
+        occurred_at = datetime.utcnow()
+        url = 'http://backend:5000/api/v1/backend/admin/webhooks/update-books'
+        try:
+            coalescer.submit('invalid', False, occurred_at)
+            coalescer.submit('valid', False, occurred_at)
+            with requests_mock.Mocker() as m:
+                # A 4xx is final: the batch becomes a dead letter and the next one still goes out
+                m.post(url, [{'status_code': 400, 'json': {'message': 'Invalid payload'}},
+                             {'json': {'updated': 1, 'missing': []}}])
+                self.assertEqual(coalescer.flush(), 1)
+            key, payload, reason = coalescer.dead_letters[0]
+            self.assertEqual([update['book_id'] for update in payload['updates']], ['invalid'])
+            self.assertIn('HTTP 400', reason)
+            self.assertEqual((coalescer.rejected_batches, coalescer.retrying), (1, []))
+
+            # While the backend is down, only the newest `max_retrying` batches are kept
+            for book_id in ('first', 'second', 'third'):
+                coalescer.submit(book_id, False, occurred_at)
+            with requests_mock.Mocker() as m:
+                m.post(url, status_code=503, text='down')
+                with pytest.raises(Exception, match='HTTP 503'):
+                    coalescer.flush()
+            self.assertEqual([payload['updates'][0]['book_id'] for _, payload in coalescer.retrying],
+                             ['second', 'third'])
+            self.assertEqual(coalescer.dropped_batches, 1)
+        finally:
+            coalescer.stop()
+            coalescer.retrying.clear()  # nothing left for the flush at exit
+
+    def test_sharded_catalog_routes_by_id_and_merges_reads(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)  # runs after the finally below has disposed of the engines
+        shards = [create_engine(f'sqlite:///{directory.name}/shard_{index}.db') for index in range(3)]
+        create_shard_tables(shards, [Book])
+        self.app.extensions['shards'] = ShardRouter(shards)
+        try:
+            now = datetime.utcnow()
+            overdue = range(0, 12, 4)
+            saved = [Book(title=f'Saved {index:02d}', publisher='Wiley', category='Drama',
+                          is_available=index not in overdue,
+                          return_by=now - timedelta(days=index + 1) if index in overdue else None)
+                     for index in range(12)]
+            for book in saved:
+                book.save()
+            response = self.client.post('/api/v1/frontend/webhooks/add-books', json={'books': [
+                {'id': str(uuid.uuid4()), 'title': f'Imported {index:02d}', 'publisher': 'Wiley', 'category': 'Drama',
+                 'is_available': True} for index in range(6)]})
+            self.assertEqual(response.status_code, 200)
+
+            # Every row lives on the shard its id hashes to, and none on the primary
+            with db.engine.connect() as connection:
+                self.assertEqual(connection.execute(text('SELECT COUNT(*) FROM books')).scalar(), 0)
+            placed = 0
+            for number, engine in enumerate(shards):
+                with engine.connect() as connection:
+                    ids = [row[0] for row in connection.execute(text('SELECT id FROM books'))]
+                self.assertTrue(ids)
+                self.assertTrue(all(shard_index(book_id, len(shards)) == number for book_id in ids))
+                placed += len(ids)
+            self.assertEqual(placed, 18)
+
+            # Scatter-gather reads come back merged in title order
+            titles = [book['title'] for book in self.client.get('/api/v1/frontend/books').json]
+            self.assertEqual(titles, sorted(titles))
+            self.assertEqual(len(titles), 15)
+            filtered = self.client.get('/api/v1/frontend/books/filter?publisher=Wiley').json
+            self.assertEqual([book['title'] for book in filtered], sorted(book['title'] for book in filtered))
+            self.assertEqual(len(filtered), 18)
+
+            # Reads and writes of one book go to its shard only
+            book = saved[1]
+            db.session.expunge_all()
+            self.assertEqual(self.client.get(f'/api/v1/frontend/book/{book.id}').json['title'], 'Saved 01')
+            with requests_mock.Mocker() as m:
+                m.post('http://backend:5000/api/v1/backend/admin/webhooks/update-book', json={})
+                self.assertEqual(self.client.post(f'/api/v1/frontend/borrow/{book.id}', json={'days': 7}).status_code,
+                                 200)
+                self.assertEqual(self.client.post(f'/api/v1/frontend/borrow/{book.id}', json={'days': 7}).status_code,
+                                 400)
+            with shards[shard_index(book.id, len(shards))].connect() as connection:
+                self.assertEqual(connection.execute(text('SELECT is_available FROM books WHERE id = :id'),
+                                                    {'id': book.id}).scalar(), 0)
+
+            # The overdue sweeper walks the shards in due order, batch by batch
+            sweeper = self.app.extensions['overdue_sweeper']
+            sweeper.batch_size = 2
+            with requests_mock.Mocker() as m:
+                m.post('http://backend:5000/api/v1/backend/admin/webhooks/overdue-books', json={})
+                self.assertEqual(sweeper.sweep_once(), 3)
+                due = [book['return_by'] for request in m.request_history for book in request.json()['books']]
+            self.assertEqual(due, sorted(due))
+
+            # Shards do not commit atomically together, so a cart must stay on one shard
+            by_shard = {number: [] for number in range(len(shards))}
+            while any(len(ids) < 2 for ids in by_shard.values()):
+                book_id = str(uuid.uuid4())
+                ids = by_shard[shard_index(book_id, len(shards))]
+                if len(ids) < 2:
+                    Book(id=book_id, title=f'Cart {book_id}', publisher='Wiley', category='Drama').save()
+                    ids.append(book_id)
+            spread = [ids[0] for ids in by_shard.values()]
+            response = self.client.post('/api/v1/frontend/borrow', json={'book_ids': spread, 'days': 7})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('different shards', response.json['message'])
+            self.assertTrue(all(Book.get_by_id(book_id).is_available for book_id in spread))
+            with requests_mock.Mocker() as m:
+                m.post('http://backend:5000/api/v1/backend/admin/webhooks/update-books', json={})
+                self.assertEqual(self.client.post('/api/v1/frontend/borrow',
+                                                  json={'book_ids': by_shard[0], 'days': 7}).status_code, 200)
+        finally:
+            del self.app.extensions['shards']
+            db.session.remove()
+            for engine in shards:
+                engine.dispose()
+
+    def test_checkout_claims_all_books_or_none_with_one_update(self):
+        books = [Book(title=f'Cart {index}', publisher='Wiley', category='Drama') for index in range(3)]
+        taken = Book(title='Taken', publisher='Wiley', category='Drama', is_available=False)
+        for book in books + [taken]:
+            book.save()
+        ids = [book.id for book in books]
+        url = 'http://backend:5000/api/v1/backend/admin/webhooks/update-books'
+        statements = []
+
+        def count_updates(conn, cursor, statement, *args):
+            if statement.startswith('UPDATE books'):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_updates)
+        try:
+            with requests_mock.Mocker() as m:
+                m.post(url, json={'updated': 3, 'missing': []})
+
+                response = self.client.post('/api/v1/frontend/borrow', json={'book_ids': ids + [taken.id], 'days': 7})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json['book_ids'], [taken.id])
+                response = self.client.post('/api/v1/frontend/borrow',
+                                            json={'book_ids': [ids[0], 'missing'], 'days': 7})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json['book_ids'], ['missing'])
+                db.session.expire_all()
+                self.assertTrue(all(db.session.get(Book, book_id).is_available for book_id in ids))
+                self.assertEqual(m.call_count, 0)
+
+                statements.clear()
+                response = self.client.post('/api/v1/frontend/borrow', json={'book_ids': ids + ids[:1], 'days': 7})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json['message'], 'Books borrowed successfully and backend updated')
+                self.assertEqual(response.json['book_ids'], ids)
+                self.assertEqual(len(statements), 1)
+                self.assertEqual(m.call_count, 1)
+                updates = m.last_request.json()['updates']
+                self.assertEqual([update['book_id'] for update in updates], ids)
+                self.assertTrue(all(not update['is_available'] and len(update['borrowed_at']) == 1
+                                    for update in updates))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_updates)
+
+        db.session.expire_all()
+        self.assertEqual({db.session.get(Book, book_id).return_by for book_id in ids},
+                         {datetime.fromisoformat(response.json['return_by'])})
+        response = self.client.post('/api/v1/frontend/borrow', json={'book_ids': [], 'days': 7})
+        self.assertEqual(response.status_code, 400)
+
 if __name__ == '__main__':
     pytest.main()
\ No newline at end of file
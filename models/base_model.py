@@ -1,16 +1,34 @@
 #!/usr/bin/python3
 """models/base_model.py"""
 
-from datetime import datetime
-from sqlalchemy import Column, DateTime, String
+from datetime import datetime, timezone
+from flask import abort
+from sqlalchemy import Column, DateTime, String, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import make_transient_to_detached
 import uuid
 from config.base_database import db
+from config.query_cache import WRITTEN_TABLES, get_query_cache
+from config.read_replicas import reads_from_replica
+from config.sharding import get_shard_router, listen_for_new_instances, scatter_gather
+from config.unit_of_work import commit_or_defer, current_unit_of_work, rollback_or_defer
+
+def _sortable(value):
+    # NULLs sort first, as they do in SQLite and MySQL, and are never compared to values
+    return (value is not None, value)
+
 
 class BaseModel(db.Model):
     """Base model for other models."""
 
     __abstract__ = True  # Declares this as a base class for other models
 
+    # Opt a model in to the query cache used by get_all/get_first (when QUERY_CACHE_SIZE is set)
+    cache_queries = False
+
+    # Opt a model in to hash sharding by id across the 'shard_*' binds (when any are configured)
+    sharded = False
+
     # Define columns
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -20,26 +38,31 @@ class BaseModel(db.Model):
         """
         Save the current instance to the database.
 
-        Commits the changes to the database session.
+        Commits the changes to the database session. Inside a unit of work the
+        instance is only staged, and written with the unit's next batched flush.
         """
-        try:
-            db.session.add(self)
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            raise Exception(e)
+        self._stage(db.session.add)
 
     def delete(self):
         """
         Delete the current instance from the database.
 
-        Commits the changes to the database session.
+        Commits the changes to the database session. Inside a unit of work the
+        deletion is only staged, and written with the unit's next batched flush.
         """
+        self._stage(db.session.delete)
+
+    def _stage(self, operation):
+        session = db.session()
         try:
-            db.session.delete(self)
-            db.session.commit()
+            operation(self)
+            unit = current_unit_of_work(session)
+            if unit is None:
+                session.commit()
+            else:
+                unit.staged_change(session)
         except Exception as e:
-            db.session.rollback()
+            rollback_or_defer(session)
             raise Exception(e)
     
     def to_dict(self, fields=None):
@@ -60,6 +83,79 @@ class BaseModel(db.Model):
                 data[column.name] = value
         return data
     
+    def to_payload(self, fields=None):
+        """
+        Convert the model instance to a dictionary for a peer service, like to_dict().
+
+        Datetimes are kept as timezone-aware UTC datetimes instead of strings, so the
+        wire format can encode them natively.
+
+        :param fields: Optional list of fields to include in the dictionary
+        :return: Dictionary of column values
+        """
+        data = {}
+        for column in self.__table__.columns:
+            if fields and column.name not in fields:
+                continue
+            value = getattr(self, column.name)
+            data[column.name] = value.replace(tzinfo=timezone.utc) if isinstance(value, datetime) else value
+        return data
+
+    @classmethod
+    def shard_binds(cls, key=None):
+        """
+        Get the session bind arguments of the databases a statement on this model runs on.
+
+        :param key: Optional row id; a sharded model's statement then only runs on the shard holding it
+        :return: List of bind_arguments dictionaries: one per shard to query for a sharded model,
+            a single empty one otherwise
+        """
+        router = get_shard_router() if cls.sharded else None
+        return router.bind_arguments(key) if router is not None else [{}]
+
+    @classmethod
+    def shard_count(cls, ids):
+        """
+        Count the databases holding the rows with the given ids.
+
+        :param ids: Row ids
+        :return: Number of shards the ids hash to, or 1 if the model is not sharded
+        """
+        router = get_shard_router() if cls.sharded else None
+        return len({router.engine_for(ident) for ident in ids}) if router is not None and ids else 1
+
+    @classmethod
+    def scatter(cls, stmt, key=None, order_by=None, limit=None):
+        """
+        Run a SELECT on the model's rows, gathering them from every shard of a sharded model.
+
+        :param stmt: SELECT statement
+        :param key: Optional row id the statement is limited to, to query its shard only
+        :param order_by: Optional sort key of a result row matching the statement's ORDER BY,
+            to merge the shards' rows in order
+        :param limit: Optional maximum number of rows, matching the statement's LIMIT
+        :return: List of rows
+        """
+        return scatter_gather(db.session, stmt, cls.shard_binds(key), order_by, limit)
+
+    @classmethod
+    def get_by_id(cls, ident):
+        """
+        Get an instance by primary key, from the shard holding it for a sharded model.
+
+        :param ident: Primary key
+        :return: The instance, or None if not found
+        """
+        return db.session.get(cls, ident, bind_arguments=cls.shard_binds(ident)[0])
+
+    @classmethod
+    def get_or_404(cls, ident):
+        """Like get_by_id(), but abort with 404 Not Found if there is no such instance."""
+        instance = cls.get_by_id(ident)
+        if instance is None:
+            abort(404)
+        return instance
+
     @classmethod
     def get_first(cls, **kwargs):
         """
@@ -69,21 +165,277 @@ class BaseModel(db.Model):
         :return: The first instance of the model matching the filter criteria, or None if not found
         """
         try:
-            return db.session.query(cls).filter_by(**kwargs).first()
+            cached = cls._cached_query(kwargs, limit=1)
+            if cached is not None:
+                return cached[0] if cached else None
+            rows = cls.scatter(select(cls).filter_by(**kwargs).limit(1), key=kwargs.get('id'), limit=1)
+            return rows[0][0] if rows else None
         except Exception as e:
             raise Exception(e)
         
     @classmethod
-    def get_all(cls, filters=None):
+    def get_all(cls, filters=None, order_by=None):
         """
         Get all instances of the model.
 
+        :param filters: Optional filter criteria
+        :param order_by: Optional list of column names to sort by; rows of a sharded model are
+            then merged from the shards in this order
         :return: List of all instances of the model
         """
         try:
-            query = db.session.query(cls)
-            if filters:
-                query = query.filter_by(**filters)
-            return query.all()
+            cached = cls._cached_query(filters or {}, order_by=order_by)
+            if cached is not None:
+                return cached
+            stmt = select(cls).filter_by(**(filters or {}))
+            sort_key = None
+            if order_by:
+                stmt = stmt.order_by(*(cls.__table__.c[name] for name in order_by))
+                sort_key = lambda row: tuple(_sortable(getattr(row[0], name)) for name in order_by)
+            return [row[0] for row in cls.scatter(stmt, key=(filters or {}).get('id'), order_by=sort_key)]
+        except Exception as e:
+            raise Exception(e)
+
+    @classmethod
+    def _cached_query(cls, filters, limit=None, order_by=None):
+        """
+        Run a filter_by query through the query cache.
+
+        Results are cached as plain column values, keyed by model, filters, limit, the
+        loaded columns and whether the read may go to a replica (so clients pinned to
+        the primary never see replica rows), and served while the table's version is
+        unchanged. The cache is bypassed while the session holds writes that are not
+        committed yet, so a session always reads its own writes.
+
+        :return: List of instances, or None if the query cannot use the cache
+        """
+        cache = get_query_cache() if cls.cache_queries else None
+        if cache is None:
+            return None
+        session = db.session()
+        if session.new or session.dirty or session.deleted or session.info.get(WRITTEN_TABLES):
+            return None
+
+        attrs = cls.__mapper__.column_attrs
+        key = (cls.__name__, tuple(sorted(filters.items())), limit, tuple(order_by or ()),
+               tuple(attr.key for attr in attrs), reads_from_replica())
+        try:
+            hash(key)
+        except TypeError:  # unhashable filter value
+            return None
+
+        table = cls.__table__.name
+        rows = cache.get(key, table)
+        if rows is None:
+            version = cache.versions.get(table)
+            stmt = select(*(attr.columns[0] for attr in attrs)).filter_by(**filters)
+            sort_key = None
+            if order_by:
+                stmt = stmt.order_by(*(cls.__table__.c[name] for name in order_by))
+                positions = [[attr.key for attr in attrs].index(name) for name in order_by]
+                sort_key = lambda row: tuple(_sortable(row[position]) for position in positions)
+            if limit is not None:
+                stmt = stmt.limit(limit)
+            rows = [tuple(row) for row in cls.scatter(stmt, key=filters.get('id'), order_by=sort_key, limit=limit)]
+            cache.put(key, version, rows)
+        return cls._from_rows(session, [attr.key for attr in attrs], rows)
+
+    @classmethod
+    def _from_rows(cls, session, keys, rows):
+        """
+        Turn cached column values into persistent instances of the session.
+
+        Instances already in the identity map are returned as they are; new ones are
+        built detached, as if loaded by a query, and added to the session without a
+        SELECT or a pending change.
+        """
+        mapper = cls.__mapper__
+        pk_positions = [keys.index(mapper.get_property_by_column(column).key) for column in mapper.primary_key]
+        instances = []
+        for row in rows:
+            identity = mapper.identity_key_from_primary_key([row[position] for position in pk_positions])
+            instance = session.identity_map.get(identity)
+            if instance is None:
+                instance = cls(**dict(zip(keys, row)))
+                make_transient_to_detached(instance)
+                session.add(instance)
+            instances.append(instance)
+        return instances
+
+    @classmethod
+    def update_where(cls, values, **filters):
+        """
+        Atomically update the rows matching the filter criteria with a single UPDATE statement.
+
+        Because the criteria are part of the statement, a state check such as
+        ``is_available=True`` cannot race with a concurrent update. A list of values
+        matches any of them, so a whole set of rows is updated set-based. For a sharded
+        model the statement runs on the shards holding the filtered ``id``s, or on every shard.
+
+        Inside a unit of work the commit is left to the unit.
+
+        :param values: Dictionary of column values to set
+        :param filters: Filter criteria the rows must match at update time; list values match any of their items
+        :return: Number of rows updated
+        """
+        values = dict(values)
+        values.setdefault('updated_at', datetime.utcnow())
+        try:
+            updated = 0
+            for bind_arguments, shard_filters in cls._filters_by_shard(filters):
+                columns = cls.__table__.c
+                stmt = (update(cls)
+                        .where(*(columns[name].in_(value) if isinstance(value, list) else columns[name] == value
+                                 for name, value in shard_filters.items()))
+                        .values(values).execution_options(synchronize_session=False))
+                updated += db.session.execute(stmt, bind_arguments=bind_arguments).rowcount
+            commit_or_defer()
+            return updated
+        except Exception as e:
+            rollback_or_defer()
+            raise Exception(e)
+
+    @classmethod
+    def upsert(cls, values, update_fields=None):
+        """
+        Insert a row, or update it in place if the primary key already exists.
+
+        Issues a single INSERT ... ON CONFLICT statement on SQLite/PostgreSQL and
+        INSERT ... ON DUPLICATE KEY UPDATE on MySQL, so replaying the same payload
+        is idempotent. Keys that are not columns of the table are ignored.
+
+        :param values: Dictionary of column values, including the primary key
+        :param update_fields: Optional list of columns to overwrite on conflict (defaults to all given)
+        """
+        cls.upsert_many([values], update_fields=update_fields)
+
+    @classmethod
+    def upsert_many(cls, rows, update_fields=None):
+        """
+        Insert or update many rows in one transaction, like upsert().
+
+        Rows are grouped by shard (for a sharded model) and by the set of columns they
+        provide, and each group is sent as a single executemany. Inside a unit of work
+        the commit is left to the unit.
+
+        :param rows: Iterable of dictionaries of column values, including the primary key
+        :param update_fields: Optional list of columns to overwrite on conflict (defaults to all given)
+        """
+        table = cls.__table__
+        now = datetime.utcnow()
+        groups = {}
+        for values in rows:
+            values = {key: value for key, value in values.items() if key in table.columns}
+            if update_fields is None or update_fields:
+                values.setdefault('updated_at', now)
+            shard = cls._shard_of(values)
+            groups.setdefault((shard, tuple(sorted(values))), []).append(values)
+
+        try:
+            for (shard, columns), group in groups.items():
+                bind_arguments = cls.shard_binds(shard)[0] if shard is not None else {}
+                dialect = db.session.get_bind(mapper=cls, **bind_arguments).dialect.name
+                if update_fields is None:
+                    fields = [key for key in columns if key not in ('id', 'created_at')]
+                else:
+                    # Only columns the rows provide, so a partial payload never blanks the others
+                    fields = [key for key in update_fields if key in columns]
+                    if fields and 'updated_at' not in fields:
+                        fields.append('updated_at')
+
+                if dialect in ('sqlite', 'postgresql'):
+                    insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+                    stmt = insert(table)
+                    if fields:
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=[table.c.id],
+                            set_={key: stmt.excluded[key] for key in fields},
+                        )
+                    else:
+                        stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.id])
+                elif dialect == 'mysql':
+                    stmt = mysql.insert(table)
+                    fields = fields or ['id']
+                    stmt = stmt.on_duplicate_key_update({key: stmt.inserted[key] for key in fields})
+                else:
+                    for values in group:
+                        db.session.merge(cls(**values))
+                    continue
+                db.session.execute(stmt, group, bind_arguments=bind_arguments)
+            commit_or_defer()
+        except Exception as e:
+            rollback_or_defer()
+            raise Exception(e)
+
+    @classmethod
+    def _filters_by_shard(cls, filters):
+        """
+        Split filter criteria per shard, into (bind_arguments, filters) for every shard a statement must run on.
+
+        A list of ids is split, so each shard only gets the ids it holds.
+        """
+        ids = filters.get('id')
+        router = get_shard_router() if cls.sharded else None
+        if router is None:
+            return [({}, filters)]
+        if not isinstance(ids, list):
+            return [(bind_arguments, filters) for bind_arguments in router.bind_arguments(ids)]
+        by_shard = {}
+        for ident in ids:
+            by_shard.setdefault(router.engine_for(ident), []).append(ident)
+        return [({'bind': engine}, dict(filters, id=shard_ids)) for engine, shard_ids in by_shard.items()]
+
+    @classmethod
+    def _shard_of(cls, values):
+        """The id that routes a row of a sharded model to its shard, or None if the model is not sharded."""
+        return values.get('id') if cls.sharded and get_shard_router() is not None else None
+
+    @classmethod
+    def increment_many(cls, rows, counters):
+        """
+        Add to counter columns of many rows, inserting the rows that do not exist yet.
+
+        Like upsert_many(), but on conflict the given counters are added to the stored
+        values instead of replacing them, in the same single statement, so concurrent
+        increments of one row are never lost.
+
+        :param rows: List of dictionaries of column values, including the primary key and the counters
+        :param counters: Names of the counter columns to add on conflict
+        """
+        table = cls.__table__
+        now = datetime.utcnow()
+        rows = [dict(values, updated_at=now) for values in rows]
+        if not rows:
+            return
+
+        try:
+            dialect = db.session.get_bind(mapper=cls).dialect.name
+            if dialect in ('sqlite', 'postgresql'):
+                insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+                stmt = insert(table)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.id],
+                    set_=dict({key: table.c[key] + stmt.excluded[key] for key in counters},
+                              updated_at=stmt.excluded.updated_at),
+                )
+                db.session.execute(stmt, rows)
+            elif dialect == 'mysql':
+                stmt = mysql.insert(table)
+                stmt = stmt.on_duplicate_key_update(dict(
+                    {key: table.c[key] + stmt.inserted[key] for key in counters},
+                    updated_at=stmt.inserted.updated_at))
+                db.session.execute(stmt, rows)
+            else:
+                for values in rows:
+                    updated = db.session.execute(
+                        table.update().where(table.c.id == values['id'])
+                        .values({key: table.c[key] + values[key] for key in counters}, updated_at=now))
+                    if not updated.rowcount:
+                        db.session.execute(table.insert().values(values))
+            commit_or_defer()
         except Exception as e:
+            rollback_or_defer()
             raise Exception(e)
+
+
+listen_for_new_instances(BaseModel)
@@ -1,16 +1,20 @@
 from models.base_model import BaseModel
 from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
 from sqlalchemy.orm import relationship
+from config.query_cache import get_table_versions
 
 class Book(BaseModel):
     __tablename__ = 'books'
 
-    title = Column(String(255), nullable=False)
+    cache_queries = True  # read far more often than written
+    sharded = True  # spread across the shard databases by id, when they are configured
+
+    title = Column(String(255), nullable=False, index=True)
     publisher = Column(String(255), nullable=False)
     category = Column(String(100), nullable=False)
     is_available = Column(Boolean, default=True)
     borrowed_at = Column(DateTime, default=None)
-    return_by = Column(DateTime, default=None)
+    return_by = Column(DateTime, default=None, index=True)  # used by the overdue sweeper
     borrowed_by_id = Column(Integer, ForeignKey('users.id'))
 
     # Define a relationship with User
@@ -19,6 +23,19 @@ class Book(BaseModel):
     def __repr__(self):
         return f'<Book {self.title}>'
 
+    @classmethod
+    def catalog_version(cls):
+        """
+        Get a version of the catalog that changes whenever a book is added, updated or removed.
+
+        Reads the ``books`` counter of the table version store, which every flush, bulk
+        statement and commit touching the table bumps, without querying the database.
+        The default store is shared by the workers of a host.
+
+        :return: Version number
+        """
+        return get_table_versions().get(cls.__tablename__)
+
     def to_dict(self, fields=None):
         """
         Convert the book instance to a dictionary, including only the specified fields if provided.
@@ -0,0 +1,64 @@
+from collections import defaultdict
+from datetime import datetime
+from models.base_model import BaseModel, db
+from models.borrow_rollup import advance_windows, record_borrows
+from config.unit_of_work import unit_of_work
+from sqlalchemy import Column, DateTime, Index, String
+
+BORROW, RETURN = 'borrow', 'return'
+
+
+class BorrowEvent(BaseModel):
+    """Append-only history of borrows and returns; rows are never updated or deleted."""
+    __tablename__ = 'borrow_events'
+    __table_args__ = (
+        Index('ix_borrow_events_book_occurred', 'book_id', 'occurred_at'),
+        Index('ix_borrow_events_occurred', 'occurred_at'),
+    )
+
+    book_id = Column(String(36), nullable=False)
+    event_type = Column(String(10), nullable=False)
+    occurred_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<BorrowEvent {self.event_type} {self.book_id}>'
+
+    @classmethod
+    def record(cls, book_ids, event_type, occurred_at=None):
+        """
+        Append events for books, and count borrows in the popularity rollups.
+
+        The events and the rollup updates are written together, in a savepoint when
+        called inside a unit of work.
+
+        :param book_ids: IDs of the books borrowed or returned
+        :param event_type: BORROW or RETURN
+        :param occurred_at: Time of the borrow or return, defaults to now
+        """
+        occurred_at = occurred_at or datetime.utcnow()
+        cls.record_many([(book_id, event_type, occurred_at) for book_id in book_ids])
+
+    @classmethod
+    def record_many(cls, events):
+        """
+        Append a batch of events with one INSERT, and count its borrows in the popularity rollups.
+
+        Like record(), but each event has its own type and time.
+
+        :param events: List of (book_id, event_type, occurred_at)
+        """
+        if not events:
+            return
+        now = datetime.utcnow()
+        borrows_by_day = defaultdict(list)
+        for book_id, event_type, occurred_at in events:
+            if event_type == BORROW:
+                borrows_by_day[occurred_at.date()].append(book_id)
+        with unit_of_work():
+            db.session.execute(cls.__table__.insert(), [
+                {'book_id': book_id, 'event_type': event_type, 'occurred_at': occurred_at}
+                for book_id, event_type, occurred_at in events])
+            if borrows_by_day:
+                advance_windows(now.date())
+                for day, book_ids in borrows_by_day.items():
+                    record_borrows(book_ids, day, now.date())
@@ -0,0 +1,127 @@
+import uuid
+from collections import Counter
+from datetime import timedelta
+from models.base_model import BaseModel, db
+from sqlalchemy import Column, Date, Index, Integer, String, bindparam, delete, func, select, update
+
+# Popularity windows served by the stats endpoint, in days
+WINDOWS = {'1d': 1, '7d': 7, '30d': 30}
+
+# Rollup rows have deterministic IDs so increments of the same bucket meet on the primary key
+_ROLLUP_NAMESPACE = uuid.UUID('5b0b8f0e-8f55-4c43-9a36-0f1b5e1f3c7a')
+
+
+def rollup_id(*parts):
+    return str(uuid.uuid5(_ROLLUP_NAMESPACE, ':'.join(str(part) for part in parts)))
+
+
+class DailyBorrowCount(BaseModel):
+    """Borrows of one book on one (UTC) day."""
+    __tablename__ = 'daily_borrow_counts'
+    __table_args__ = (
+        Index('ix_daily_borrow_counts_day', 'day', 'book_id'),
+    )
+
+    day = Column(Date, nullable=False)
+    book_id = Column(String(36), nullable=False)
+    borrows = Column(Integer, nullable=False, default=0)
+
+
+class WindowBorrowCount(BaseModel):
+    """Borrows of one book over the last `window_days` days, kept up to date incrementally."""
+    __tablename__ = 'window_borrow_counts'
+    __table_args__ = (
+        Index('ix_window_borrow_counts_top', 'window_days', 'borrows', 'book_id'),  # top-K is an index range scan
+    )
+
+    window_days = Column(Integer, nullable=False)
+    book_id = Column(String(36), nullable=False)
+    borrows = Column(Integer, nullable=False, default=0)
+
+
+class RollupWatermark(BaseModel):
+    """The last day a window was advanced to; its counts cover the days after `through_day - window_days`."""
+    __tablename__ = 'borrow_rollup_watermarks'
+
+    window_days = Column(Integer, nullable=False, unique=True)
+    through_day = Column(Date, nullable=False)
+
+
+def advance_windows(today):
+    """
+    Move every window forward to `today`, subtracting the daily buckets that fell out of it.
+
+    Each daily bucket is added to a window once and subtracted once, so keeping the
+    windows current costs work proportional to the new buckets, not to the history.
+    The watermark is moved with a conditional UPDATE in the same transaction as the
+    subtraction, so two workers advancing at once cannot subtract a day twice.
+
+    :param today: Current day
+    """
+    marks = db.session.execute(select(RollupWatermark.window_days, RollupWatermark.through_day)).all()
+    if len(marks) < len(WINDOWS):
+        # First use: start the missing windows empty, as of today
+        RollupWatermark.upsert_many([{'id': rollup_id('watermark', days), 'window_days': days, 'through_day': today}
+                                     for days in WINDOWS.values()], update_fields=[])
+        marks = db.session.execute(select(RollupWatermark.window_days, RollupWatermark.through_day)).all()
+    daily, windows = DailyBorrowCount.__table__, WindowBorrowCount.__table__
+    for days, through in marks:
+        if through >= today:
+            continue
+        claimed = db.session.execute(
+            update(RollupWatermark.__table__)
+            .where(RollupWatermark.window_days == days, RollupWatermark.through_day == through)
+            .values(through_day=today)).rowcount
+        if not claimed:
+            continue
+
+        first_expired, last_expired = through - timedelta(days=days), today - timedelta(days=days)
+        if last_expired >= through:
+            # Every counted day fell out of the window
+            db.session.execute(delete(windows).where(windows.c.window_days == days))
+            continue
+        expired = db.session.execute(
+            select(daily.c.book_id, func.sum(daily.c.borrows))
+            .where(daily.c.day > first_expired, daily.c.day <= last_expired)
+            .group_by(daily.c.book_id)).all()
+        if expired:
+            db.session.execute(
+                update(windows).where(windows.c.id == bindparam('window_id'))
+                .values(borrows=windows.c.borrows - bindparam('expired')),
+                [{'window_id': rollup_id('window', days, book_id), 'expired': borrows}
+                 for book_id, borrows in expired])
+            db.session.execute(delete(windows).where(windows.c.window_days == days, windows.c.borrows <= 0))
+
+
+def record_borrows(book_ids, day, today):
+    """
+    Count borrows in the daily buckets and in every window that includes `day`.
+
+    :param book_ids: IDs of the borrowed books
+    :param day: Day the books were borrowed
+    :param today: Current day, the windows must already be advanced to it
+    """
+    counts = Counter(book_ids)  # one row per book, as a multi-row upsert may not touch a row twice
+    DailyBorrowCount.increment_many(
+        [{'id': rollup_id('daily', day, book_id), 'day': day, 'book_id': book_id, 'borrows': borrows}
+         for book_id, borrows in counts.items()], ['borrows'])
+    WindowBorrowCount.increment_many(
+        [{'id': rollup_id('window', days, book_id), 'window_days': days, 'book_id': book_id, 'borrows': borrows}
+         for days in WINDOWS.values() if day > today - timedelta(days=days)
+         for book_id, borrows in counts.items()], ['borrows'])
+
+
+def top_books(window_days, limit):
+    """
+    Get the most borrowed books of a window from its maintained counts.
+
+    :param window_days: Window length in days, one of WINDOWS
+    :param limit: Number of books to return
+    :return: List of (book_id, borrows) pairs, most borrowed first
+    """
+    windows = WindowBorrowCount.__table__
+    return db.session.execute(
+        select(windows.c.book_id, windows.c.borrows)
+        .where(windows.c.window_days == window_days)
+        .order_by(windows.c.borrows.desc(), windows.c.book_id.desc())
+        .limit(limit)).all()
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from models.base_model import BaseModel, db
+from config.unit_of_work import unit_of_work
+from sqlalchemy import Column, DateTime, Integer, String, Text
+from sqlalchemy.exc import IntegrityError
+
+
+class IdempotencyKey(BaseModel):
+    __tablename__ = 'idempotency_keys'
+
+    key = Column(String(255), unique=True, nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response_body = Column(Text)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key}>'
+
+    @classmethod
+    def get_active(cls, key):
+        """
+        Get the recorded response for a key that has not expired yet.
+
+        :param key: Idempotency key (scoped to the endpoint)
+        :return: The matching IdempotencyKey instance, or None
+        """
+        return db.session.query(cls).filter(cls.key == key, cls.expires_at > datetime.utcnow()).first()
+
+    @classmethod
+    def record(cls, key, status_code, response_body, ttl):
+        """
+        Record a processed key with its response, and purge expired keys.
+
+        A concurrent request that recorded the same key first wins; the duplicate is dropped.
+        Any other failure is logged as a warning and the key is not recorded, so a retry
+        would be processed again. Inside a unit of work the key is written in a savepoint and committed with the
+        handler's changes, so a failed insert does not undo them.
+
+        :param key: Idempotency key (scoped to the endpoint)
+        :param status_code: HTTP status code of the processed request
+        :param response_body: Response body of the processed request
+        :param ttl: Number of seconds the key is remembered for
+        """
+        now = datetime.utcnow()
+        try:
+            with unit_of_work():
+                db.session.query(cls).filter(cls.expires_at <= now).delete(synchronize_session=False)
+                db.session.add(cls(key=key, status_code=status_code, response_body=response_body,
+                                   expires_at=now + timedelta(seconds=ttl)))
+        except IntegrityError:
+            pass
+        except Exception as e:
+            current_app.logger.warning('Could not record idempotency key %s; a retry will be processed again: %s',
+                                       key, e, exc_info=True)
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+from models.base_model import BaseModel, db
+from sqlalchemy import Column, DateTime, String, or_, select, update
+
+# Where a sweep starts when it has never run
+SWEEP_EPOCH = datetime(1970, 1, 1)
+
+
+class SweepWatermark(BaseModel):
+    """
+    Progress of a periodic sweep, shared by every worker.
+
+    `swept_until` is the end of the last window reported successfully. A worker
+    sweeps only while it holds the lease in `claimed_until`, so one window is never
+    swept twice at once, and a restart resumes where the last sweep ended.
+    """
+    __tablename__ = 'sweep_watermarks'
+
+    name = Column(String(50), nullable=False, unique=True)
+    swept_until = Column(DateTime, nullable=False)
+    claimed_until = Column(DateTime, default=None)
+
+    @classmethod
+    def claim(cls, name, now, lease_seconds):
+        """
+        Take the lease of a sweep with a conditional UPDATE.
+
+        :param name: Name of the sweep
+        :param now: Current time
+        :param lease_seconds: How long the lease holds if its holder never releases it
+        :return: The start of the window to sweep, or None if another worker holds the lease
+        """
+        cls.upsert({'id': name, 'name': name, 'swept_until': SWEEP_EPOCH}, update_fields=[])
+        table = cls.__table__
+        claimed = db.session.execute(
+            update(table)
+            .where(table.c.name == name, or_(table.c.claimed_until.is_(None), table.c.claimed_until < now))
+            .values(claimed_until=now + timedelta(seconds=lease_seconds), updated_at=now)).rowcount
+        since = db.session.execute(select(table.c.swept_until).where(table.c.name == name)).scalar_one()
+        db.session.commit()
+        return since if claimed else None
+
+    @classmethod
+    def release(cls, name, swept_until=None):
+        """
+        Give the lease of a sweep back, moving its watermark if the sweep succeeded.
+
+        :param name: Name of the sweep
+        :param swept_until: End of the window reported, or None to keep the watermark
+        """
+        table = cls.__table__
+        values = {'claimed_until': None, 'updated_at': datetime.utcnow()}
+        if swept_until is not None:
+            values['swept_until'] = swept_until
+        db.session.execute(update(table).where(table.c.name == name).values(values))
+        db.session.commit()
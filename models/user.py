@@ -6,6 +6,8 @@ from sqlalchemy.orm import relationship
 class User(BaseModel):
     __tablename__ = 'users'
 
+    cache_queries = True  # read far more often than written
+
     email = db.Column(db.String(120), unique=True, nullable=False)
     firstname = db.Column(db.String(50), nullable=False)
     lastname = db.Column(db.String(50), nullable=False)
@@ -25,6 +27,6 @@ class User(BaseModel):
         
         if include_books:
             # Include borrowed books' titles
-            data['is_available'] = [book.is_availabe for book in self.books] if self.books else []
+            data['is_available'] = [book.is_available for book in self.books] if self.books else []
         
         return data
\ No newline at end of file